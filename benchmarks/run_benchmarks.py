@@ -0,0 +1,336 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Benchmark each stage of ``run_application`` on synthetic images.
+
+Synthetic multi-channel TIFF files are generated for each image size and
+channel count, then the load, prepare, validate, predict and write stages
+are timed and memory-profiled. A stub application is used for ``predict``
+so the benchmarks run offline on CPU without TensorFlow.
+
+Results are saved as JSON and can be compared against a stored baseline:
+
+    python -m benchmarks.run_benchmarks --output results.json \\
+        --baseline benchmarks/baseline.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+import numpy as np
+import tifffile
+
+import deepcell_applications as dca
+
+
+PRESETS = {
+    'quick': {'sizes': [1024, 2048], 'channels': [2, 8]},
+    'full': {'sizes': [1024, 4096, 10240, 20480], 'channels': [2, 8, 40]},
+}
+
+STAGES = ('load', 'prepare', 'validate', 'predict', 'write')
+
+# metadata that must match for timings to be comparable, other metadata such
+# as the kernel build in ``platform`` differs between otherwise equal hosts
+HOST_KEYS = ('python', 'system', 'machine', 'cpu_count')
+
+logger = logging.getLogger(__name__)
+
+
+class StubApplication(object):
+    """A stand-in for ``deepcell.applications.Mesmer`` that runs on CPU.
+
+    ``predict`` thresholds the nuclear channel, so the benchmark measures
+    the pipeline around the model rather than the model itself.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.model_image_shape = (256, 256, 2)
+        self.required_channels = 2
+        self.logger = logging.getLogger(self.__class__.__name__)
+
+    def predict(self, image, **kwargs):
+        labels = image[..., 0:1] > image[..., 0:1].mean()
+        return labels.astype('int64')
+
+
+def generate_image(path, size, channels, compression=None, seed=0):
+    """Write a random ``(channels, size, size)`` uint16 TIFF file."""
+    rng = np.random.RandomState(seed)
+    with tifffile.TiffWriter(path, bigtiff=size * size * channels * 2 > 2 ** 31) as tif:
+        # write one channel at a time to bound memory use
+        for _ in range(channels):
+            tif.write(rng.randint(0, 2 ** 12, size=(size, size), dtype='uint16'),
+                      compression=compression, photometric='minisblack',
+                      contiguous=compression is None)
+
+
+def measure(func, repeat=1):
+    """Run ``func`` and return its result, fastest time and peak memory.
+
+    Peak memory is the largest amount of memory allocated by Python and
+    numpy while ``func`` runs, in megabytes.
+    """
+    seconds, peak = [], []
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = timeit.default_timer()
+        result = func()
+        seconds.append(timeit.default_timer() - start)
+        peak.append(tracemalloc.get_traced_memory()[1] / 2 ** 20)
+        tracemalloc.stop()
+    return result, {'seconds': min(seconds), 'peak_mb': min(peak)}
+
+
+def run_case(directory, size, channels, compression=None, repeat=1):
+    """Benchmark each stage of ``run_application`` on one synthetic image.
+
+    Args:
+        directory (str): Directory for the input and output files.
+        size (int): The height and width of the image.
+        channels (int): The number of channels in the image.
+        compression (str): Optional codec for the input file.
+        repeat (int): Number of times to run each stage.
+
+    Returns:
+        dict: The timing and memory of each stage.
+    """
+    path = os.path.join(directory, 'input_{}_{}.tif'.format(size, channels))
+    generate_image(path, size, channels, compression=compression)
+
+    app = StubApplication()
+    arg_dict = {
+        'app': 'mesmer',
+        'nuclear_path': path,
+        'nuclear_channel': [0],
+        'membrane_path': path,
+        'membrane_channel': list(range(1, min(channels, 3))),
+        'batch_size': 4,
+        'image_mpp': 0.5,
+        'compartment': 'whole-cell',
+        'squeeze': True,
+        'output_directory': directory,
+        'output_name': 'mask_{}_{}.tif'.format(size, channels),
+    }
+
+    results = {}
+
+    def load():
+        # load is part of prepare, but is timed alone to isolate decoding
+        nuclear = dca.io.load_image(path, channel=arg_dict['nuclear_channel'])
+        membrane = dca.io.load_image(path, channel=arg_dict['membrane_channel'])
+        return nuclear, membrane
+
+    _, results['load'] = measure(load, repeat=repeat)
+
+    image, results['prepare'] = measure(
+        lambda: dca.prepare.prepare_input(arg_dict['app'], **arg_dict),
+        repeat=repeat)
+
+    _, results['validate'] = measure(
+        lambda: dca.utils.validate_input(app, image[0]), repeat=repeat)
+
+    output, results['predict'] = measure(
+        lambda: dca.app_runners.predict_job(app, arg_dict, image), repeat=repeat)
+
+    outfile = dca.app_runners.get_output_path(arg_dict)
+
+    def write():
+        if os.path.exists(outfile):
+            os.remove(outfile)
+        dca.app_runners.save_job(app, arg_dict, output)
+
+    _, results['write'] = measure(write, repeat=repeat)
+
+    for stage in results.values():
+        stage['megapixels'] = size * size / 1e6
+
+    os.remove(path)
+    os.remove(outfile)
+    return results
+
+
+def get_metadata():
+    return {
+        'python': '{}.{}'.format(*sys.version_info[:2]),
+        'system': platform.system(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'tifffile': tifffile.__version__,
+    }
+
+
+def get_host_differences(metadata, baseline_metadata):
+    """Returns the host metadata that differs between two benchmark results.
+
+    Returns:
+        list: A ``key: new != baseline`` description of each difference.
+    """
+    return ['{}: {} != {}'.format(k, metadata.get(k), baseline_metadata.get(k))
+            for k in HOST_KEYS
+            if metadata.get(k) != baseline_metadata.get(k)]
+
+
+def compare(results, baseline, time_tolerance=0.25, memory_tolerance=0.1):
+    """Compare benchmark results to a baseline.
+
+    Timings are only compared if the baseline was recorded on the same host.
+    Otherwise a warning is logged and only the peak memory is compared.
+
+    Args:
+        results (dict): The new benchmark results.
+        baseline (dict): The baseline benchmark results.
+        time_tolerance (float): Allowed fractional increase in time.
+        memory_tolerance (float): Allowed fractional increase in memory.
+
+    Returns:
+        list: A description of each regression.
+    """
+    checks = [('peak_mb', memory_tolerance, 1.0)]
+    differences = get_host_differences(results.get('metadata', {}),
+                                       baseline.get('metadata', {}))
+    if not differences:
+        checks.insert(0, ('seconds', time_tolerance, 0.01))
+    else:
+        logger.warning('The baseline was recorded on a different host (%s), '
+                       'timings are skipped and only peak memory is compared. '
+                       'Regenerate the baseline on this host to compare '
+                       'timings.', ', '.join(differences))
+
+    regressions = []
+    for case, stages in results['results'].items():
+        if case not in baseline['results']:
+            continue
+        for stage, new in stages.items():
+            old = baseline['results'][case].get(stage)
+            if old is None:
+                continue
+            # ignore very small values, which are dominated by noise
+            for key, tolerance, floor in checks:
+                limit = max(old[key], floor) * (1 + tolerance)
+                if new[key] > limit:
+                    regressions.append('{} {} {}: {:.3f} > {:.3f} (baseline {:.3f})'.format(
+                        case, stage, key, new[key], limit, old[key]))
+    return regressions
+
+
+def print_results(results, baseline=None):
+    header = '{:<16}' + '{:>22}' * len(STAGES)
+    print(header.format('case', *STAGES))
+    for case, stages in results['results'].items():
+        cells = []
+        for stage in STAGES:
+            cell = '{:.3f}s {:.0f}MB'.format(stages[stage]['seconds'],
+                                             stages[stage]['peak_mb'])
+            if baseline and case in baseline['results']:
+                old = baseline['results'][case][stage]['seconds']
+                cell += ' ({:+.0%})'.format(
+                    stages[stage]['seconds'] / max(old, 1e-9) - 1)
+            cells.append(cell)
+        print(header.format(case, *cells))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--preset', choices=list(PRESETS), default='quick',
+                        help='Default image sizes and channel counts.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='Image sizes to benchmark, overrides the preset.')
+    parser.add_argument('--channels', type=int, nargs='+',
+                        help='Channel counts to benchmark, overrides the preset.')
+    parser.add_argument('--compression', default=None,
+                        help='Codec for the generated input files.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of times to run each stage.')
+    parser.add_argument('--output', '-o', default=None,
+                        help='Path to save the results as JSON.')
+    parser.add_argument('--baseline', default=None,
+                        help='Path to baseline results to compare against.')
+    parser.add_argument('--time-tolerance', type=float, default=0.25,
+                        help='Allowed fractional increase in time.')
+    parser.add_argument('--memory-tolerance', type=float, default=0.1,
+                        help='Allowed fractional increase in peak memory.')
+    parser.add_argument('--directory', default=None,
+                        help='Directory for the generated files. '
+                             'Defaults to a temporary directory.')
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    sizes = args.sizes or PRESETS[args.preset]['sizes']
+    channels = args.channels or PRESETS[args.preset]['channels']
+
+    directory = args.directory or tempfile.mkdtemp(prefix='dca-benchmarks-')
+    os.makedirs(directory, exist_ok=True)
+
+    results = {'metadata': get_metadata(), 'results': {}}
+    try:
+        for size in sizes:
+            for c in channels:
+                case = '{0}x{0}x{1}'.format(size, c)
+                results['results'][case] = run_case(
+                    directory, size, c,
+                    compression=args.compression,
+                    repeat=args.repeat)
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline=baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if baseline:
+        regressions = compare(results, baseline,
+                              time_tolerance=args.time_tolerance,
+                              memory_tolerance=args.memory_tolerance)
+        for regression in regressions:
+            print('REGRESSION: {}'.format(regression))
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
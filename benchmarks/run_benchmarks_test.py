@@ -0,0 +1,94 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for benchmarks.run_benchmarks"""
+
+import copy
+
+from benchmarks import run_benchmarks
+
+
+def _make_results(seconds, peak_mb, **metadata):
+    host = {'python': '3.8', 'system': 'Linux', 'machine': 'x86_64',
+            'platform': 'Linux-5.15.0-1-x86_64-with-glibc2.31',
+            'cpu_count': 8}
+    host.update(metadata)
+    return {
+        'metadata': host,
+        'results': {
+            '1024x1024x2': {
+                'write': {'seconds': seconds, 'peak_mb': peak_mb},
+            },
+        },
+    }
+
+
+def test_compare():
+    baseline = _make_results(1.0, 10.0)
+
+    # values within the tolerance pass
+    assert run_benchmarks.compare(_make_results(1.2, 10.5), baseline) == []
+
+    regressions = run_benchmarks.compare(_make_results(1.5, 12.0), baseline)
+    assert len(regressions) == 2
+    assert regressions[0].startswith('1024x1024x2 write seconds')
+    assert regressions[1].startswith('1024x1024x2 write peak_mb')
+
+    # very small values are not compared
+    small = _make_results(0.001, 0.1)
+    assert run_benchmarks.compare(_make_results(0.005, 0.5), small) == []
+
+    # cases and stages missing from the baseline are ignored
+    results = _make_results(1.5, 12.0)
+    results['results']['2048x2048x2'] = copy.deepcopy(
+        results['results']['1024x1024x2'])
+    results['results']['1024x1024x2']['load'] = {'seconds': 9, 'peak_mb': 90}
+    assert len(run_benchmarks.compare(results, baseline)) == 2
+
+
+def test_get_host_differences():
+    metadata = _make_results(1.0, 10.0)['metadata']
+
+    # the kernel build in the platform string does not change the host
+    other = dict(metadata, platform='Linux-6.1.0-2-x86_64-with-glibc2.36')
+    assert run_benchmarks.get_host_differences(metadata, other) == []
+
+    other = dict(metadata, cpu_count=64)
+    assert run_benchmarks.get_host_differences(metadata, other) == [
+        'cpu_count: 8 != 64']
+
+
+def test_compare_other_host(caplog):
+    baseline = _make_results(1.0, 10.0, cpu_count=64)
+
+    # timings of another host are not compared, but memory is
+    regressions = run_benchmarks.compare(_make_results(1.5, 10.0), baseline)
+    assert regressions == []
+    assert 'different host (cpu_count: 8 != 64)' in caplog.text
+    assert 'timings are skipped' in caplog.text
+
+    regressions = run_benchmarks.compare(_make_results(1.5, 12.0), baseline)
+    assert len(regressions) == 1
+    assert 'peak_mb' in regressions[0]
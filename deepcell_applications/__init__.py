@@ -30,5 +30,21 @@ from deepcell_applications import io
 from deepcell_applications import prepare
 from deepcell_applications import settings
 from deepcell_applications import utils
+from deepcell_applications import models
+from deepcell_applications import backends
+from deepcell_applications import metrics
+from deepcell_applications import autotune
+from deepcell_applications import cache
+from deepcell_applications import completion
+from deepcell_applications import preflight
+from deepcell_applications import batch
+from deepcell_applications import tiling
+from deepcell_applications import stack
+from deepcell_applications import pipeline
+from deepcell_applications import shm
 from deepcell_applications import argparse
 from deepcell_applications import app_runners
+from deepcell_applications import workers
+from deepcell_applications import server
+from deepcell_applications import api
+from deepcell_applications import aio
@@ -0,0 +1,180 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""An asyncio API for running warm applications from async services"""
+
+import asyncio
+import functools
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import deepcell_applications as dca
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncApplication(object):
+    """Runs an application from an event loop without blocking it.
+
+    Inputs are arrays, or the same input paths and channels as
+    ``run_app.py``. Files are decoded and outputs are encoded in a pool of
+    I/O threads, and inference runs on a single dedicated thread that builds
+    and keeps a warm instance of the application. While one request is
+    predicted, others are decoded or encoded, and at most ``max_pending``
+    requests are in flight at once.
+
+    A request may be cancelled or given a timeout. If it has not reached the
+    inference thread, it never runs. A prediction that has already started
+    runs to completion and its output is discarded.
+
+    Args:
+        name (str): The name of the application.
+        app (deepcell.applications.Application): An already instantiated
+            application to use instead of building a new one.
+        io_workers (int): Number of threads decoding and encoding files.
+        max_pending (int): Maximum number of requests in flight.
+        app_kwargs (dict): Keyword arguments used to build the application.
+    """
+
+    def __init__(self, name, app=None, io_workers=2, max_pending=16,
+                 **app_kwargs):
+        self.name = str(name).lower()
+        # fail early for unknown applications, without importing them
+        dca.utils.get_app_class(self.name, load=False)
+        self.predict_options = dca.settings.VALID_APPLICATIONS[
+            self.name]['predict_options']
+        self.app = app
+        self.app_kwargs = app_kwargs
+        self.max_pending = max(1, int(max_pending))
+        self._inference = ThreadPoolExecutor(
+            1, thread_name_prefix='dca-inference')
+        self._io = ThreadPoolExecutor(
+            max(1, int(io_workers)), thread_name_prefix='dca-io')
+        # created on the event loop, which Python < 3.10 binds them to
+        self._semaphore = None
+        self._loading = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_):
+        await self.close()
+
+    async def _run(self, executor, func, *args, **kwargs):
+        # cancelling the returned future cancels the call if it has not started
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, functools.partial(func, *args, **kwargs))
+
+    async def _load(self):
+        if self.app is None:
+            self.app = await self._run(self._inference, dca.utils.get_app,
+                                       self.name, **self.app_kwargs)
+            logger.info('Loaded a warm instance of %s.', self.name)
+
+    async def start(self):
+        """Build the warm application on the inference thread.
+
+        It is called by the first request if it was not called before.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pending)
+        if self._loading is None:
+            self._loading = asyncio.ensure_future(self._load())
+        # a cancelled request does not cancel loading for the others
+        await asyncio.shield(self._loading)
+
+    async def close(self):
+        """Wait for running calls and stop the I/O and inference threads."""
+        def shutdown():
+            self._io.shutdown(wait=True)
+            self._inference.shutdown(wait=True)
+
+        await self._run(None, shutdown)
+
+    async def predict(self, image=None, channels=None, output_path=None,
+                      timeout=None, **kwargs):
+        """Run the application on an array or on input files.
+
+        Args:
+            image (numpy.array): A ``(height, width, channels)`` image, or a
+                batch of them. If not given, the input is loaded from the
+                paths and channels in ``kwargs``, e.g. ``nuclear_path``.
+            channels (list): Optional channel, or list of channels, of
+                ``image`` to sum for each input of the application.
+            output_path (str): Optional path to save the output to as a TIFF.
+            timeout (float): Maximum seconds to wait for the output.
+            kwargs (dict): The options of ``app.predict``, e.g.
+                ``image_mpp``, the input paths and channels, and the output
+                options of ``run_app.py``, e.g. ``squeeze`` or ``compression``.
+
+        Returns:
+            numpy.array: The output of the application.
+
+        Raises:
+            asyncio.TimeoutError: If the output is not ready in ``timeout``.
+            ValueError: If the input is invalid.
+        """
+        coro = self._predict(image, channels, output_path, kwargs)
+        if timeout is None:
+            return await coro
+        return await asyncio.wait_for(coro, timeout)
+
+    async def _predict(self, image, channels, output_path, kwargs):
+        await self.start()
+
+        predict_kwargs = {k: kwargs.pop(k) for k in self.predict_options
+                          if k in kwargs}
+
+        async with self._semaphore:
+            if image is None:
+                image = await self._run(self._io, dca.prepare.prepare_input,
+                                        self.name, **kwargs)
+            else:
+                image = await self._run(self._io, dca.api.prepare_array, image,
+                                        len(self.app.model_image_shape),
+                                        channels=channels)
+
+            dca.utils.validate_input(self.app, image[0])
+
+            output = await self._run(self._inference, self.app.predict,
+                                     image, **predict_kwargs)
+
+            channels = output.shape[-1]
+            if kwargs.get('squeeze'):
+                output = np.squeeze(output)
+
+            if output_path:
+                await self._run(self._io, dca.io.save_image, output_path,
+                                output, channels=channels,
+                                downcast=kwargs.get('downcast', True),
+                                **dca.io.get_save_kwargs(kwargs))
+
+        return output
@@ -0,0 +1,133 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.aio"""
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import tifffile
+
+import pytest
+
+import deepcell_applications as dca
+
+
+class DummyApplication(object):
+
+    def __init__(self, *args, delay=0, **kwargs):
+        self.model_image_shape = (32, 32, 2)
+        self.required_channels = 2
+        self.logger = logging.getLogger('DummyApplication')
+        self.delay = delay
+        self.threads = set()
+        self.calls = []
+
+    def predict(self, image, **kwargs):
+        self.threads.add(threading.current_thread().name)
+        self.calls.append(kwargs)
+        time.sleep(self.delay)
+        return np.ones(image.shape[:-1] + (1,), dtype='int32')
+
+
+def test_async_application(tmpdir, mocker):
+    temp_dir = str(tmpdir)
+    nuclear_path = os.path.join(temp_dir, 'nuclear.tif')
+    tifffile.imwrite(nuclear_path, np.ones((32, 32), dtype='uint16'))
+    output_path = os.path.join(temp_dir, 'mask.tif')
+
+    built = []
+
+    def get_app(name, **kwargs):
+        built.append(threading.current_thread().name)
+        return DummyApplication(**kwargs)
+
+    mocker.patch('deepcell_applications.utils.get_app', get_app)
+
+    async def run():
+        async with dca.aio.AsyncApplication('mesmer', io_workers=2) as aio:
+            # arrays and paths are predicted concurrently
+            outputs = await asyncio.gather(
+                aio.predict(np.zeros((32, 32, 2)), image_mpp=0.5),
+                aio.predict(np.zeros((2, 32, 32, 3)), channels=[0, [1, 2]]),
+                aio.predict(nuclear_path=nuclear_path, output_path=output_path,
+                            squeeze=True, compression='zlib'),
+            )
+            with pytest.raises(ValueError):
+                await aio.predict(np.zeros((32, 32, 3)))
+            return aio.app, outputs
+
+    app, outputs = asyncio.run(run())
+
+    # the warm application is built once, on the inference thread
+    assert len(built) == 1
+    assert built[0].startswith('dca-inference')
+    assert app.threads == set(built)
+
+    assert outputs[0].shape == (1, 32, 32, 1)
+    assert outputs[1].shape == (2, 32, 32, 1)
+    assert outputs[2].shape == (32, 32)
+    assert {'image_mpp': 0.5} in app.calls
+    np.testing.assert_array_equal(tifffile.imread(output_path), outputs[2])
+
+    # unknown applications fail before anything is built
+    with pytest.raises(ValueError):
+        dca.aio.AsyncApplication('unknown app')
+
+
+def test_async_application_cancel():
+    app = DummyApplication(delay=0.2)
+
+    async def run():
+        aio = dca.aio.AsyncApplication('mesmer', app=app)
+        image = np.zeros((32, 32, 2))
+
+        # the first request times out while it is predicted, and the second
+        # is cancelled while it waits for the inference thread
+        first = asyncio.ensure_future(aio.predict(image, timeout=0.1))
+        await asyncio.sleep(0.05)
+        second = asyncio.ensure_future(aio.predict(image, batch_size=2))
+        await asyncio.sleep(0.05)
+        second.cancel()
+
+        with pytest.raises(asyncio.TimeoutError):
+            await first
+        with pytest.raises(asyncio.CancelledError):
+            await second
+
+        # the application still serves new requests
+        output = await aio.predict(image, timeout=5)
+        await aio.close()
+        return output
+
+    output = asyncio.run(run())
+    assert output.shape == (1, 32, 32, 1)
+    # the cancelled request never reached the model
+    assert {'batch_size': 2} not in app.calls
+    assert len(app.calls) == 2
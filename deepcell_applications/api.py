@@ -0,0 +1,193 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Functions for running applications on in-memory images"""
+
+import threading
+
+import numpy as np
+
+import deepcell_applications as dca
+
+
+_PREDICTORS = {}
+_PREDICTORS_LOCK = threading.Lock()
+
+
+def prepare_array(image, rank, channels=None):
+    """Returns an in-memory image as a float32 batch for ``app.predict``.
+
+    Without ``channels``, a float32 image is returned as a view, so it is
+    not copied. Otherwise the selected channels of each input are summed
+    into a single new batch.
+
+    Args:
+        image (numpy.array): A ``(height, width, channels)`` image,
+            or a batch of them, with the channels last.
+        rank (int): The rank of a single image, without the batch axis.
+        channels (list): Optional channel, or list of channels, to sum for
+            each input of the application, e.g. ``[0, [1, 2]]`` for the
+            nuclear and membrane channels of Mesmer. An input of ``None``
+            is left as zeros.
+
+    Returns:
+        numpy.array: The batch of input images.
+
+    Raises:
+        ValueError: If the image rank is invalid or a channel is out of range.
+    """
+    image = np.asarray(image)
+    if image.ndim not in (rank, rank + 1):
+        raise ValueError('Expected an image of rank {} or a batch of rank {}, '
+                         'but found shape {}'.format(rank, rank + 1, image.shape))
+
+    if image.ndim == rank:
+        image = image[np.newaxis]
+
+    if channels is None:
+        return image.astype('float32', copy=False)
+
+    batch = np.zeros(image.shape[:-1] + (len(channels),), dtype='float32')
+    for i, channel in enumerate(channels):
+        if channel is None:
+            continue
+
+        channel = channel if isinstance(channel, (list, tuple)) else [channel]
+        dca.io.check_channels(channel, image.shape[-1])
+        for c in channel:
+            # sum on the channel axis without a 64-bit intermediate
+            np.add(batch[..., i], image[..., c], out=batch[..., i],
+                   casting='unsafe')
+
+    return batch
+
+
+class Predictor(object):
+    """Runs a warm application on in-memory images.
+
+    Images are passed to ``app.predict`` and its labels are returned, with
+    no files written or read.
+
+    Args:
+        name (str): The name of the application.
+        app (deepcell.applications.Application): An already instantiated
+            application to use instead of building a new one.
+        app_kwargs (dict): Keyword arguments used to build the application.
+    """
+
+    def __init__(self, name='mesmer', app=None, **app_kwargs):
+        self.name = str(name).lower()
+        self.app = app if app is not None else dca.utils.get_app(
+            self.name, **app_kwargs)
+
+    def predict(self, image, channels=None, squeeze=False, **kwargs):
+        """Run the application on an image or a batch of images.
+
+        Args:
+            image (numpy.array): A ``(height, width, channels)`` image,
+                or a batch of them, with the channels last.
+            channels (list): Optional channel, or list of channels, to sum
+                for each input of the application.
+            squeeze (bool): Whether to squeeze the output.
+            kwargs (dict): Keyword arguments of ``app.predict``,
+                e.g. ``image_mpp`` or ``compartment``.
+
+        Returns:
+            numpy.array: The labels predicted by the application.
+        """
+        image = prepare_array(image, len(self.app.model_image_shape),
+                              channels=channels)
+        dca.utils.validate_input(self.app, image[0])
+
+        output = self.app.predict(image, **kwargs)
+        return np.squeeze(output) if squeeze else output
+
+    def predict_iter(self, images, channels=None, squeeze=False, **kwargs):
+        """Lazily run the application on each of many images.
+
+        Each image is only read from ``images`` once the labels of the
+        previous image are consumed, so a generator of images is never
+        held in memory at once.
+
+        Args:
+            images (iterable): Images or batches of images, e.g. a generator.
+                A single array is treated as one image or batch.
+            channels (list): Optional channel, or list of channels, to sum
+                for each input of the application.
+            squeeze (bool): Whether to squeeze each output.
+            kwargs (dict): Keyword arguments of ``app.predict``.
+
+        Yields:
+            numpy.array: The labels of each image.
+        """
+        if isinstance(images, np.ndarray):
+            images = [images]
+
+        for image in images:
+            yield self.predict(image, channels=channels, squeeze=squeeze,
+                               **kwargs)
+
+
+def get_predictor(name='mesmer'):
+    """Returns a Predictor with a warm application, building it once.
+
+    Args:
+        name (str): The name of the application.
+
+    Returns:
+        Predictor: The shared predictor of the application.
+    """
+    name = str(name).lower()
+    with _PREDICTORS_LOCK:
+        if name not in _PREDICTORS:
+            _PREDICTORS[name] = Predictor(name)
+        return _PREDICTORS[name]
+
+
+def predict(images, name='mesmer', app=None, channels=None, squeeze=False,
+            **kwargs):
+    """Lazily run an application on in-memory images.
+
+    The application is built on first use and reused by later calls,
+    unless an instantiated ``app`` is given.
+
+    Args:
+        images (iterable): Images or batches of images, e.g. a generator.
+            A single array is treated as one image or batch.
+        name (str): The name of the application.
+        app (deepcell.applications.Application): An already instantiated
+            application to use instead of the shared one.
+        channels (list): Optional channel, or list of channels, to sum for
+            each input of the application.
+        squeeze (bool): Whether to squeeze each output.
+        kwargs (dict): Keyword arguments of ``app.predict``.
+
+    Yields:
+        numpy.array: The labels of each image.
+    """
+    predictor = get_predictor(name) if app is None else Predictor(name, app=app)
+    for output in predictor.predict_iter(images, channels=channels,
+                                         squeeze=squeeze, **kwargs):
+        yield output
@@ -0,0 +1,130 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.api"""
+
+import logging
+
+import numpy as np
+
+import pytest
+
+import deepcell_applications as dca
+
+
+class DummyApplication(object):
+
+    def __init__(self, *args, **kwargs):
+        self.model_image_shape = (32, 32, 2)
+        self.required_channels = 2
+        self.logger = logging.getLogger('DummyApplication')
+        self.inputs = []
+
+    def predict(self, image, **kwargs):
+        self.inputs.append(image)
+        return np.ones(image.shape[:-1] + (1,), dtype='int32')
+
+
+def test_prepare_array():
+    # float32 images are not copied
+    image = np.random.random((32, 32, 2)).astype('float32')
+    batch = dca.api.prepare_array(image, 3)
+    assert batch.shape == (1, 32, 32, 2)
+    assert np.shares_memory(batch, image)
+
+    batch = dca.api.prepare_array(np.zeros((4, 32, 32, 2), dtype='uint16'), 3)
+    assert batch.shape == (4, 32, 32, 2)
+    assert batch.dtype == np.float32
+
+    # the selected channels of each input are summed
+    image = np.random.randint(0, 100, size=(2, 32, 32, 4)).astype('uint16')
+    batch = dca.api.prepare_array(image, 3, channels=[[0, 3], 2])
+    assert batch.shape == (2, 32, 32, 2)
+    np.testing.assert_array_equal(batch[..., 0], image[..., [0, 3]].sum(axis=-1))
+    np.testing.assert_array_equal(batch[..., 1], image[..., 2])
+
+    # inputs without channels are zeros
+    batch = dca.api.prepare_array(image[0], 3, channels=[1, None])
+    assert batch.shape == (1, 32, 32, 2)
+    np.testing.assert_array_equal(batch[0, ..., 1], 0)
+
+    with pytest.raises(ValueError):
+        dca.api.prepare_array(image, 3, channels=[0, 4])
+
+    with pytest.raises(ValueError):
+        dca.api.prepare_array(np.zeros((32, 32)), 3)
+
+
+def test_predictor():
+    app = DummyApplication()
+    predictor = dca.api.Predictor('mesmer', app=app)
+
+    image = np.zeros((32, 32, 2), dtype='float32')
+    output = predictor.predict(image)
+    assert output.shape == (1, 32, 32, 1)
+    # the image is passed to the application without a copy
+    assert np.shares_memory(app.inputs[-1], image)
+
+    assert predictor.predict(image, squeeze=True).shape == (32, 32)
+
+    with pytest.raises(ValueError):
+        predictor.predict(np.zeros((32, 32, 3)))
+
+    # images are read from a generator as each output is consumed
+    read = []
+
+    def images():
+        for i in range(3):
+            read.append(i)
+            yield np.zeros((32, 32, 3))
+
+    outputs = predictor.predict_iter(images(), channels=[0, [1, 2]])
+    assert not read
+    assert next(outputs).shape == (1, 32, 32, 1)
+    assert read == [0]
+    assert len(list(outputs)) == 2
+
+    # a single array is one image
+    assert len(list(predictor.predict_iter(image))) == 1
+
+
+def test_predict(mocker):
+    mocker.patch('deepcell_applications.api._PREDICTORS', {})
+    get_app = mocker.patch('deepcell_applications.utils.get_app',
+                           return_value=DummyApplication())
+
+    images = [np.zeros((32, 32, 2)), np.zeros((2, 32, 32, 2))]
+    outputs = list(dca.api.predict(images, image_mpp=0.5))
+    assert [o.shape for o in outputs] == [(1, 32, 32, 1), (2, 32, 32, 1)]
+
+    # the warm application is reused
+    list(dca.api.predict(images[0]))
+    assert get_app.call_count == 1
+
+    # or another application is used
+    app = DummyApplication()
+    list(dca.api.predict(images[0], app=app))
+    assert len(app.inputs) == 1
+    assert get_app.call_count == 1
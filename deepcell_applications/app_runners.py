@@ -24,52 +24,438 @@
 # limitations under the License.
 # ==============================================================================
 """Helper functions to run Applications"""
+import logging
 import os
 import timeit
 
 import numpy as np
-import tifffile
 
 import deepcell_applications as dca
 
 
-def run_application(arg_dict):
-    """Takes the user-supplied command line arguments and runs the specified application
+logger = logging.getLogger(__name__)
 
-    Args:
-        arg_dict: dictionary of command line args
 
-    Raises:
-        IOError: If specified output file already exists"""
-    _ = timeit.default_timer()
+def get_output_path(arg_dict):
+    """Returns the path of the output file for the given arguments."""
+    return os.path.join(arg_dict['output_directory'], arg_dict['output_name'])
 
-    outfile = os.path.join(arg_dict['output_directory'], arg_dict['output_name'])
 
-    # Check that the output path does not exist already
-    if os.path.exists(outfile):
-        raise IOError(f'{outfile} already exists!')
+def load_job(app, arg_dict, metrics=None, loader=None):
+    """Load and validate the input of a single job.
 
-    app = dca.utils.get_app(arg_dict['app'])
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        arg_dict (dict): Command line args for a single input image.
+        metrics (dca.metrics.JobMetrics): Optional metrics of the job.
+        loader (dca.shm.SharedLoader): Optional loader that prepares the
+            input in another process into shared memory. Its block must be
+            released once the job is done.
 
+    Returns:
+        numpy.array: The batch of input images.
+    """
     # load the input image
-    image = dca.prepare.prepare_input(arg_dict['app'], **arg_dict)
+    with dca.metrics.stage(metrics, 'load'):
+        if loader is None:
+            image = dca.prepare.prepare_input(arg_dict['app'], **arg_dict)
+        else:
+            image = loader.load(get_output_path(arg_dict), arg_dict)
+
+    if metrics is not None:
+        metrics.set_input_shape(image.shape)
 
     # make sure the input image is compatible with the app
-    dca.utils.validate_input(app, image)
+    # the prepared input already has a batch dimension
+    with dca.metrics.stage(metrics, 'validate'):
+        dca.utils.validate_input(app, image[0])
 
-    # Applications expect a batch dimension
-    image = np.expand_dims(image, axis=0)
+    return image
 
-    # run the prediction
+
+def predict_job(app, arg_dict, image, metrics=None, cache=None):
+    """Run the application on the loaded input of a single job.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        arg_dict (dict): Command line args for a single input image.
+        image (numpy.array): The batch of input images.
+        metrics (dca.metrics.JobMetrics): Optional metrics of the job.
+        cache (dca.cache.ResultCache): Optional cache of outputs. If the
+            same input was predicted with the same options and model,
+            the cached output is used instead.
+
+    Returns:
+        numpy.array: The output of the application.
+    """
     kwargs = dca.utils.get_predict_kwargs(arg_dict)
-    output = app.predict(image, **kwargs)
+
+    output = None
+    if cache is not None:
+        with dca.metrics.stage(metrics, 'cache'):
+            key = dca.cache.get_cache_key(
+                image, kwargs, dca.cache.get_model_version(app))
+            output = cache.get(key)
+        if metrics is not None:
+            metrics.cache = 'miss' if output is None else 'hit'
+
+    if output is None:
+        # run the prediction
+        with dca.metrics.stage(metrics, 'predict'):
+            output = app.predict(image, **kwargs)
+        if cache is not None:
+            with dca.metrics.stage(metrics, 'cache'):
+                cache.put(key, output)
+    else:
+        app.logger.info('Using cached output for %s.', get_output_path(arg_dict))
+
+    return output
+
+
+def save_job(app, arg_dict, output, metrics=None):
+    """Save the output of a single job.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        arg_dict (dict): Command line args for a single input image.
+        output (numpy.array): The output of the application.
+        metrics (dca.metrics.JobMetrics): Optional metrics of the job.
+            They are written to the ``metrics_file`` once the output is saved.
+    """
+    outfile = get_output_path(arg_dict)
+
+    # the channels are the last axis of the output, unless it is squeezed
+    channels = output.shape[-1]
 
     # Optionally squeeze the output
     if arg_dict['squeeze']:
         output = np.squeeze(output)
 
     # save the output as a tiff
-    tifffile.imwrite(outfile, output)
+    with dca.metrics.stage(metrics, 'write'):
+        dca.io.save_image(outfile, output, channels=channels,
+                          downcast=arg_dict.get('downcast', True),
+                          **dca.io.get_save_kwargs(arg_dict))
+
+    app.logger.info('Wrote output file %s.', outfile)
+
+    finish_job(arg_dict, metrics)
+
+
+def get_metrics(arg_dict):
+    """Returns new metrics for a job if a ``metrics_file`` is given."""
+    if arg_dict.get('metrics_file'):
+        return dca.metrics.JobMetrics(arg_dict)
+    return None
+
+
+def emit_metrics(arg_dict, metrics):
+    """Write the metrics of a finished job to the ``metrics_file``."""
+    if metrics is not None:
+        metrics.set_output_file(get_output_path(arg_dict))
+        metrics.emit(arg_dict['metrics_file'])
+
+
+def finish_job(arg_dict, metrics=None):
+    """Record the written output of a job and emit its metrics.
+
+    The output is only recorded in the completion log with ``resume``,
+    so other runs do not read back their outputs.
+    """
+    if arg_dict.get('resume'):
+        dca.completion.record_job(arg_dict)
+    emit_metrics(arg_dict, metrics)
+
+
+def get_app(arg_dict):
+    """Returns the application of the arguments, from the model cache if possible."""
+    return dca.utils.get_app(arg_dict['app'],
+                             model_directory=arg_dict.get('model_directory'),
+                             offline=arg_dict.get('offline') or None)
+
+
+def convert_app(app, arg_dict, jobs=None):
+    """Run an application on the backend and precision of the arguments.
+
+    ``int8`` quantization is calibrated on the model inputs of the first job.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        arg_dict (dict): Command line args with the ``backend`` and
+            ``precision``. Defaults are taken from the application settings.
+        jobs (list): Command line args for each input image.
+
+    Returns:
+        deepcell.applications.Application: The same application.
+    """
+    backend, precision = dca.backends.get_backend_options(
+        arg_dict['app'], arg_dict.get('backend'), arg_dict.get('precision'))
+
+    samples = None
+    if backend != dca.backends.DEFAULT_BACKEND and precision == 'int8' and jobs:
+        kwargs = dca.utils.get_predict_kwargs(jobs[0])
+        kwargs.pop('batch_size', None)
+        samples = dca.backends.get_model_inputs(
+            app, load_job(app, jobs[0]), **kwargs)
+
+    return dca.backends.set_backend(app, backend, precision, samples=samples)
+
+
+def prepare_app(app, arg_dict, jobs, memory=None):
+    """Get a new application ready to run the jobs of a run.
+
+    The model is converted to the ``backend`` of the arguments and any
+    automatic batch size of the jobs is resolved. With ``warmup``, the model
+    is then compiled for its tile shape and batch size, so the first job
+    does not pay for it.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        arg_dict (dict): Command line args of the run.
+        jobs (list): Command line args for each input image.
+        memory (int): The memory available to the application in bytes.
+
+    Returns:
+        deepcell.applications.Application: The same application.
+    """
+    app = convert_app(app, arg_dict, jobs)
+    dca.autotune.resolve_batch_size(app, jobs, memory=memory)
+
+    if arg_dict.get('warmup'):
+        dca.utils.warmup_app(app, batch_size=jobs[0].get('batch_size') or 1)
+    return app
+
+
+def run_accuracy_check(arg_dict, jobs, app=None, reference=None):
+    """Compare a backend with the reference Keras model on sample inputs.
+
+    The first ``check_samples`` jobs are compared. ``int8`` quantization is
+    calibrated on the next job, so it is not evaluated on its own
+    calibration data, or on random tiles if every job is a sample.
+
+    Args:
+        arg_dict (dict): Command line args with the ``backend``,
+            ``precision`` and number of ``check_samples``.
+        jobs (list): Command line args for each input image.
+        app (deepcell.applications.Application): An already instantiated
+            application on the backend to check.
+        reference (deepcell.applications.Application): An already
+            instantiated application on the Keras backend to compare with.
+
+    Returns:
+        list: The agreement and the time of both backends for each sample.
+    """
+    count = max(1, arg_dict.get('check_samples') or 1)
+    samples, others = jobs[:count], jobs[count:count + 1]
 
-    app.logger.info('Wrote output file %s in %s s.',
+    if reference is None:
+        reference = dca.backends.set_backend(get_app(arg_dict))
+    dca.autotune.resolve_batch_size(reference, samples)
+
+    if app is None:
+        app = convert_app(get_app(arg_dict), arg_dict, others)
+
+    reports = dca.backends.check_accuracy(reference, app, samples)
+    logger.info('Accuracy of %s (%s) on %s sample(s):\n%s',
+                app.backend, app.precision, len(reports),
+                dca.backends.format_report(reports, app.backend, app.precision))
+    return reports
+
+
+def run_job(app, arg_dict, cache=None):
+    """Run an instantiated application on a single input and save the output.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        arg_dict (dict): Command line args for a single input image.
+        cache (dca.cache.ResultCache): Optional cache of outputs.
+            Tiled jobs and stacks are not cached.
+    """
+    _ = timeit.default_timer()
+
+    outfile = get_output_path(arg_dict)
+    metrics = get_metrics(arg_dict)
+
+    # large images are read, predicted, and written one tile at a time
+    if arg_dict.get('tile_size'):
+        dca.tiling.run_tiled(app, arg_dict, metrics=metrics)
+        app.logger.info('Wrote tiled output file %s in %s s.',
+                        outfile, timeit.default_timer() - _)
+        finish_job(arg_dict, metrics)
+        return
+
+    # stacks are read, predicted, and written a chunk of frames at a time
+    if arg_dict.get('stack'):
+        dca.stack.run_stack(app, arg_dict, metrics=metrics)
+        app.logger.info('Wrote stack output file %s in %s s.',
+                        outfile, timeit.default_timer() - _)
+        finish_job(arg_dict, metrics)
+        return
+
+    image = load_job(app, arg_dict, metrics=metrics)
+    output = predict_job(app, arg_dict, image, metrics=metrics, cache=cache)
+    save_job(app, arg_dict, output, metrics=metrics)
+
+    app.logger.info('Finished %s in %s s.',
                     outfile, timeit.default_timer() - _)
+
+
+def run_pipelined_jobs(app, jobs, depth=2, cache=None, load_processes=0):
+    """Run many jobs, loading and saving in background threads.
+
+    The next inputs are loaded and the previous outputs are written while
+    the application predicts on the current input.
+
+    With ``load_processes``, inputs are decoded in other processes into
+    reused shared memory blocks, so they are neither limited by the GIL nor
+    pickled. Each block is recycled once its output is written.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        jobs (list): Command line args for each input image.
+        depth (int): Maximum number of inputs loaded ahead of the model
+            and outputs waiting to be written.
+        cache (dca.cache.ResultCache): Optional cache of outputs.
+        load_processes (int): Number of processes loading inputs.
+            If 0, inputs are loaded by a background thread.
+    """
+    # each item is a job and its metrics, so the stages share the metrics
+    items = ((job, get_metrics(job)) for job in jobs)
+
+    def predict(item, image):
+        return predict_job(app, item[0], image, item[1], cache=cache)
+
+    if not load_processes:
+        dca.pipeline.run_pipeline(
+            items,
+            load=lambda item: load_job(app, *item),
+            predict=predict,
+            write=lambda item, output: save_job(app, item[0], output, item[1]),
+            depth=depth)
+        return
+
+    # inputs are held while loading, predicting and waiting to be written
+    max_buffers = 2 * max(1, depth) + 2
+    with dca.shm.SharedLoader(load_processes, max_buffers=max_buffers) as loader:
+
+        def write(item, output):
+            try:
+                save_job(app, item[0], output, item[1])
+            finally:
+                loader.release(get_output_path(item[0]))
+
+        dca.pipeline.run_pipeline(
+            items,
+            load=lambda item: load_job(app, *item, loader=loader),
+            predict=predict,
+            write=write,
+            depth=depth,
+            load_workers=load_processes)
+
+
+def run_application(arg_dict, app=None, reference=None):
+    """Takes the user-supplied command line arguments and runs the specified application
+
+    If the arguments describe a batch of inputs (a directory, glob pattern,
+    or manifest), the application is instantiated once and run on each input.
+    Inputs are loaded and outputs are written in background threads while
+    the application is predicting, unless ``pipeline_depth`` is 0.
+    With more than one ``workers``, the inputs are instead spread across
+    worker processes that each build their own application.
+
+    With ``resume``, each completed output is recorded in a log in the
+    output directory, and outputs that match their record are skipped.
+
+    With ``warmup``, a new application is compiled for its tile shape and
+    batch size when it is built, and the compile and steady-state times are
+    logged.
+
+    The rank and channels of every input are checked from its header before
+    any pixels are read. With ``dry_run``, the plan of each job, with its
+    estimated memory and runtime, is logged and nothing is run.
+
+    The model runs on the ``backend`` and ``precision`` of the arguments.
+    With ``check_accuracy``, the labels of the backend are compared with
+    those of the Keras model on ``check_samples`` inputs, and nothing is
+    written.
+
+    Args:
+        arg_dict: dictionary of command line args
+        app: an already instantiated application to use instead of
+            building a new one, e.g. a warm application in a server.
+        reference: an already instantiated application on the Keras
+            backend to compare with if ``check_accuracy`` is set.
+
+    Returns:
+        list: The plan of each job if ``dry_run`` is set, or the report of
+            each sample if ``check_accuracy`` is set.
+
+    Raises:
+        IOError: If specified output file already exists
+            and neither ``overwrite`` nor ``resume`` is set.
+        ValueError: If any input is invalid."""
+    _ = timeit.default_timer()
+
+    jobs = dca.batch.get_jobs(arg_dict)
+
+    if arg_dict.get('resume'):
+        # skip completed outputs, and replace partial or corrupt outputs
+        jobs = dca.completion.get_remaining_jobs(jobs)
+        if not jobs:
+            return
+
+    # check every input from its header before reading any pixels
+    plans = dca.preflight.check_jobs(jobs, app=app)
+    if arg_dict.get('dry_run'):
+        logger.info('Plan of %s job(s):\n%s', len(plans),
+                    dca.preflight.format_plan(plans))
+        return plans
+
+    if arg_dict.get('check_accuracy'):
+        dca.preflight.raise_errors(plans)
+        return run_accuracy_check(arg_dict, jobs, app=app, reference=reference)
+
+    # Check that the output paths do not exist already
+    for job in jobs:
+        outfile = get_output_path(job)
+        if os.path.exists(outfile) and not (
+                arg_dict.get('overwrite') or arg_dict.get('resume')):
+            raise IOError(f'{outfile} already exists!')
+
+    dca.preflight.raise_errors(plans)
+
+    workers = arg_dict.get('workers') or 1
+    if app is None and workers > 1 and len(jobs) > 1:
+        # each worker process builds its own application
+        dca.workers.run_jobs_in_workers(arg_dict['app'], jobs, workers,
+                                        log_level=arg_dict.get('log_level'),
+                                        model_directory=arg_dict.get('model_directory'),
+                                        offline=arg_dict.get('offline') or None)
+        logger.info('Wrote %s output files in %s s.',
+                    len(jobs), timeit.default_timer() - _)
+        return
+
+    if app is None:
+        app = prepare_app(get_app(arg_dict), arg_dict, jobs)
+    else:
+        # choose an automatic batch size once for all jobs
+        dca.autotune.resolve_batch_size(app, jobs)
+
+    cache = dca.cache.get_cache(arg_dict)
+
+    depth = arg_dict.get('pipeline_depth', 0)
+    streamed = arg_dict.get('tile_size') or arg_dict.get('stack')
+    if len(jobs) > 1 and depth and not streamed:
+        run_pipelined_jobs(app, jobs, depth=depth, cache=cache,
+                           load_processes=arg_dict.get('load_processes', 0))
+    else:
+        for job in jobs:
+            run_job(app, job, cache=cache)
+
+    if cache is not None:
+        app.logger.info('Result cache: %s hits, %s misses, %s evictions.',
+                        cache.hits, cache.misses, cache.evictions)
+
+    if len(jobs) > 1:
+        app.logger.info('Wrote %s output files in %s s.',
+                        len(jobs), timeit.default_timer() - _)
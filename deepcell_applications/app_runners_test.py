@@ -24,6 +24,8 @@
 # limitations under the License.
 # ==============================================================================
 """Tests for deepcell_applications.app_runners"""
+import json
+import logging
 import os
 
 import skimage.io as io
@@ -72,3 +74,276 @@ def test_run_app_mesmer(tmpdir):
 
     with pytest.raises(IOError):
         dca.app_runners.run_application(dict(args_io_error._get_kwargs()))
+
+
+class DummyApplication(object):
+
+    instances = 0
+
+    def __init__(self, *args, **kwargs):
+        DummyApplication.instances += 1
+        self.model_image_shape = (32, 32, 2)
+        self.required_channels = 2
+        self.logger = logging.getLogger('DummyApplication')
+
+    def predict(self, image, **kwargs):
+        return np.zeros(image.shape[:-1] + (1,), dtype='int32')
+
+
+def test_run_app_mesmer_batch(tmpdir, mocker):
+    temp_dir = str(tmpdir)
+    mocker.patch('deepcell_applications.utils.get_app',
+                 lambda *_, **__: DummyApplication())
+    DummyApplication.instances = 0
+
+    # create a directory of input files
+    img = np.zeros((10, 10))
+    input_dir = os.path.join(temp_dir, 'inputs')
+    output_dir = os.path.join(temp_dir, 'output_dir')
+    os.makedirs(input_dir)
+    os.makedirs(output_dir)
+    names = ['fov{}'.format(i) for i in range(3)]
+    for name in names:
+        io.imsave(os.path.join(input_dir, name + '.tif'), img)
+
+    metrics_file = os.path.join(temp_dir, 'metrics.jsonl')
+    required_inputs = ['mesmer',
+                       '--output-directory', output_dir,
+                       '--nuclear-image', input_dir,
+                       '--metrics-file', metrics_file,
+                       '--squeeze']
+    args = dca.argparse.get_arg_parser().parse_args(required_inputs)
+
+    dca.app_runners.run_application(dict(args._get_kwargs()))
+
+    # the application is only built once
+    assert DummyApplication.instances == 1
+    for name in names:
+        assert os.path.exists(os.path.join(output_dir, name + '_mask.tif'))
+
+    # a metrics record is written for each image
+    with open(metrics_file) as f:
+        records = [json.loads(line) for line in f]
+    assert sorted(os.path.basename(r['output']) for r in records) == [
+        name + '_mask.tif' for name in names]
+    for record in records:
+        assert list(record['stages']) == ['load', 'validate', 'predict', 'write']
+        assert record['input_megapixels'] == 100 / 1e6
+        assert record['output_bytes'] > 0
+
+    # existing outputs fail before the application is built
+    with pytest.raises(IOError):
+        dca.app_runners.run_application(dict(args._get_kwargs()))
+    assert DummyApplication.instances == 1
+
+
+def test_run_app_mesmer_load_processes(tmpdir, mocker):
+    temp_dir = str(tmpdir)
+    app = DummyApplication()
+    predict = app.predict
+    inputs = []
+
+    def record(image, **kwargs):
+        # blocks are recycled, so the input is only valid while predicting
+        inputs.append(image[0, 0, 0, 0])
+        return predict(image, **kwargs)
+
+    mocker.patch.object(app, 'predict', record)
+
+    input_dir = os.path.join(temp_dir, 'inputs')
+    os.makedirs(input_dir)
+    for i in range(4):
+        io.imsave(os.path.join(input_dir, 'fov{}.tif'.format(i)),
+                  np.full((10, 10), i, dtype='uint16'))
+
+    args = dca.argparse.get_arg_parser().parse_args([
+        'mesmer',
+        '--output-directory', temp_dir,
+        '--nuclear-image', input_dir,
+        '--load-processes', '2',
+        '--pipeline-depth', '1',
+        '--squeeze'])
+
+    dca.app_runners.run_application(dict(args._get_kwargs()), app=app)
+
+    # inputs are loaded in other processes into shared memory
+    assert sorted(inputs) == [0, 1, 2, 3]
+    for i in range(4):
+        assert os.path.exists(os.path.join(temp_dir, 'fov{}_mask.tif'.format(i)))
+
+
+def test_run_app_mesmer_warmup(tmpdir, mocker):
+    temp_dir = str(tmpdir)
+    mocker.patch('deepcell_applications.utils.get_app',
+                 lambda *_, **__: DummyApplication())
+    warmup = mocker.patch('deepcell_applications.utils.warmup_app')
+
+    img_path = os.path.join(temp_dir, 'img.tif')
+    io.imsave(img_path, np.zeros((10, 10)))
+    args = dca.argparse.get_arg_parser().parse_args([
+        'mesmer',
+        '--output-directory', temp_dir,
+        '--nuclear-image', img_path,
+        '--batch-size', '3',
+        '--warmup'])
+
+    # the model is compiled for the batch size before the job
+    dca.app_runners.run_application(dict(args._get_kwargs()))
+    assert warmup.call_count == 1
+    assert warmup.call_args[1]['batch_size'] == 3
+
+
+def test_run_app_mesmer_check_accuracy(tmpdir, mocker, caplog):
+    temp_dir = str(tmpdir)
+    mocker.patch('deepcell_applications.utils.get_app',
+                 lambda *_, **__: DummyApplication())
+    convert_app = mocker.spy(dca.app_runners, 'convert_app')
+    DummyApplication.instances = 0
+    caplog.set_level(logging.INFO)
+
+    input_dir = os.path.join(temp_dir, 'inputs')
+    os.makedirs(input_dir)
+    for i in range(3):
+        io.imsave(os.path.join(input_dir, 'fov{}.tif'.format(i)),
+                  np.zeros((10, 10), dtype='uint16'))
+
+    args = dca.argparse.get_arg_parser().parse_args([
+        'mesmer',
+        '--output-directory', temp_dir,
+        '--nuclear-image', input_dir,
+        '--check-accuracy',
+        '--check-samples', '2'])
+
+    # the backend is compared with the reference on the samples
+    reports = dca.app_runners.run_application(dict(args._get_kwargs()))
+    assert len(reports) == 2
+    assert all(r['f1'] == 1.0 for r in reports)
+    assert 'keras (float32)' in caplog.text
+    assert DummyApplication.instances == 2
+
+    # the backend is calibrated on an input that is not a sample
+    calibration = convert_app.call_args[0][2]
+    assert [job['nuclear_path'] for job in calibration] == [
+        os.path.join(input_dir, 'fov2.tif')]
+
+    # nothing is written
+    assert not [f for f in os.listdir(temp_dir) if f.endswith('_mask.tif')]
+
+
+def test_run_app_mesmer_cache(tmpdir, mocker):
+    temp_dir = str(tmpdir)
+    app = DummyApplication()
+    spy = mocker.spy(app, 'predict')
+
+    img_path = os.path.join(temp_dir, 'img.tif')
+    io.imsave(img_path, np.random.random((10, 10)).astype('float32'))
+    cache_dir = os.path.join(temp_dir, 'cache')
+
+    required_inputs = ['mesmer',
+                       '--output-directory', temp_dir,
+                       '--nuclear-image', img_path,
+                       '--cache-directory', cache_dir,
+                       '--squeeze']
+    args = dict(dca.argparse.get_arg_parser().parse_args(required_inputs)._get_kwargs())
+
+    dca.app_runners.run_application(args, app=app)
+    assert spy.call_count == 1
+    output = io.imread(os.path.join(temp_dir, 'mask.tif'))
+
+    # outputs are replaced only with overwrite
+    with pytest.raises(IOError):
+        dca.app_runners.run_application(args, app=app)
+    args['overwrite'] = True
+
+    # the cached output is written without predicting again
+    dca.app_runners.run_application(args, app=app)
+    assert spy.call_count == 1
+    np.testing.assert_array_equal(io.imread(os.path.join(temp_dir, 'mask.tif')), output)
+
+    # changing the predict options misses the cache
+    args['compartment'] = 'nuclear'
+    dca.app_runners.run_application(args, app=app)
+    assert spy.call_count == 2
+
+
+def test_run_app_mesmer_resume(tmpdir, mocker):
+    temp_dir = str(tmpdir)
+    app = DummyApplication()
+    spy = mocker.spy(app, 'predict')
+
+    input_dir = os.path.join(temp_dir, 'inputs')
+    output_dir = os.path.join(temp_dir, 'output_dir')
+    os.makedirs(input_dir)
+    os.makedirs(output_dir)
+    names = ['fov{}'.format(i) for i in range(4)]
+    for name in names:
+        io.imsave(os.path.join(input_dir, name + '.tif'), np.zeros((10, 10)))
+
+    required_inputs = ['mesmer',
+                       '--output-directory', output_dir,
+                       '--nuclear-image', input_dir,
+                       '--squeeze']
+    args = dict(dca.argparse.get_arg_parser().parse_args(required_inputs)._get_kwargs())
+    log_path = os.path.join(output_dir, dca.completion.COMPLETION_LOG)
+
+    # outputs are only recorded with resume
+    dca.app_runners.run_application(args, app=app)
+    assert spy.call_count == 4
+    assert not os.path.exists(log_path)
+
+    args['resume'] = True
+    args['overwrite'] = True
+    dca.app_runners.run_application(args, app=app)
+    assert spy.call_count == 8
+    assert os.path.exists(log_path)
+
+    # an interrupted run left a missing and a truncated output
+    os.remove(os.path.join(output_dir, 'fov1_mask.tif'))
+    with open(os.path.join(output_dir, 'fov2_mask.tif'), 'r+b') as f:
+        f.truncate(10)
+
+    # options that only change how jobs are run are ignored
+    args['overwrite'] = False
+    args['batch_size'] = 2
+    args['pipeline_depth'] = 0
+    args['stack_chunk'] = 8
+    args['warmup'] = False
+    dca.app_runners.run_application(args, app=app)
+    assert spy.call_count == 10
+    for name in names:
+        output = io.imread(os.path.join(output_dir, name + '_mask.tif'))
+        assert output.shape == (10, 10)
+
+    # nothing is left to do
+    dca.app_runners.run_application(args, app=app)
+    assert spy.call_count == 10
+
+
+def test_run_app_mesmer_dry_run(tmpdir, mocker, caplog):
+    temp_dir = str(tmpdir)
+    caplog.set_level(logging.INFO)
+    get_app = mocker.patch('deepcell_applications.utils.get_app')
+
+    img_path = os.path.join(temp_dir, 'img.tif')
+    io.imsave(img_path, np.zeros((3, 10, 10), dtype='uint8'))
+
+    required_inputs = ['mesmer',
+                       '--output-directory', temp_dir,
+                       '--nuclear-image', img_path,
+                       '--nuclear-channel', '1',
+                       '--dry-run']
+    args = dict(dca.argparse.get_arg_parser().parse_args(required_inputs)._get_kwargs())
+
+    # the plan is logged without building the application
+    plans = dca.app_runners.run_application(args)
+    assert len(plans) == 1
+    assert not plans[0]['errors']
+    assert 'mask.tif' in caplog.text
+    get_app.assert_not_called()
+    assert not os.path.exists(os.path.join(temp_dir, 'mask.tif'))
+
+    # bad channels fail before the application is built
+    args.update(dry_run=False, nuclear_channel=[3])
+    with pytest.raises(ValueError):
+        dca.app_runners.run_application(args)
+    get_app.assert_not_called()
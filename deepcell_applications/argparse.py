@@ -26,6 +26,7 @@
 """Functions for parsing command line arguments"""
 
 import argparse
+import glob
 import os
 
 
@@ -59,6 +60,25 @@ def get_arg_parser():
             raise argparse.ArgumentTypeError('{} does not exist.'.format(x))
         return x
 
+    def existing_path(x):
+        # a file, a directory, or a glob pattern matching at least one file
+        if x is not None and not (os.path.exists(x) or glob.glob(x)):
+            raise argparse.ArgumentTypeError('{} does not exist.'.format(x))
+        return x
+
+    def batch_size(x):
+        # a positive integer, or auto to choose from memory and throughput
+        if x == 'auto':
+            return x
+        try:
+            value = int(x)
+        except ValueError:
+            value = 0
+        if value < 1:
+            raise argparse.ArgumentTypeError(
+                '{} is not a positive integer or auto.'.format(x))
+        return value
+
     parent.add_argument('--output-directory', '-o',
                         default=os.path.join(root_dir, 'output'),
                         action=WritableDirectoryAction,
@@ -66,7 +86,9 @@ def get_arg_parser():
 
     parent.add_argument('--output-name', '-f',
                         default='mask.tif',
-                        help='Name of output file.')
+                        help='Name of output file. When running a batch, '
+                             'each output is named after its input file '
+                             'with this value as a suffix.')
 
     parent.add_argument('-L', '--log-level', default='INFO',
                         choices=('DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'),
@@ -75,6 +97,110 @@ def get_arg_parser():
     parent.add_argument('--squeeze', action='store_true',
                         help='Squeeze the output tensor before saving.')
 
+    parent.add_argument('--compression', default='none',
+                        choices=('none', 'zlib', 'zstd', 'lzw'),
+                        help='Codec used to compress the output file.')
+
+    parent.add_argument('--output-tile', type=int, default=0,
+                        help='Write the output as a tiled TIFF with square '
+                             'tiles of this size (a multiple of 16). '
+                             'Default value of 0 writes strips.')
+
+    parent.add_argument('--bigtiff', action='store_true',
+                        help='Always write the output as a BigTIFF. '
+                             'By default, BigTIFF is only used for outputs '
+                             'larger than 4 GB.')
+
+    parent.add_argument('--no-downcast', action='store_false', dest='downcast',
+                        help='Save labels with the dtype returned by the '
+                             'application instead of the smallest unsigned '
+                             'integer dtype that fits them.')
+
+    parent.add_argument('--server', default=None,
+                        help='URL of a running `serve` process to send the '
+                             'job to, e.g. http://127.0.0.1:8765. '
+                             'Paths must be accessible to the server.')
+
+    parent.add_argument('--pipeline-depth', type=int, default=2,
+                        help='When running a batch, the number of inputs '
+                             'loaded and outputs written in the background '
+                             'while the model is predicting. '
+                             'Use 0 to run each image in series.')
+
+    parent.add_argument('--load-processes', type=int, default=0,
+                        help='When running a batch with --pipeline-depth, '
+                             'the number of processes decoding inputs into '
+                             'shared memory. Default value of 0 decodes '
+                             'inputs in a background thread.')
+
+    parent.add_argument('--workers', type=int, default=1,
+                        help='When running a batch, the number of worker '
+                             'processes, each with its own application '
+                             'pinned to its share of the CPUs.')
+
+    parent.add_argument('--backend', default=None,
+                        choices=('keras', 'tflite', 'onnx'),
+                        help='Run the model as a Keras model, or converted '
+                             'to a TF-Lite or ONNX Runtime graph. '
+                             'Defaults to the application settings.')
+
+    parent.add_argument('--precision', default=None,
+                        choices=('float32', 'float16', 'int8'),
+                        help='Precision of a converted model. '
+                             'Defaults to the application settings.')
+
+    parent.add_argument('--check-accuracy', action='store_true',
+                        help='Compare the labels of the backend with those '
+                             'of the Keras model on sample inputs and log '
+                             'their F1, IoU and speedup without writing.')
+
+    parent.add_argument('--check-samples', type=int, default=4,
+                        help='Number of inputs used by --check-accuracy.')
+
+    parent.add_argument('--model-directory', default=None,
+                        help='Directory of models cached by `prefetch`. '
+                             'Defaults to DEEPCELL_MODEL_DIR or '
+                             '~/.deepcell/models.')
+
+    parent.add_argument('--offline', action='store_true',
+                        help='Only load models from the model cache, '
+                             'and fail instead of downloading them. '
+                             'Also enabled by DEEPCELL_OFFLINE=1.')
+
+    parent.add_argument('--warmup', action='store_true',
+                        help='Compile the model for its tile shape and batch '
+                             'size before the first image, and log the '
+                             'compile and steady-state times.')
+
+    parent.add_argument('--dry-run', action='store_true',
+                        help='Check every input from its header and log '
+                             'the estimated memory and runtime of each job '
+                             'without running anything.')
+
+    parent.add_argument('--overwrite', action='store_true',
+                        help='Replace existing output files instead of '
+                             'failing.')
+
+    parent.add_argument('--resume', action='store_true',
+                        help='Record completed outputs, skip inputs whose '
+                             'outputs were completed by a previous run with '
+                             'the same arguments, and replace partial or '
+                             'corrupt outputs.')
+
+    parent.add_argument('--cache-directory', default=None,
+                        help='Directory to cache outputs in. Inputs that '
+                             'were already predicted with the same options '
+                             'and model are not predicted again.')
+
+    parent.add_argument('--cache-size', type=float, default=10,
+                        help='Maximum size of the cache directory in GB. '
+                             'The least recently used outputs are removed.')
+
+    parent.add_argument('--metrics-file', default=None,
+                        help='Append a JSON record with the time and memory '
+                             'used by each stage to this file for each '
+                             'image. Use - to write to stdout.')
+
     # use subparsers to group options for different applications
     # https://stackoverflow.com/a/30217387
     subparsers = parser.add_subparsers(dest='app', help='application name')
@@ -89,9 +215,23 @@ def get_arg_parser():
                                    help='Run Mesmer on nuclear + membrane data')
 
     # Mesmer Image file inputs
-    mesmer.add_argument('--nuclear-image', '-n', required=True,
-                        type=existing_file, dest='nuclear_path',
-                        help=('REQUIRED: Path to 2D single channel TIF file.'))
+    # Either a single nuclear image, a directory or glob of nuclear images,
+    # or a manifest of many inputs must be provided.
+    mesmer_inputs = mesmer.add_mutually_exclusive_group(required=True)
+
+    mesmer_inputs.add_argument('--nuclear-image', '-n',
+                               type=existing_path, dest='nuclear_path',
+                               help=('Path to 2D single channel TIF file. '
+                                     'A directory or glob pattern of files '
+                                     'will run each file as a batch.'))
+
+    mesmer_inputs.add_argument('--manifest',
+                               type=existing_file,
+                               help=('Path to a CSV file with a `nuclear_path` '
+                                     'column and optional `membrane_path`, '
+                                     '`output_name`, `nuclear_channel` and '
+                                     '`membrane_channel` columns. '
+                                     'Each row is run as a batch.'))
 
     mesmer.add_argument('--nuclear-channel', '-nc',
                         default=0, nargs='+', type=int,
@@ -100,10 +240,12 @@ def get_arg_parser():
                              'all channels will be summed.')
 
     mesmer.add_argument('--membrane-image', '-m',
-                        type=existing_file, dest='membrane_path',
+                        type=existing_path, dest='membrane_path',
                         help=('Path to 2D single channel TIF file. '
                               'Optional. If not provided, membrane '
-                              'channel input to network is blank.'))
+                              'channel input to network is blank. '
+                              'If a directory or glob pattern, membrane '
+                              'images are paired to nuclear images by name.'))
 
     mesmer.add_argument('--membrane-channel', '-mc',
                         default=0, nargs='+', type=int,
@@ -111,16 +253,104 @@ def get_arg_parser():
                              'If more than one channel is passed, '
                              'all channels will be summed.')
 
+    mesmer.add_argument('--resolution-level', type=int, default=0,
+                        help='Resolution level of OME-Zarr inputs. '
+                             'Default value of 0 is the full resolution.')
+
     # Mesmer Inference parameters
     mesmer.add_argument('--image-mpp', type=float, default=0.5,
                         help='Input image resolution in microns-per-pixel. '
                              'Default value of 0.5 corresponds to a 20x zoom.')
 
-    mesmer.add_argument('--batch-size', '-b', default=4, type=int,
-                        help='Batch size for `model.predict`.')
+    mesmer.add_argument('--batch-size', '-b', default=4, type=batch_size,
+                        help='Batch size for `model.predict`. Use auto to '
+                             'choose the fastest batch size that fits in '
+                             'memory, calibrated once per host.')
 
     mesmer.add_argument('--compartment', '-c', default='whole-cell',
                         choices=('nuclear', 'whole-cell', 'both'),
                         help='The cellular compartment to segment.')
 
+    # Mesmer stack parameters for time-lapse or z-stack images
+    mesmer.add_argument('--stack', action='store_true',
+                        help='Treat the first axis of the inputs as frames, '
+                             'e.g. time points or z-slices, and write the '
+                             'labels of each frame as a page of the output.')
+
+    mesmer.add_argument('--stack-chunk', type=int, default=16,
+                        help='Number of frames of a stack loaded and '
+                             'predicted at once.')
+
+    # Mesmer tiling parameters for images that do not fit in memory
+    mesmer.add_argument('--tile-size', type=int, default=0,
+                        help='Read, predict and write the image in square '
+                             'tiles of this size (a multiple of 16). '
+                             'Peak memory is bounded by the tile size. '
+                             'Default value of 0 disables tiling.')
+
+    mesmer.add_argument('--tile-overlap', type=int, default=64,
+                        help='Number of pixels of context added to each side '
+                             'of a tile. Labels are stitched across tiles '
+                             'using the overlapping pixels.')
+
+    # Server Configuration
+    # Keeps applications in memory to run jobs sent with ``--server``
+    serve = subparsers.add_parser('serve',
+                                  help='Serve warm applications over HTTP')
+
+    serve.add_argument('--host', default='127.0.0.1',
+                       help='Host to listen on.')
+
+    serve.add_argument('--port', '-p', type=int, default=8765,
+                       help='Port to listen on.')
+
+    serve.add_argument('--apps', nargs='+', default=None,
+                       help='Applications to serve. Defaults to all.')
+
+    serve.add_argument('--max-concurrency', type=int, default=1,
+                       help='Number of warm instances of each application, '
+                            'and the number of jobs run at once.')
+
+    serve.add_argument('--max-queue', type=int, default=16,
+                       help='Number of jobs that may wait for an instance '
+                            'before new jobs are rejected.')
+
+    serve.add_argument('--drain-timeout', type=float, default=None,
+                       help='Seconds to wait for running jobs on shutdown.')
+
+    serve.add_argument('--warmup-batch-size', type=int, default=0,
+                       help='Compile each instance for this batch size '
+                            'before the server is ready. '
+                            'Default value of 0 skips the warm-up.')
+
+    serve.add_argument('--model-directory', default=None,
+                       help='Directory of models cached by `prefetch`.')
+
+    serve.add_argument('--offline', action='store_true',
+                       help='Only load models from the model cache.')
+
+    serve.add_argument('-L', '--log-level', default='INFO',
+                       choices=('DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'),
+                       help='Only log the given level and above.')
+
+    # Downloads models ahead of time for offline use
+    prefetch = subparsers.add_parser('prefetch',
+                                     help='Download and verify models into '
+                                          'the model cache')
+
+    prefetch.add_argument('--apps', nargs='+', default=None,
+                          help='Applications to cache. Defaults to all.')
+
+    prefetch.add_argument('--model-directory', default=None,
+                          help='Directory to cache the models in. '
+                               'Defaults to DEEPCELL_MODEL_DIR or '
+                               '~/.deepcell/models.')
+
+    prefetch.add_argument('--overwrite', action='store_true',
+                          help='Download models that are already cached.')
+
+    prefetch.add_argument('-L', '--log-level', default='INFO',
+                          choices=('DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'),
+                          help='Only log the given level and above.')
+
     return parser
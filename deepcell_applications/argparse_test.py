@@ -28,6 +28,8 @@
 import argparse
 import os
 import stat
+import subprocess
+import sys
 import tempfile
 
 
@@ -67,13 +69,40 @@ def test_get_arg_parser_mesmer(tmpdir):
         'output_name': 'seg_mask.tif',
         'log_level': 'INFO',
         'squeeze': True,
+        'compression': 'zstd',
+        'output_tile': 256,
+        'bigtiff': True,
+        'downcast': False,
+        'server': None,
+        'pipeline_depth': 3,
+        'load_processes': 2,
+        'workers': 4,
+        'backend': 'tflite',
+        'precision': 'float16',
+        'check_accuracy': True,
+        'check_samples': 2,
+        'model_directory': '/models',
+        'offline': True,
+        'warmup': True,
+        'dry_run': True,
+        'overwrite': True,
+        'resume': True,
+        'cache_directory': dir_path,
+        'cache_size': 2.5,
+        'metrics_file': '-',
         'nuclear_path': file_path,
+        'manifest': None,
         'nuclear_channel': [2],
         'membrane_path': file_path,
         'membrane_channel': [3],
+        'resolution_level': 1,
         'compartment': 'nuclear',
         'image_mpp': 3.0,
-        'batch_size': 5}
+        'batch_size': 5,
+        'stack': True,
+        'stack_chunk': 8,
+        'tile_size': 512,
+        'tile_overlap': 32}
 
     # construct syntax for appropriate passing to argparse
     input_list = [output_dict['app'],
@@ -81,13 +110,38 @@ def test_get_arg_parser_mesmer(tmpdir):
                   '--output-name', output_dict['output_name'],
                   '--log-level', output_dict['log_level'],
                   '--squeeze',
+                  '--compression', output_dict['compression'],
+                  '--output-tile', str(output_dict['output_tile']),
+                  '--bigtiff',
+                  '--no-downcast',
+                  '--pipeline-depth', str(output_dict['pipeline_depth']),
+                  '--load-processes', str(output_dict['load_processes']),
+                  '--workers', str(output_dict['workers']),
+                  '--backend', output_dict['backend'],
+                  '--precision', output_dict['precision'],
+                  '--check-accuracy',
+                  '--check-samples', str(output_dict['check_samples']),
+                  '--model-directory', output_dict['model_directory'],
+                  '--offline',
+                  '--warmup',
+                  '--dry-run',
+                  '--overwrite',
+                  '--resume',
+                  '--cache-directory', output_dict['cache_directory'],
+                  '--cache-size', str(output_dict['cache_size']),
+                  '--metrics-file', output_dict['metrics_file'],
                   '--nuclear-image', output_dict['nuclear_path'],
                   '--nuclear-channel', str(output_dict['nuclear_channel'][0]),
                   '--membrane-image', output_dict['membrane_path'],
                   '--membrane-channel', str(output_dict['membrane_channel'][0]),
+                  '--resolution-level', str(output_dict['resolution_level']),
                   '--compartment', output_dict['compartment'],
                   '--image-mpp', str(int(output_dict['image_mpp'])),
-                  '--batch-size', str(output_dict['batch_size'])]
+                  '--batch-size', str(output_dict['batch_size']),
+                  '--stack',
+                  '--stack-chunk', str(output_dict['stack_chunk']),
+                  '--tile-size', str(output_dict['tile_size']),
+                  '--tile-overlap', str(output_dict['tile_overlap'])]
 
     ARGS = dca.argparse.get_arg_parser().parse_args(input_list)
 
@@ -109,6 +163,65 @@ def test_get_arg_parser_mesmer(tmpdir):
                                                       '--membrane-image', bad_file_path,
                                                       '--output-directory', dir_path])
 
+    with pytest.raises(SystemExit):
+        # no nuclear image or manifest
+        _ = dca.argparse.get_arg_parser().parse_args([output_dict['app'],
+                                                      '--output-directory', dir_path])
+
+    with pytest.raises(SystemExit):
+        # nuclear image and manifest are mutually exclusive
+        _ = dca.argparse.get_arg_parser().parse_args([output_dict['app'],
+                                                      '--nuclear-image', file_path,
+                                                      '--manifest', file_path,
+                                                      '--output-directory', dir_path])
+
+    # directories and glob patterns are valid batch inputs
+    for batch_path in (temp_dir, os.path.join(temp_dir, '*.tiff')):
+        args = dca.argparse.get_arg_parser().parse_args([output_dict['app'],
+                                                         '--nuclear-image', batch_path,
+                                                         '--output-directory', dir_path])
+        assert args.nuclear_path == batch_path
+
+    with pytest.raises(SystemExit):
+        # glob pattern without any matches
+        _ = dca.argparse.get_arg_parser().parse_args([output_dict['app'],
+                                                      '--nuclear-image',
+                                                      os.path.join(temp_dir, '*.png'),
+                                                      '--output-directory', dir_path])
+
+    # the batch size may be chosen automatically
+    args = dca.argparse.get_arg_parser().parse_args([output_dict['app'],
+                                                     '--nuclear-image', file_path,
+                                                     '--batch-size', 'auto',
+                                                     '--output-directory', dir_path])
+    assert args.batch_size == 'auto'
+
+    for bad_batch_size in ('0', 'fast'):
+        with pytest.raises(SystemExit):
+            _ = dca.argparse.get_arg_parser().parse_args([output_dict['app'],
+                                                          '--nuclear-image', file_path,
+                                                          '--batch-size', bad_batch_size,
+                                                          '--output-directory', dir_path])
+
+    # the serve command has its own options
+    args = dca.argparse.get_arg_parser().parse_args(['serve', '--port', '9000',
+                                                     '--max-concurrency', '2',
+                                                     '--warmup-batch-size', '8'])
+    assert args.app == 'serve'
+    assert args.port == 9000
+    assert args.max_concurrency == 2
+    assert args.warmup_batch_size == 8
+    assert args.model_directory is None
+    assert not args.offline
+
+    # the prefetch command caches models
+    args = dca.argparse.get_arg_parser().parse_args(['prefetch', '--apps', 'mesmer',
+                                                     '--model-directory', '/models'])
+    assert args.app == 'prefetch'
+    assert args.apps == ['mesmer']
+    assert args.model_directory == '/models'
+    assert not args.overwrite
+
     with pytest.raises(argparse.ArgumentTypeError):
         # bad output dir
         _ = dca.argparse.get_arg_parser().parse_args([output_dict['app'],
@@ -119,3 +232,29 @@ def test_get_arg_parser_mesmer(tmpdir):
         _ = dca.argparse.get_arg_parser().parse_args([output_dict['app'],
                                                       '--nuclear-image', file_path,
                                                       '--output-directory', read_dir_path])
+
+
+# parsing arguments must not wait for TensorFlow to be imported
+STARTUP_SCRIPT = """
+import sys
+import deepcell_applications as dca
+dca.argparse.get_arg_parser().parse_args(['mesmer', '--nuclear-image', sys.argv[1]])
+print(any(m in sys.modules for m in ('deepcell', 'tensorflow')))
+"""
+
+
+def test_startup_imports(tmpdir):
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    file_path = os.path.join(str(tmpdir), 'img.tiff')
+    io.imsave(file_path, np.zeros((10, 10)))
+
+    # --help must work without importing deepcell
+    result = subprocess.run([sys.executable, os.path.join(root_dir, 'run_app.py'),
+                             'mesmer', '--help'],
+                            cwd=root_dir, capture_output=True)
+    assert result.returncode == 0
+
+    # parsing the arguments does not import deepcell or tensorflow
+    result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, file_path],
+                            cwd=root_dir, capture_output=True, check=True)
+    assert result.stdout.decode().strip() == 'False'
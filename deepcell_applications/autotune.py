@@ -0,0 +1,372 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Functions for choosing the batch size from available memory and throughput"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import timeit
+
+import numpy as np
+
+import deepcell_applications as dca
+
+
+logger = logging.getLogger(__name__)
+
+AUTO = 'auto'
+
+# Conservative ratio of the memory used by the model to predict a tile,
+# including intermediate activations, to the size of the float32 tile.
+TILE_MEMORY_FACTOR = 256
+
+# Fraction of the available memory that the model may use
+MEMORY_FRACTION = 0.5
+
+MAX_BATCH_SIZE = 64
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser('~'), '.deepcell', 'batch_size.json')
+
+CGROUP_MEMORY_LIMIT_PATHS = (
+    '/sys/fs/cgroup/memory.max',  # cgroup v2
+    '/sys/fs/cgroup/memory/memory.limit_in_bytes',  # cgroup v1
+)
+
+_CACHE_LOCK = threading.Lock()
+
+
+def get_available_memory():
+    """Returns the memory available to new processes in bytes.
+
+    Returns:
+        int: The available memory, or ``None`` if it is not known.
+    """
+    try:
+        # MemAvailable includes reclaimable page cache
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def get_memory_limit():
+    """Returns the total memory this process may use in bytes.
+
+    Unlike the available memory, this does not change from run to run: it is
+    the physical memory of the host, or the memory limit of the container if
+    that is lower.
+
+    Returns:
+        int: The memory limit, or ``None`` if it is not known.
+    """
+    limit = None
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    limit = int(line.split()[1]) * 1024
+                    break
+    except (IOError, OSError, ValueError):
+        pass
+
+    if limit is None:
+        try:
+            limit = os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+        except (AttributeError, ValueError, OSError):
+            pass
+
+    for path in CGROUP_MEMORY_LIMIT_PATHS:
+        try:
+            with open(path) as f:
+                cgroup_limit = int(f.read().strip())
+        except (IOError, OSError, ValueError):
+            # missing, or "max" if the cgroup is not limited
+            continue
+        if limit is None or cgroup_limit < limit:
+            limit = cgroup_limit
+        break
+
+    return limit
+
+
+def estimate_tile_bytes(model_image_shape):
+    """Estimates the memory used by the model to predict a single tile.
+
+    Args:
+        model_image_shape (tuple): The shape of a tile, e.g. from
+            ``app.model_image_shape``.
+
+    Returns:
+        int: The estimated bytes per tile.
+    """
+    pixels = int(np.prod(model_image_shape))
+    return pixels * np.dtype('float32').itemsize * TILE_MEMORY_FACTOR
+
+
+def get_max_batch_size(model_image_shape, memory=None, limit=MAX_BATCH_SIZE):
+    """Returns the largest batch size that is expected to fit in memory.
+
+    Args:
+        model_image_shape (tuple): The shape of a tile, e.g. from
+            ``app.model_image_shape``.
+        memory (int): The available memory in bytes.
+            Defaults to the memory available now.
+        limit (int): The largest batch size to return.
+
+    Returns:
+        int: The largest batch size, at least 1.
+    """
+    memory = get_available_memory() if memory is None else memory
+    if memory is None:
+        return limit
+    max_batch_size = int(memory * MEMORY_FRACTION) // estimate_tile_bytes(
+        model_image_shape)
+    return int(min(max(max_batch_size, 1), limit))
+
+
+def get_candidates(max_batch_size):
+    """Returns the powers of 2 up to and including ``max_batch_size``."""
+    candidates = []
+    batch_size = 1
+    while batch_size < max_batch_size:
+        candidates.append(batch_size)
+        batch_size *= 2
+    candidates.append(max_batch_size)
+    return candidates
+
+
+def calibrate(app, candidates, steps=2):
+    """Measure the throughput of the model for each candidate batch size.
+
+    Each candidate is timed on ``steps`` batches of random tiles of
+    ``app.model_image_shape``, after a warm-up batch. Larger candidates are
+    skipped once a batch size fails, e.g. because it runs out of memory.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        candidates (list): The batch sizes to try, in increasing order.
+        steps (int): The number of batches timed for each candidate.
+
+    Returns:
+        dict: The tiles per second of each batch size that succeeded.
+
+    Raises:
+        Exception: If even the smallest candidate fails.
+    """
+    throughput = {}
+    rng = np.random.default_rng(0)
+    for batch_size in candidates:
+        tiles = rng.random((batch_size * steps,) + tuple(app.model_image_shape),
+                           dtype='float32')
+        try:
+            # the first batch includes graph tracing and allocation
+            app.model.predict(tiles[:batch_size], batch_size=batch_size)
+
+            _ = timeit.default_timer()
+            app.model.predict(tiles, batch_size=batch_size)
+            seconds = timeit.default_timer() - _
+        except Exception as err:  # pylint: disable=broad-except
+            if not throughput:
+                raise
+            logger.warning('Batch size %s failed during calibration: %s',
+                           batch_size, err)
+            break
+
+        throughput[batch_size] = len(tiles) / max(seconds, 1e-9)
+        logger.debug('Batch size %s predicted %.1f tiles/s.',
+                     batch_size, throughput[batch_size])
+
+    return throughput
+
+
+def format_cache_key(class_name, model_image_shape, backend=None,
+                     precision=None):
+    """Returns the key of the cached batch size for this host and a model.
+
+    The key includes the CPUs this process may run on and the memory limit
+    of the host or container, so a batch size calibrated by a process with
+    the whole machine is not reused by a worker with a share of it. Only
+    facts that are the same on every run are used, so later runs skip the
+    calibration.
+
+    Args:
+        class_name (str): The name of the application class.
+        model_image_shape (tuple): The shape of a tile.
+        backend (str): The backend the model is converted to.
+        precision (str): The precision of a converted model.
+
+    Returns:
+        str: The cache key.
+    """
+    memory_limit = get_memory_limit()
+    key = '{}:{}:{}:cpus={}:gpus={}:mem={}'.format(
+        socket.gethostname(),
+        class_name,
+        'x'.join(str(d) for d in model_image_shape),
+        ','.join(str(c) for c in sorted(dca.workers.get_available_cpus())),
+        os.environ.get('CUDA_VISIBLE_DEVICES', ''),
+        '?' if memory_limit is None else memory_limit // 2 ** 20)
+
+    # converted models have their own throughput
+    if backend and backend != 'keras':
+        key += ':{}-{}'.format(backend, precision)
+    return key
+
+
+def get_cache_key(app):
+    """Returns the key of the cached batch size for this host and app.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+
+    Returns:
+        str: The cache key.
+    """
+    return format_cache_key(app.__class__.__name__, app.model_image_shape,
+                            backend=getattr(app, 'backend', None),
+                            precision=getattr(app, 'precision', None))
+
+
+def load_cache(path):
+    """Returns the cached calibrations, or an empty dict if there are none."""
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if not isinstance(cache, dict):
+        return {}
+    # older caches only have the batch size
+    return {k: v if isinstance(v, dict) else {'batch_size': v}
+            for k, v in cache.items()}
+
+
+def save_cache(path, key, batch_size, tiles_per_second=None):
+    """Save a calibration in the cache file, keeping other entries."""
+    with _CACHE_LOCK:
+        cache = load_cache(path)
+        cache[key] = {
+            'batch_size': batch_size,
+            'tiles_per_second': tiles_per_second,
+        }
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # replace the file at once so concurrent readers never see part of it
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+def get_cached_throughput(key, cache_path=DEFAULT_CACHE_PATH):
+    """Returns the calibrated tiles per second of a cache key, if there is one.
+
+    Args:
+        key (str): The cache key from ``format_cache_key``.
+        cache_path (str): JSON file the batch size is cached in.
+
+    Returns:
+        float: The tiles per second of the cached batch size, or ``None``.
+    """
+    if not cache_path:
+        return None
+    return load_cache(cache_path).get(key, {}).get('tiles_per_second')
+
+
+def get_batch_size(app, cache_path=DEFAULT_CACHE_PATH, memory=None):
+    """Returns the batch size with the best throughput that fits in memory.
+
+    The result is cached per host, application configuration, CPU affinity
+    and memory limit, so later runs skip the calibration. A cached batch size
+    is reduced to the largest one that fits in the memory available now.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        cache_path (str): JSON file to cache the batch size in,
+            or ``None`` to always calibrate.
+        memory (int): The available memory in bytes.
+            Defaults to the memory available now.
+
+    Returns:
+        int: The batch size.
+    """
+    max_batch_size = get_max_batch_size(app.model_image_shape, memory=memory)
+
+    key = get_cache_key(app)
+    if cache_path:
+        cached = load_cache(cache_path).get(key, {}).get('batch_size')
+        if cached:
+            batch_size = min(int(cached), max_batch_size)
+            logger.debug('Using cached batch size %s for %s (at most %s fit '
+                         'in memory).', cached, key, max_batch_size)
+            return batch_size
+
+    throughput = calibrate(app, get_candidates(max_batch_size))
+    batch_size = max(throughput, key=throughput.get)
+    logger.info('Calibrated batch size %s (%.1f tiles/s, at most %s fit in '
+                'memory).', batch_size, throughput[batch_size], max_batch_size)
+
+    if cache_path:
+        try:
+            save_cache(cache_path, key, batch_size,
+                       tiles_per_second=throughput[batch_size])
+        except (IOError, OSError) as err:
+            logger.warning('Could not cache the batch size in %s: %s',
+                           cache_path, err)
+
+    return batch_size
+
+
+def resolve_batch_size(app, jobs, cache_path=DEFAULT_CACHE_PATH, memory=None):
+    """Replace an ``auto`` batch size in each job with the chosen batch size.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        jobs (list): Command line args for each input image.
+        cache_path (str): JSON file to cache the batch size in.
+        memory (int): The memory available to the application in bytes.
+            Defaults to the memory available now.
+    """
+    batch_size = None
+    for job in jobs:
+        if job.get('batch_size') == AUTO:
+            if batch_size is None:
+                batch_size = get_batch_size(app, cache_path=cache_path,
+                                            memory=memory)
+            job['batch_size'] = batch_size
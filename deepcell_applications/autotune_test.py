@@ -0,0 +1,164 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.autotune"""
+
+import json
+import os
+
+import numpy as np
+
+import pytest
+
+import deepcell_applications as dca
+
+
+class DummyModel(object):
+
+    def __init__(self, max_batch_size=None):
+        self.max_batch_size = max_batch_size
+        self.batch_sizes = []
+
+    def predict(self, x, batch_size=32):
+        if self.max_batch_size and batch_size > self.max_batch_size:
+            raise MemoryError('batch size {} is too large'.format(batch_size))
+        self.batch_sizes.append(batch_size)
+        return np.zeros(x.shape[:-1] + (1,))
+
+
+class DummyApplication(object):
+
+    def __init__(self, max_batch_size=None):
+        self.model_image_shape = (32, 32, 2)
+        self.required_channels = 2
+        self.model = DummyModel(max_batch_size)
+
+
+def test_get_available_memory():
+    memory = dca.autotune.get_available_memory()
+    assert memory is None or memory > 0
+
+
+def test_get_memory_limit():
+    limit = dca.autotune.get_memory_limit()
+    assert limit is None or limit > 0
+
+
+def test_get_cache_key(mocker):
+    app = DummyApplication()
+    mocker.patch('deepcell_applications.workers.get_available_cpus',
+                 return_value=[0, 1])
+    key = dca.autotune.get_cache_key(app)
+
+    # the key does not depend on the memory available now
+    mocker.patch('deepcell_applications.autotune.get_available_memory',
+                 return_value=1)
+    assert dca.autotune.get_cache_key(app) == key
+
+    # a worker pinned to fewer CPUs has its own key
+    mocker.patch('deepcell_applications.workers.get_available_cpus',
+                 return_value=[0])
+    assert dca.autotune.get_cache_key(app) != key
+
+
+def test_get_max_batch_size():
+    shape = DummyApplication().model_image_shape
+    tile_bytes = dca.autotune.estimate_tile_bytes(shape)
+    assert tile_bytes == 32 * 32 * 2 * 4 * dca.autotune.TILE_MEMORY_FACTOR
+
+    memory = int(tile_bytes * 10 / dca.autotune.MEMORY_FRACTION)
+    assert dca.autotune.get_max_batch_size(shape, memory=memory) == 10
+    assert dca.autotune.get_max_batch_size(shape, memory=memory, limit=4) == 4
+    # at least one tile is always predicted
+    assert dca.autotune.get_max_batch_size(shape, memory=1) == 1
+
+
+def test_get_candidates():
+    assert dca.autotune.get_candidates(1) == [1]
+    assert dca.autotune.get_candidates(8) == [1, 2, 4, 8]
+    assert dca.autotune.get_candidates(10) == [1, 2, 4, 8, 10]
+
+
+def test_calibrate():
+    app = DummyApplication()
+    throughput = dca.autotune.calibrate(app, [1, 2, 4])
+    assert sorted(throughput) == [1, 2, 4]
+    assert all(t > 0 for t in throughput.values())
+
+    # larger batch sizes are skipped once one fails
+    app = DummyApplication(max_batch_size=2)
+    throughput = dca.autotune.calibrate(app, [1, 2, 4, 8])
+    assert sorted(throughput) == [1, 2]
+    assert 8 not in app.model.batch_sizes
+
+    # the smallest batch size must succeed
+    app = DummyApplication(max_batch_size=1)
+    with pytest.raises(MemoryError):
+        dca.autotune.calibrate(app, [2, 4])
+
+
+def test_get_batch_size(tmpdir, mocker):
+    cache_path = os.path.join(str(tmpdir), 'cache', 'batch_size.json')
+    app = DummyApplication(max_batch_size=4)
+    memory = int(dca.autotune.estimate_tile_bytes(app.model_image_shape) * 8 /
+                 dca.autotune.MEMORY_FRACTION)
+
+    batch_size = dca.autotune.get_batch_size(app, cache_path=cache_path,
+                                             memory=memory)
+    assert batch_size in (1, 2, 4)
+
+    with open(cache_path) as f:
+        cache = json.load(f)
+    key = dca.autotune.get_cache_key(app)
+    assert list(cache) == [key]
+    assert cache[key]['batch_size'] == batch_size
+    assert dca.autotune.get_cached_throughput(key, cache_path) > 0
+
+    # the cached value skips the calibration
+    spy = mocker.spy(dca.autotune, 'calibrate')
+    assert dca.autotune.get_batch_size(app, cache_path=cache_path,
+                                       memory=memory) == batch_size
+    spy.assert_not_called()
+
+    # with less memory available now, the cached value is reduced to fit
+    assert dca.autotune.get_batch_size(app, cache_path=cache_path,
+                                       memory=memory // 8) == 1
+    spy.assert_not_called()
+    with open(cache_path) as f:
+        assert len(json.load(f)) == 1
+
+    # older caches only have the batch size
+    with open(cache_path, 'w') as f:
+        json.dump({key: 2}, f)
+    assert dca.autotune.get_batch_size(app, cache_path=cache_path,
+                                       memory=memory) == 2
+    assert dca.autotune.get_cached_throughput(key, cache_path) is None
+    batch_size = 2
+
+    # only jobs with an automatic batch size are changed
+    jobs = [{'batch_size': 'auto'}, {'batch_size': 3}]
+    dca.autotune.resolve_batch_size(app, jobs, cache_path=cache_path,
+                                    memory=memory)
+    assert jobs == [{'batch_size': batch_size}, {'batch_size': 3}]
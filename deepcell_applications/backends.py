@@ -0,0 +1,569 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Functions for running applications with other inference backends"""
+
+import importlib.util
+import logging
+import os
+import tempfile
+import timeit
+
+import numpy as np
+
+import deepcell_applications as dca
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BACKEND = 'keras'
+DEFAULT_PRECISION = 'float32'
+BACKENDS = ('keras', 'tflite', 'onnx')
+PRECISIONS = ('float32', 'float16', 'int8')
+
+# Modules required by each backend, and by each precision of a backend,
+# mapped to the package that installs them.
+BACKEND_REQUIREMENTS = {
+    ('tflite', None): {'tensorflow': 'tensorflow'},
+    ('onnx', None): {
+        'tensorflow': 'tensorflow',
+        'tf2onnx': 'tf2onnx',
+        'onnxruntime': 'onnxruntime',
+    },
+    ('onnx', 'float16'): {'onnxconverter_common': 'onnxconverter-common'},
+    ('onnx', 'int8'): {'onnx': 'onnx'},
+}
+
+# IoU above which a predicted object matches a reference object
+MATCH_THRESHOLD = 0.5
+
+
+def _predict_batches(run, x, batch_size):
+    # run each batch and concatenate the outputs of each head
+    batch_size = max(1, int(batch_size or 1))
+    outputs = None
+    for i in range(0, len(x), batch_size):
+        batch = run(np.ascontiguousarray(x[i:i + batch_size], dtype='float32'))
+        if outputs is None:
+            outputs = [[] for _ in batch]
+        for output, head in zip(outputs, batch):
+            output.append(head)
+
+    outputs = [np.concatenate(o, axis=0) for o in outputs or []]
+    return outputs[0] if len(outputs) == 1 else outputs
+
+
+class TFLiteModel(object):
+    """A TF-Lite graph with the ``predict`` interface of a Keras model.
+
+    Args:
+        content (bytes): The converted TF-Lite model.
+        output_names (list): The names of the outputs of the Keras model,
+            so the outputs are returned in the same order.
+        num_threads (int): Number of threads used by the interpreter.
+    """
+
+    def __init__(self, content, output_names, num_threads=None):
+        import tensorflow as tf  # pylint: disable=import-outside-toplevel
+
+        self.interpreter = tf.lite.Interpreter(model_content=content,
+                                               num_threads=num_threads)
+        self.runner = self.interpreter.get_signature_runner()
+        self.input_name = list(self.runner.get_input_details())[0]
+        self.output_names = list(output_names)
+
+        # Keras 3 names the signature outputs output_0, output_1, ...
+        signature_names = set(self.runner.get_output_details())
+        if not signature_names.issuperset(self.output_names):
+            self.output_names = ['output_{}'.format(i)
+                                 for i in range(len(signature_names))]
+
+    def _run(self, batch):
+        outputs = self.runner(**{self.input_name: batch})
+        return [outputs[name] for name in self.output_names]
+
+    def predict(self, x, batch_size=32, **_):
+        return _predict_batches(self._run, x, batch_size)
+
+
+class ONNXModel(object):
+    """An ONNX Runtime session with the ``predict`` interface of a Keras model.
+
+    Args:
+        content (bytes): The serialized ONNX model.
+        output_names (list): The names of the outputs of the Keras model,
+            so the outputs are returned in the same order.
+        num_threads (int): Number of threads used by each operator.
+    """
+
+    def __init__(self, content, output_names, num_threads=None):
+        import onnxruntime as ort  # pylint: disable=import-outside-toplevel
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            content, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_names = list(output_names)
+
+        # outputs are not named after the Keras model by every tf2onnx version
+        session_names = [o.name for o in self.session.get_outputs()]
+        if not set(session_names).issuperset(self.output_names):
+            self.output_names = session_names
+
+    def _run(self, batch):
+        return self.session.run(self.output_names, {self.input_name: batch})
+
+    def predict(self, x, batch_size=32, **_):
+        return _predict_batches(self._run, x, batch_size)
+
+
+class RecordingModel(object):
+    """Wraps a model and keeps a copy of the tiles it predicts on."""
+
+    def __init__(self, model):
+        self.model = model
+        self.inputs = []
+
+    def predict(self, x, *args, **kwargs):
+        self.inputs.append(np.array(x, dtype='float32'))
+        return self.model.predict(x, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+def get_model_inputs(app, image, count=8, **kwargs):
+    """Returns tiles that ``app.predict`` passes to its model for an input.
+
+    The tiles are preprocessed like any other input, so they are
+    representative samples to calibrate ``int8`` quantization.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        image (numpy.array): A batch of input images.
+        count (int): The maximum number of tiles, spread across the input.
+        kwargs (dict): Keyword arguments of ``app.predict``.
+
+    Returns:
+        numpy.array: The model inputs.
+    """
+    model = app.model
+    app.model = recorder = RecordingModel(model)
+    try:
+        app.predict(image, **kwargs)
+    finally:
+        app.model = model
+
+    tiles = np.concatenate(recorder.inputs, axis=0)
+    index = np.unique(np.linspace(0, len(tiles) - 1, count).astype('int'))
+    return tiles[index]
+
+
+def get_sample_tiles(model_image_shape, count=8, seed=0):
+    """Returns random tiles used to calibrate int8 quantization."""
+    rng = np.random.default_rng(seed)
+    return rng.random((count,) + tuple(model_image_shape), dtype='float32')
+
+
+def convert_tflite(model, precision=DEFAULT_PRECISION, samples=None,
+                   num_threads=None):
+    """Convert a Keras model to a TF-Lite graph.
+
+    Args:
+        model (tf.keras.Model): The Keras model.
+        precision (str): ``float32``, ``float16`` weights, or ``int8``
+            weights and activations calibrated on ``samples``.
+        samples (numpy.array): Representative tiles for ``int8``.
+        num_threads (int): Number of threads used by the interpreter.
+
+    Returns:
+        TFLiteModel: The converted model.
+    """
+    import tensorflow as tf  # pylint: disable=import-outside-toplevel
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if precision == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif precision == 'int8':
+        if samples is None:
+            samples = get_sample_tiles(model.input_shape[1:])
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        # the inputs and outputs stay float32, so the application is unchanged
+        converter.representative_dataset = lambda: (
+            [s[np.newaxis]] for s in np.asarray(samples, dtype='float32'))
+
+    return TFLiteModel(converter.convert(), model.output_names,
+                       num_threads=num_threads)
+
+
+def convert_onnx(model, precision=DEFAULT_PRECISION, samples=None,
+                 num_threads=None):
+    """Convert a Keras model to an ONNX Runtime session.
+
+    Args:
+        model (tf.keras.Model): The Keras model.
+        precision (str): ``float32``, ``float16`` weights and activations,
+            or dynamically quantized ``int8`` weights.
+        samples (numpy.array): Unused, ``int8`` is quantized dynamically.
+        num_threads (int): Number of threads used by each operator.
+
+    Returns:
+        ONNXModel: The converted model.
+    """
+    # pylint: disable=import-outside-toplevel
+    import tensorflow as tf
+    import tf2onnx
+
+    spec = [tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32,
+                          name='input')]
+    onnx_model, _ = tf2onnx.convert.from_keras(
+        model, input_signature=spec, opset=13)
+
+    if precision == 'float16':
+        from onnxconverter_common import float16
+        onnx_model = float16.convert_float_to_float16(onnx_model,
+                                                      keep_io_types=True)
+    elif precision == 'int8':
+        import onnx
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'model.onnx')
+            quantized_path = os.path.join(tmpdir, 'model.int8.onnx')
+            onnx.save(onnx_model, path)
+            quantize_dynamic(path, quantized_path, weight_type=QuantType.QInt8)
+            onnx_model = onnx.load(quantized_path)
+
+    return ONNXModel(onnx_model.SerializeToString(), model.output_names,
+                     num_threads=num_threads)
+
+
+def check_requirements(backend, precision=DEFAULT_PRECISION):
+    """Check that the packages needed to convert a model are installed.
+
+    The modules are only looked up, not imported, so a missing package
+    fails before the model is converted.
+
+    Args:
+        backend (str): ``keras``, ``tflite`` or ``onnx``.
+        precision (str): ``float32``, ``float16`` or ``int8``.
+
+    Raises:
+        ImportError: If any required package is not installed.
+    """
+    required = {}
+    for key in ((backend, None), (backend, precision)):
+        required.update(BACKEND_REQUIREMENTS.get(key, {}))
+
+    missing = sorted({package for module, package in required.items()
+                      if importlib.util.find_spec(module) is None})
+    if missing:
+        raise ImportError('The {} backend with {} precision requires {}. '
+                          'Install with `pip install {}`.'.format(
+                              backend, precision, ', '.join(missing),
+                              ' '.join(missing)))
+
+
+CONVERTERS = {
+    'tflite': convert_tflite,
+    'onnx': convert_onnx,
+}
+
+
+def get_backend_options(name, backend=None, precision=None):
+    """Returns the backend and precision of an application.
+
+    Args:
+        name (str): The name of the application.
+        backend (str): The backend, defaults to the one in its settings.
+        precision (str): The precision, defaults to the one in its settings.
+
+    Returns:
+        tuple: The ``(backend, precision)``.
+
+    Raises:
+        ValueError: If the backend or precision is not supported.
+    """
+    settings = dca.settings.VALID_APPLICATIONS.get(str(name).lower(), {})
+    backend = backend or settings.get('backend', DEFAULT_BACKEND)
+    precision = precision or settings.get('precision', DEFAULT_PRECISION)
+
+    if backend not in BACKENDS:
+        raise ValueError('Invalid backend {}. Valid backends: {}'.format(
+            backend, list(BACKENDS)))
+    if precision not in PRECISIONS:
+        raise ValueError('Invalid precision {}. Valid precisions: {}'.format(
+            precision, list(PRECISIONS)))
+    if backend == 'keras' and precision != 'float32':
+        raise ValueError('The keras backend only runs with float32 precision.')
+
+    return backend, precision
+
+
+def set_backend(app, backend=DEFAULT_BACKEND, precision=DEFAULT_PRECISION,
+                samples=None, num_threads=None):
+    """Replace the model of an application with a converted graph.
+
+    ``app.predict`` runs ``app.model.predict`` on batches of tiles,
+    so the converted graph is used for prediction while the pre- and
+    post-processing of the application are unchanged.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        backend (str): ``keras``, ``tflite`` or ``onnx``.
+        precision (str): ``float32``, ``float16`` or ``int8``.
+        samples (numpy.array): Representative tiles to calibrate ``int8``.
+            Defaults to random tiles.
+        num_threads (int): Number of threads used by the backend.
+
+    Returns:
+        deepcell.applications.Application: The same application.
+
+    Raises:
+        ImportError: If a package needed by the backend is not installed.
+    """
+    if backend != DEFAULT_BACKEND:
+        check_requirements(backend, precision)
+        if samples is None and precision == 'int8':
+            samples = get_sample_tiles(app.model_image_shape)
+        app.model = CONVERTERS[backend](app.model, precision=precision,
+                                        samples=samples,
+                                        num_threads=num_threads)
+        logger.info('Converted the %s model to %s with %s precision.',
+                    app.__class__.__name__, backend, precision)
+
+    app.backend = backend
+    app.precision = precision
+    return app
+
+
+def get_app(name, backend=None, precision=None, **kwargs):
+    """Returns an instantiated application running on the given backend.
+
+    Args:
+        name (str): The name of the application.
+        backend (str): The backend, defaults to the one in its settings.
+        precision (str): The precision, defaults to the one in its settings.
+        kwargs (dict): Keyword arguments used for application instantiation.
+
+    Returns:
+        deepcell.applications.Application: The instantiated application.
+    """
+    backend, precision = get_backend_options(name, backend, precision)
+    return set_backend(dca.utils.get_app(name, **kwargs), backend, precision)
+
+
+def match_labels(y_true, y_pred, threshold=MATCH_THRESHOLD):
+    """Returns the agreement of predicted labels with reference labels.
+
+    Objects match if their IoU is above ``threshold``. With a threshold of
+    at least 0.5, each object matches at most one other object.
+
+    Args:
+        y_true (numpy.array): The reference labels.
+        y_pred (numpy.array): The predicted labels, of the same shape.
+        threshold (float): The IoU above which objects match.
+
+    Returns:
+        dict: The number of ``true`` and ``pred`` objects, the ``matched``
+            objects, their ``precision``, ``recall`` and ``f1``, and the
+            ``mean_iou`` of each reference object with its best match.
+    """
+    y_true = np.asarray(y_true).ravel().astype('int64')
+    y_pred = np.asarray(y_pred).ravel().astype('int64')
+    if y_true.shape != y_pred.shape:
+        raise ValueError('Labels of shape {} and {} can not be compared.'.format(
+            y_true.shape, y_pred.shape))
+
+    # the overlap of each pair of labels that are both objects
+    objects = (y_true > 0) & (y_pred > 0)
+    pairs = y_true[objects] * (y_pred.max() + 1) + y_pred[objects]
+    pairs, intersection = np.unique(pairs, return_counts=True)
+    true_ids, pred_ids = np.divmod(pairs, y_pred.max() + 1)
+
+    true_area = np.bincount(y_true)
+    pred_area = np.bincount(y_pred)
+    iou = intersection / (true_area[true_ids] + pred_area[pred_ids] - intersection)
+
+    n_true = int(np.count_nonzero(true_area[1:]))
+    n_pred = int(np.count_nonzero(pred_area[1:]))
+    matched = int(np.count_nonzero(iou > threshold))
+
+    # the best IoU of each reference object, 0 if it overlaps nothing
+    best = np.zeros(len(true_area))
+    np.maximum.at(best, true_ids, iou)
+    present = np.flatnonzero(true_area[1:]) + 1
+    mean_iou = float(best[present].mean()) if n_true else 1.0
+
+    precision = matched / n_pred if n_pred else 1.0
+    recall = matched / n_true if n_true else 1.0
+    f1 = (2 * precision * recall / (precision + recall)
+          if precision + recall else 0.0)
+
+    return {
+        'true': n_true,
+        'pred': n_pred,
+        'matched': matched,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'mean_iou': mean_iou,
+    }
+
+
+def combine_matches(matches):
+    """Returns the agreement over several images from their ``match_labels``."""
+    n_true = sum(m['true'] for m in matches)
+    n_pred = sum(m['pred'] for m in matches)
+    matched = sum(m['matched'] for m in matches)
+
+    precision = matched / n_pred if n_pred else 1.0
+    recall = matched / n_true if n_true else 1.0
+    f1 = (2 * precision * recall / (precision + recall)
+          if precision + recall else 0.0)
+    # weighted by the number of reference objects of each image
+    mean_iou = (sum(m['mean_iou'] * m['true'] for m in matches) / n_true
+                if n_true else 1.0)
+
+    return {
+        'true': n_true,
+        'pred': n_pred,
+        'matched': matched,
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'mean_iou': mean_iou,
+    }
+
+
+def compare_outputs(expected, output, threshold=MATCH_THRESHOLD):
+    """Returns the agreement of two outputs, per image and label channel."""
+    expected = np.asarray(expected)
+    output = np.asarray(output)
+    if expected.shape != output.shape:
+        raise ValueError('Outputs of shape {} and {} can not be compared.'.format(
+            expected.shape, output.shape))
+
+    if expected.ndim < 3:
+        return match_labels(expected, output, threshold)
+
+    # each image of the batch and each compartment is labeled separately
+    expected = expected.reshape((-1,) + expected.shape[-3:-1] + expected.shape[-1:])
+    output = output.reshape(expected.shape)
+    return combine_matches([
+        match_labels(expected[i, ..., c], output[i, ..., c], threshold)
+        for i in range(expected.shape[0]) for c in range(expected.shape[-1])])
+
+
+def check_accuracy(reference, app, jobs, threshold=MATCH_THRESHOLD):
+    """Compare the labels of an application with those of a reference.
+
+    Each input is loaded once and predicted by both applications, and
+    nothing is written. Both applications predict the first input once
+    before they are timed, so compiling the models is not timed.
+
+    Args:
+        reference (deepcell.applications.Application): The application
+            on the reference backend.
+        app (deepcell.applications.Application): The application on the
+            backend to check.
+        jobs (list): Command line args for each sample input image.
+        threshold (float): The IoU above which objects match.
+
+    Returns:
+        list: The agreement and the time of both applications for each job.
+    """
+    reports = []
+    for i, job in enumerate(jobs):
+        image = dca.app_runners.load_job(reference, job)
+        kwargs = dca.utils.get_predict_kwargs(job)
+
+        if not i:
+            # trace and compile both models before they are timed
+            reference.predict(image, **kwargs)
+            app.predict(image, **kwargs)
+
+        _ = timeit.default_timer()
+        expected = reference.predict(image, **kwargs)
+        reference_seconds = timeit.default_timer() - _
+
+        _ = timeit.default_timer()
+        output = app.predict(image, **kwargs)
+        seconds = timeit.default_timer() - _
+
+        report = compare_outputs(expected, output, threshold)
+        report.update({
+            'input': job.get('nuclear_path'),
+            'reference_seconds': reference_seconds,
+            'seconds': seconds,
+        })
+        logger.info('%s: F1 %.4f, mean IoU %.4f, %.3f s vs %.3f s.',
+                    report['input'], report['f1'], report['mean_iou'],
+                    seconds, reference_seconds)
+        reports.append(report)
+
+    return reports
+
+
+def format_report(reports, backend=None, precision=None):
+    """Returns a table of the agreement and speedup of each sample and overall.
+
+    Args:
+        reports (list): The report of each job from ``check_accuracy``.
+        backend (str): The checked backend.
+        precision (str): The checked precision.
+
+    Returns:
+        str: The formatted report.
+    """
+    total = combine_matches(reports)
+    total.update({
+        'input': 'total: {} samples'.format(len(reports)),
+        'reference_seconds': sum(r['reference_seconds'] for r in reports),
+        'seconds': sum(r['seconds'] for r in reports),
+    })
+
+    rows = [('input', 'objects', 'matched', 'f1', 'mean_iou', 'speedup')]
+    for r in reports + [total]:
+        rows.append((
+            os.path.basename(str(r['input'])),
+            str(r['true']),
+            str(r['matched']),
+            '{:.4f}'.format(r['f1']),
+            '{:.4f}'.format(r['mean_iou']),
+            '{:.2f}x'.format(r['reference_seconds'] / max(r['seconds'], 1e-9)),
+        ))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ['  '.join(v.ljust(w) for v, w in zip(row, widths)).rstrip()
+             for row in rows]
+    if backend:
+        lines.insert(0, 'Agreement of {} ({}) with keras (float32):'.format(
+            backend, precision))
+    return '\n'.join(lines)
@@ -0,0 +1,270 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.backends"""
+
+import logging
+
+import numpy as np
+
+import pytest
+
+import deepcell_applications as dca
+
+
+class DummyModel(object):
+
+    output_names = ['inner', 'pixelwise']
+
+    def __init__(self, offset=0):
+        self.offset = offset
+        self.batches = []
+
+    def predict(self, x, batch_size=32, **_):
+        self.batches.append(len(x))
+        return [x[..., :1] + self.offset, x[..., 1:] + self.offset]
+
+
+class DummyApplication(object):
+
+    def __init__(self, *args, **kwargs):
+        self.model_image_shape = (16, 16, 2)
+        self.required_channels = 2
+        self.logger = logging.getLogger('DummyApplication')
+        self.model = DummyModel()
+
+    def predict(self, image, batch_size=4, **kwargs):
+        # split the image into tiles, like deepcell applications
+        tiles = image.reshape((-1,) + self.model_image_shape)
+        outputs = self.model.predict(tiles, batch_size=batch_size)
+        labels = (outputs[0][..., 0] > 0.5).astype('int32')
+        return labels.reshape(image.shape[:-1] + (1,))
+
+
+def test_predict_batches():
+    x = np.arange(10, dtype='float32').reshape((10, 1))
+    batches = []
+
+    def run(batch):
+        batches.append(len(batch))
+        return [batch * 2, batch + 1]
+
+    outputs = dca.backends._predict_batches(run, x, batch_size=4)
+    assert batches == [4, 4, 2]
+    np.testing.assert_array_equal(outputs[0], x * 2)
+    np.testing.assert_array_equal(outputs[1], x + 1)
+
+    # a single head is returned as an array
+    output = dca.backends._predict_batches(lambda b: [b], x, batch_size=3)
+    np.testing.assert_array_equal(output, x)
+
+
+def test_match_labels():
+    y_true = np.zeros((10, 10), dtype='int32')
+    y_true[:4, :4] = 1
+    y_true[6:, 6:] = 2
+    y_true[:2, 8:] = 3
+
+    # identical labels agree, even with other label ids
+    match = dca.backends.match_labels(y_true, y_true * 7)
+    assert match['true'] == match['pred'] == match['matched'] == 3
+    assert match['f1'] == 1.0
+    assert match['mean_iou'] == 1.0
+
+    # a shrunk object still matches, a missing object does not
+    y_pred = y_true.copy()
+    y_pred[:4, 3] = 0
+    y_pred[y_true == 3] = 0
+    y_pred[8:, :2] = 5
+    match = dca.backends.match_labels(y_true, y_pred)
+    assert match['true'] == 3
+    assert match['pred'] == 3
+    assert match['matched'] == 2
+    assert match['precision'] == match['recall'] == pytest.approx(2 / 3)
+    assert match['f1'] == pytest.approx(2 / 3)
+    assert match['mean_iou'] == pytest.approx((12 / 16 + 1 + 0) / 3)
+
+    # empty labels agree
+    empty = np.zeros((4, 4))
+    assert dca.backends.match_labels(empty, empty)['f1'] == 1.0
+    assert dca.backends.match_labels(empty, y_true[:4, :4])['f1'] == 0.0
+
+    with pytest.raises(ValueError):
+        dca.backends.match_labels(empty, y_true)
+
+
+def test_compare_outputs():
+    labels = np.zeros((2, 8, 8, 2), dtype='int32')
+    labels[:, :4, :4, 0] = 1
+    labels[:, 4:, 4:, 1] = 1
+
+    # each image and compartment is compared separately
+    match = dca.backends.compare_outputs(labels, labels)
+    assert match['true'] == match['matched'] == 4
+
+    other = labels.copy()
+    other[1] = 0
+    match = dca.backends.compare_outputs(labels, other)
+    assert match['matched'] == 2
+    assert match['recall'] == 0.5
+    assert match['precision'] == 1.0
+
+    with pytest.raises(ValueError):
+        dca.backends.compare_outputs(labels, labels[0])
+
+
+def test_get_backend_options(mocker):
+    assert dca.backends.get_backend_options('mesmer') == ('keras', 'float32')
+    assert dca.backends.get_backend_options(
+        'mesmer', 'onnx', 'float16') == ('onnx', 'float16')
+
+    with pytest.raises(ValueError):
+        dca.backends.get_backend_options('mesmer', 'unknown')
+    with pytest.raises(ValueError):
+        dca.backends.get_backend_options('mesmer', 'tflite', 'int4')
+    with pytest.raises(ValueError):
+        dca.backends.get_backend_options('mesmer', 'keras', 'int8')
+
+
+def test_check_requirements(mocker):
+    # keras needs no other packages
+    dca.backends.check_requirements('keras')
+
+    installed = {'tensorflow', 'tf2onnx', 'onnxruntime'}
+    mocker.patch('importlib.util.find_spec',
+                 side_effect=lambda name: object() if name in installed else None)
+    dca.backends.check_requirements('tflite', 'int8')
+    dca.backends.check_requirements('onnx', 'float32')
+
+    # the missing package is named before the model is converted
+    with pytest.raises(ImportError, match='onnxconverter-common'):
+        dca.backends.check_requirements('onnx', 'float16')
+    with pytest.raises(ImportError, match='pip install onnx'):
+        dca.backends.check_requirements('onnx', 'int8')
+
+
+def _keras_model(model_image_shape):
+    tf = pytest.importorskip('tensorflow')
+    inputs = tf.keras.Input(model_image_shape)
+    x = tf.keras.layers.Conv2D(2, 3, padding='same')(inputs)
+    outputs = [tf.keras.layers.Conv2D(1, 1, name=name)(x)
+               for name in DummyModel.output_names]
+    return tf.keras.Model(inputs, outputs)
+
+
+@pytest.mark.parametrize('precision', ['float32', 'float16', 'int8'])
+def test_convert_tflite(precision):
+    model = _keras_model((16, 16, 2))
+    x = dca.backends.get_sample_tiles((16, 16, 2), count=3)
+
+    converted = dca.backends.convert_tflite(model, precision=precision,
+                                            samples=x)
+    outputs = converted.predict(x, batch_size=2)
+    expected = model.predict(x)
+    assert [o.shape for o in outputs] == [e.shape for e in expected]
+    if precision == 'float32':
+        for output, e in zip(outputs, expected):
+            np.testing.assert_allclose(output, e, atol=1e-4)
+
+
+@pytest.mark.parametrize('precision,module', [
+    ('float32', 'tf2onnx'),
+    ('float16', 'onnxconverter_common'),
+    ('int8', 'onnx'),
+])
+def test_convert_onnx(precision, module):
+    for name in ('tf2onnx', 'onnxruntime', module):
+        pytest.importorskip(name)
+    model = _keras_model((16, 16, 2))
+    x = dca.backends.get_sample_tiles((16, 16, 2), count=3)
+
+    converted = dca.backends.convert_onnx(model, precision=precision)
+    outputs = converted.predict(x, batch_size=2)
+    expected = model.predict(x)
+    assert [o.shape for o in outputs] == [e.shape for e in expected]
+    if precision == 'float32':
+        for output, e in zip(outputs, expected):
+            np.testing.assert_allclose(output, e, atol=1e-4)
+
+
+def test_set_backend(mocker):
+    app = DummyApplication()
+    model = app.model
+
+    # the keras model is kept
+    dca.backends.set_backend(app)
+    assert app.model is model
+    assert (app.backend, app.precision) == ('keras', 'float32')
+
+    mocker.patch('deepcell_applications.backends.check_requirements')
+    converted = DummyModel()
+    convert = mocker.Mock(return_value=converted)
+    mocker.patch.dict(dca.backends.CONVERTERS, {'tflite': convert})
+    dca.backends.set_backend(app, 'tflite', 'int8')
+    assert app.model is converted
+    assert (app.backend, app.precision) == ('tflite', 'int8')
+    assert convert.call_args[0][0] is model
+    # int8 is calibrated on sample tiles of the model input shape
+    assert convert.call_args[1]['samples'].shape[1:] == (16, 16, 2)
+
+
+def test_get_model_inputs():
+    app = DummyApplication()
+    model = app.model
+    image = np.random.random((1, 64, 16, 2)).astype('float32')
+
+    tiles = dca.backends.get_model_inputs(app, image, count=3)
+    assert tiles.shape == (3, 16, 16, 2)
+    np.testing.assert_array_equal(tiles[0], image.reshape((-1, 16, 16, 2))[0])
+    assert app.model is model
+
+
+def test_check_accuracy(tmpdir, mocker):
+    reference = DummyApplication()
+    app = DummyApplication()
+    app.model = DummyModel(offset=0.1)
+
+    images = [np.random.random((1, 16, 16, 2)).astype('float32') for _ in range(2)]
+    mocker.patch('deepcell_applications.app_runners.load_job',
+                 side_effect=lambda _, job: images[job['index']])
+    jobs = [{'app': 'mesmer', 'nuclear_path': 'img{}.tif'.format(i), 'index': i,
+             'batch_size': 4, 'image_mpp': 0.5, 'compartment': 'whole-cell'}
+            for i in range(2)]
+
+    reference_predict = mocker.spy(reference, 'predict')
+    predict = mocker.spy(app, 'predict')
+
+    reports = dca.backends.check_accuracy(reference, app, jobs)
+    assert [r['input'] for r in reports] == ['img0.tif', 'img1.tif']
+    # both models predict once before they are timed
+    assert reference_predict.call_count == predict.call_count == 3
+    for r in reports:
+        assert 0 <= r['f1'] <= 1
+        assert r['seconds'] >= 0 and r['reference_seconds'] >= 0
+
+    table = dca.backends.format_report(reports, 'tflite', 'int8')
+    lines = table.splitlines()
+    assert 'tflite (int8)' in lines[0]
+    assert lines[-1].startswith('total: 2 samples')
@@ -0,0 +1,223 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Functions for expanding command line inputs into a batch of jobs"""
+
+import copy
+import csv
+import glob
+import os
+
+import deepcell_applications as dca
+
+
+# file extensions that are considered images when listing a directory
+IMAGE_EXTENSIONS = ('.tif', '.tiff', '.png', '.jpg', '.jpeg', '.zarr')
+
+
+def expand_path(path):
+    """Expand a file, directory, or glob pattern into a sorted list of files.
+
+    Args:
+        path (str): A path to a single file, a directory of image files,
+            or a glob pattern matching image files.
+
+    Returns:
+        list: Sorted list of paths to the matching files.
+
+    Raises:
+        IOError: If no files are found.
+    """
+    if os.path.isdir(path):
+        paths = [os.path.join(path, f) for f in os.listdir(path)
+                 if f.lower().endswith(IMAGE_EXTENSIONS)
+                 and not f.startswith('.')]
+    elif glob.has_magic(path):
+        paths = [p for p in glob.glob(path)
+                 if os.path.isfile(p) or dca.io.is_zarr(p)]
+    else:
+        paths = [path]
+
+    if not paths:
+        raise IOError('No image files found in {}'.format(path))
+
+    return sorted(paths)
+
+
+def is_batch_path(path):
+    """Returns True if the path refers to more than a single image."""
+    if not path:
+        return False
+    if os.path.isdir(path):
+        return not dca.io.is_zarr(path)
+    return glob.has_magic(path)
+
+
+def _parse_channels(value, default):
+    # manifest channels are space separated integers, e.g. "0 1 2"
+    if value is None or not str(value).strip():
+        return default
+    return [int(c) for c in str(value).split()]
+
+
+def read_manifest(path):
+    """Read a CSV manifest of input images.
+
+    The manifest must have a header with a ``nuclear_path`` column.
+    The optional columns ``membrane_path``, ``output_name``,
+    ``nuclear_channel`` and ``membrane_channel`` override the
+    command line values for the given row. Channels are space separated.
+    Relative paths are resolved relative to the manifest file.
+
+    Args:
+        path (str): Path to the CSV manifest file.
+
+    Returns:
+        list: A list of dictionaries, one for each row in the manifest.
+
+    Raises:
+        ValueError: If the manifest has no ``nuclear_path`` column.
+    """
+    root = os.path.dirname(os.path.abspath(path))
+
+    def resolve(p):
+        p = (p or '').strip()
+        if not p:
+            return None
+        return p if os.path.isabs(p) else os.path.join(root, p)
+
+    rows = []
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        if 'nuclear_path' not in (reader.fieldnames or []):
+            raise ValueError('Manifest {} must have a `nuclear_path` '
+                             'column.'.format(path))
+        for row in reader:
+            if not (row.get('nuclear_path') or '').strip():
+                continue  # skip blank lines
+            rows.append({
+                'nuclear_path': resolve(row.get('nuclear_path')),
+                'membrane_path': resolve(row.get('membrane_path')),
+                'output_name': (row.get('output_name') or '').strip() or None,
+                'nuclear_channel': row.get('nuclear_channel'),
+                'membrane_channel': row.get('membrane_channel'),
+            })
+    return rows
+
+
+def get_output_name(nuclear_path, output_name):
+    """Returns a unique output name for a batched input file."""
+    stem = os.path.splitext(os.path.basename(nuclear_path))[0]
+    return '{}_{}'.format(stem, output_name)
+
+
+def pair_membrane_path(nuclear_path, membrane_paths):
+    """Returns the membrane image with the same file name as a nuclear image.
+
+    Args:
+        nuclear_path (str): Path to the nuclear image.
+        membrane_paths (dict): Membrane image paths by file name.
+
+    Returns:
+        str: Path to the paired membrane image.
+
+    Raises:
+        ValueError: If there is no membrane image with the same file name.
+    """
+    try:
+        return membrane_paths[os.path.basename(nuclear_path)]
+    except KeyError:
+        raise ValueError('No membrane image found for nuclear '
+                         'image {}'.format(nuclear_path))
+
+
+def get_jobs(arg_dict):
+    """Expand the command line arguments into one set of arguments per image.
+
+    A job is created for each nuclear image found by ``manifest``, or by
+    expanding ``nuclear_path`` if it is a directory or glob pattern.
+    In the batch case, ``membrane_path`` may also be a directory or glob
+    pattern, and membrane images are paired with nuclear images by file name,
+    including the manifest rows without a ``membrane_path``.
+
+    Args:
+        arg_dict (dict): Parsed command line arguments.
+
+    Returns:
+        list: A list of argument dictionaries, one per input image.
+
+    Raises:
+        ValueError: If membrane images can not be paired with nuclear images
+            or if two jobs would write to the same output file.
+    """
+    output_name = arg_dict.get('output_name')
+    manifest = arg_dict.get('manifest')
+    nuclear_path = arg_dict.get('nuclear_path')
+    membrane_path = arg_dict.get('membrane_path')
+
+    if not manifest and not is_batch_path(nuclear_path):
+        # a single image, nothing to expand
+        return [arg_dict]
+
+    if is_batch_path(membrane_path):
+        membrane_paths = {os.path.basename(p): p
+                          for p in expand_path(membrane_path)}
+    else:
+        membrane_paths = {}
+
+    if manifest:
+        rows = read_manifest(manifest)
+        for row in rows:
+            if not row['membrane_path'] and membrane_paths:
+                row['membrane_path'] = pair_membrane_path(
+                    row['nuclear_path'], membrane_paths)
+            row['membrane_path'] = row['membrane_path'] or membrane_path
+            row['nuclear_channel'] = _parse_channels(
+                row['nuclear_channel'], arg_dict.get('nuclear_channel', 0))
+            row['membrane_channel'] = _parse_channels(
+                row['membrane_channel'], arg_dict.get('membrane_channel', 0))
+
+    else:
+        rows = []
+        for path in expand_path(nuclear_path):
+            row = {'nuclear_path': path, 'membrane_path': membrane_path}
+            if membrane_paths:
+                row['membrane_path'] = pair_membrane_path(path, membrane_paths)
+            rows.append(row)
+
+    jobs = []
+    for row in rows:
+        job = copy.copy(arg_dict)
+        job.update({k: v for k, v in row.items() if v is not None})
+        if not row.get('output_name'):
+            job['output_name'] = get_output_name(row['nuclear_path'], output_name)
+        jobs.append(job)
+
+    output_names = [job['output_name'] for job in jobs]
+    if len(set(output_names)) != len(output_names):
+        raise ValueError('Multiple inputs would write to the same output file. '
+                         'Use unique file names or `output_name` in the manifest.')
+
+    return jobs
@@ -0,0 +1,174 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.batch"""
+
+import os
+
+import pytest
+
+import deepcell_applications as dca
+
+
+def _touch(path):
+    with open(path, 'w'):
+        pass
+
+
+def test_expand_path(tmpdir):
+    temp_dir = str(tmpdir)
+    names = ['b.tif', 'a.tiff', 'c.png']
+    for name in names + ['notes.txt', '.hidden.tif']:
+        _touch(os.path.join(temp_dir, name))
+
+    # directories are expanded to sorted image files
+    paths = dca.batch.expand_path(temp_dir)
+    assert paths == [os.path.join(temp_dir, n) for n in sorted(names)]
+
+    # glob patterns are expanded
+    paths = dca.batch.expand_path(os.path.join(temp_dir, '*.tif*'))
+    assert paths == [os.path.join(temp_dir, n) for n in ('a.tiff', 'b.tif')]
+
+    # single files are returned as is
+    path = os.path.join(temp_dir, 'a.tiff')
+    assert dca.batch.expand_path(path) == [path]
+
+    with pytest.raises(IOError):
+        dca.batch.expand_path(os.path.join(temp_dir, '*.jpg'))
+
+    # Zarr stores are single images, not directories of images
+    zarr_path = os.path.join(temp_dir, 'd.zarr')
+    os.makedirs(zarr_path)
+    _touch(os.path.join(zarr_path, 'zarr.json'))
+    assert not dca.batch.is_batch_path(zarr_path)
+    assert dca.batch.is_batch_path(temp_dir)
+    assert zarr_path in dca.batch.expand_path(temp_dir)
+    assert dca.batch.expand_path(os.path.join(temp_dir, '*.zarr')) == [zarr_path]
+
+
+def test_read_manifest(tmpdir):
+    temp_dir = str(tmpdir)
+    manifest = os.path.join(temp_dir, 'manifest.csv')
+    with open(manifest, 'w') as f:
+        f.write('nuclear_path,membrane_path,output_name,nuclear_channel\n')
+        f.write('fov1.tif,fov1_mem.tif,,0 1\n')
+        f.write('/abs/fov2.tif,,fov2_out.tif,\n')
+        f.write(',,,\n')
+
+    rows = dca.batch.read_manifest(manifest)
+    assert len(rows) == 2
+    assert rows[0]['nuclear_path'] == os.path.join(temp_dir, 'fov1.tif')
+    assert rows[0]['membrane_path'] == os.path.join(temp_dir, 'fov1_mem.tif')
+    assert rows[0]['output_name'] is None
+    assert rows[1]['nuclear_path'] == '/abs/fov2.tif'
+    assert rows[1]['membrane_path'] is None
+    assert rows[1]['output_name'] == 'fov2_out.tif'
+
+    # manifest requires a nuclear_path column
+    with open(manifest, 'w') as f:
+        f.write('membrane_path\nfov1.tif\n')
+    with pytest.raises(ValueError):
+        dca.batch.read_manifest(manifest)
+
+
+def test_get_jobs(tmpdir):
+    temp_dir = str(tmpdir)
+    nuc_dir = os.path.join(temp_dir, 'nuclear')
+    mem_dir = os.path.join(temp_dir, 'membrane')
+    os.makedirs(nuc_dir)
+    os.makedirs(mem_dir)
+    for name in ('fov1.tif', 'fov2.tif'):
+        _touch(os.path.join(nuc_dir, name))
+        _touch(os.path.join(mem_dir, name))
+
+    arg_dict = {
+        'app': 'mesmer',
+        'output_name': 'mask.tif',
+        'nuclear_path': os.path.join(nuc_dir, 'fov1.tif'),
+        'membrane_path': None,
+        'manifest': None,
+        'nuclear_channel': 0,
+        'membrane_channel': 0,
+    }
+
+    # a single image is a single job
+    assert dca.batch.get_jobs(arg_dict) == [arg_dict]
+
+    # directories are paired by name
+    arg_dict['nuclear_path'] = nuc_dir
+    arg_dict['membrane_path'] = mem_dir
+    jobs = dca.batch.get_jobs(arg_dict)
+    assert len(jobs) == 2
+    for job, name in zip(jobs, ('fov1', 'fov2')):
+        assert job['nuclear_path'] == os.path.join(nuc_dir, name + '.tif')
+        assert job['membrane_path'] == os.path.join(mem_dir, name + '.tif')
+        assert job['output_name'] == name + '_mask.tif'
+        assert job['app'] == 'mesmer'
+
+    # missing membrane images are an error
+    _touch(os.path.join(nuc_dir, 'fov3.tif'))
+    with pytest.raises(ValueError):
+        dca.batch.get_jobs(arg_dict)
+
+    # manifest rows override the command line arguments
+    manifest = os.path.join(temp_dir, 'manifest.csv')
+    with open(manifest, 'w') as f:
+        f.write('nuclear_path,output_name,membrane_channel\n')
+        f.write('nuclear/fov1.tif,out1.tif,1 2\n')
+        f.write('nuclear/fov2.tif,,\n')
+    arg_dict['manifest'] = manifest
+    arg_dict['nuclear_path'] = None
+    arg_dict['membrane_path'] = None
+    jobs = dca.batch.get_jobs(arg_dict)
+    assert len(jobs) == 2
+    assert jobs[0]['output_name'] == 'out1.tif'
+    assert jobs[0]['membrane_channel'] == [1, 2]
+    assert jobs[1]['output_name'] == 'fov2_mask.tif'
+    assert jobs[1]['membrane_channel'] == 0
+    assert jobs[1]['membrane_path'] is None
+
+    # a membrane directory is paired with the rows without a membrane image
+    with open(manifest, 'w') as f:
+        f.write('nuclear_path,membrane_path\n')
+        f.write('nuclear/fov1.tif,membrane/fov2.tif\n')
+        f.write('nuclear/fov2.tif,\n')
+    arg_dict['membrane_path'] = mem_dir
+    jobs = dca.batch.get_jobs(arg_dict)
+    assert jobs[0]['membrane_path'] == os.path.join(mem_dir, 'fov2.tif')
+    assert jobs[1]['membrane_path'] == os.path.join(mem_dir, 'fov2.tif')
+
+    with open(manifest, 'a') as f:
+        f.write('nuclear/fov3.tif,\n')
+    with pytest.raises(ValueError):
+        dca.batch.get_jobs(arg_dict)
+    arg_dict['membrane_path'] = None
+
+    # duplicate output names are an error
+    with open(manifest, 'w') as f:
+        f.write('nuclear_path,output_name\n')
+        f.write('nuclear/fov1.tif,out.tif\n')
+        f.write('nuclear/fov2.tif,out.tif\n')
+    with pytest.raises(ValueError):
+        dca.batch.get_jobs(arg_dict)
@@ -0,0 +1,165 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""An on-disk cache of application outputs keyed by their inputs"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_model_version(app):
+    """Returns a description of the application and its model version.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+
+    Returns:
+        dict: The application class, package version, model metadata,
+            and the backend and precision of the model.
+    """
+    module = app.__class__.__module__
+    package = sys.modules.get(module.split('.')[0])
+    return {
+        'class': '{}.{}'.format(module, app.__class__.__name__),
+        'version': getattr(package, '__version__', None),
+        'model': getattr(app, 'model_metadata', None),
+        'backend': getattr(app, 'backend', None),
+        'precision': getattr(app, 'precision', None),
+    }
+
+
+def get_cache_key(image, predict_kwargs, model_version):
+    """Returns a hash of the input, the predict options and the model version.
+
+    Args:
+        image (numpy.array): The prepared input of the application.
+        predict_kwargs (dict): The keyword arguments of ``app.predict``.
+        model_version (dict): The application and model version.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    options = {
+        'shape': list(image.shape),
+        'dtype': str(image.dtype),
+        'predict': predict_kwargs,
+        'model': model_version,
+    }
+    h.update(json.dumps(options, sort_keys=True, default=str).encode('utf-8'))
+    # hash the buffer directly without copying a contiguous array
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    """A size-bounded cache of outputs stored as ``.npy`` files.
+
+    The least recently used outputs are evicted once the cache is larger
+    than ``max_bytes``. Several processes may share the same directory.
+
+    Args:
+        directory (str): Directory to store the outputs in.
+        max_bytes (int): Maximum total size of the cached outputs.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def get_path(self, key):
+        """Returns the path of the cached output of ``key``."""
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key):
+        """Returns the cached output of ``key``, or ``None`` on a miss."""
+        path = self.get_path(key)
+        try:
+            output = np.load(path)
+            os.utime(path)  # mark as recently used
+        except (IOError, OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return output
+
+    def put(self, key, output):
+        """Store the output of ``key`` and evict old outputs if needed."""
+        path = self.get_path(key)
+        # write to a temporary file first so readers never load part of it
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, output)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used outputs until the cache fits."""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, '*.npy')):
+            try:
+                stat = os.stat(path)
+            except OSError:  # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        size = sum(e[1] for e in entries)
+        for _, nbytes, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= nbytes
+            with self._lock:
+                self.evictions += 1
+
+
+def get_cache(arg_dict):
+    """Returns the result cache of the job, or ``None`` if it is disabled."""
+    directory = arg_dict.get('cache_directory')
+    if not directory:
+        return None
+    max_bytes = float(arg_dict.get('cache_size') or 0) * 2 ** 30
+    return ResultCache(directory, max_bytes)
@@ -0,0 +1,93 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.cache"""
+
+import os
+
+import numpy as np
+
+import deepcell_applications as dca
+
+
+class DummyApplication(object):
+
+    model_metadata = {'name': 'dummy', 'version': 1}
+
+
+def test_get_cache_key():
+    app = DummyApplication()
+    version = dca.cache.get_model_version(app)
+    assert version['class'].endswith('cache_test.DummyApplication')
+    assert version['model'] == app.model_metadata
+
+    image = np.random.random((1, 32, 32, 2)).astype('float32')
+    kwargs = {'batch_size': 4, 'image_mpp': 0.5, 'compartment': 'whole-cell'}
+    key = dca.cache.get_cache_key(image, kwargs, version)
+    assert key == dca.cache.get_cache_key(image.copy(), dict(kwargs), version)
+
+    # non-contiguous inputs are hashed by value
+    view = np.asfortranarray(image)
+    assert key == dca.cache.get_cache_key(view, kwargs, version)
+
+    # the input, options and model all change the key
+    changed = image.copy()
+    changed[0, 0, 0, 0] += 1
+    assert key != dca.cache.get_cache_key(changed, kwargs, version)
+    assert key != dca.cache.get_cache_key(image.astype('float64'), kwargs, version)
+    assert key != dca.cache.get_cache_key(
+        image, dict(kwargs, compartment='nuclear'), version)
+    assert key != dca.cache.get_cache_key(
+        image, kwargs, dict(version, model={'version': 2}))
+
+
+def test_result_cache(tmpdir):
+    directory = os.path.join(str(tmpdir), 'cache')
+    output = np.arange(100, dtype='int32').reshape((1, 10, 10, 1))
+
+    cache = dca.cache.ResultCache(directory, max_bytes=2 ** 20)
+    assert cache.get('a') is None
+    assert cache.misses == 1
+
+    cache.put('a', output)
+    # room for two outputs
+    cache.max_bytes = os.path.getsize(cache.get_path('a')) * 2.5
+    np.testing.assert_array_equal(cache.get('a'), output)
+    assert cache.hits == 1
+
+    # the least recently used output is evicted
+    cache.put('b', output)
+    os.utime(cache.get_path('a'), (0, 0))
+    cache.put('c', output)
+    assert cache.evictions == 1
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
+    assert cache.get('c') is not None
+    assert not [f for f in os.listdir(directory) if f.endswith('.tmp')]
+
+    # the cache is disabled without a directory
+    assert dca.cache.get_cache({'cache_directory': None}) is None
+    cache = dca.cache.get_cache({'cache_directory': directory, 'cache_size': 1})
+    assert cache.max_bytes == 2 ** 30
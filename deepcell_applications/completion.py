@@ -0,0 +1,194 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""An append-only log of completed jobs for resuming interrupted runs"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import deepcell_applications as dca
+
+
+logger = logging.getLogger(__name__)
+
+COMPLETION_LOG = 'completed.jsonl'
+
+# Arguments that change the output of a job, in addition to the
+# ``<input>_path`` and ``<input>_channel`` of each input of the application
+# and its predict options. Any other argument, e.g. ``batch_size``,
+# ``workers`` or ``stack_chunk``, only changes how the job is run.
+OUTPUT_PARAMS = {
+    'app', 'resolution_level', 'squeeze', 'downcast', 'compression',
+    'output_tile', 'bigtiff', 'tile_size', 'tile_overlap', 'stack',
+    'backend', 'precision',
+}
+
+# Predict options that do not change the output
+RUNTIME_OPTIONS = {'batch_size'}
+
+_LOG_LOCK = threading.Lock()
+
+
+def get_log_path(arg_dict):
+    """Returns the path of the completion log in the output directory."""
+    return os.path.join(arg_dict['output_directory'], COMPLETION_LOG)
+
+
+def get_checksum(path, chunk_size=2 ** 20):
+    """Returns the blake2b hex digest of a file."""
+    h = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_param_names(app):
+    """Returns the names of the arguments that change the output of an app.
+
+    Args:
+        app (str): The name of the application.
+
+    Returns:
+        set: The names of the arguments.
+    """
+    names = set(OUTPUT_PARAMS)
+    settings = dca.settings.VALID_APPLICATIONS.get(app, {})
+    for name in settings.get('inputs', []):
+        names.update({'{}_path'.format(name), '{}_channel'.format(name)})
+    names.update(set(settings.get('predict_options', [])) - RUNTIME_OPTIONS)
+    return names
+
+
+def get_params(arg_dict):
+    """Returns the arguments of a job that change its output."""
+    names = get_param_names(arg_dict.get('app'))
+    return {k: v for k, v in sorted(arg_dict.items()) if k in names}
+
+
+def record_job(arg_dict):
+    """Append the completed output of a job to the completion log.
+
+    Args:
+        arg_dict (dict): Command line args for a single input image.
+    """
+    outfile = dca.app_runners.get_output_path(arg_dict)
+    record = {
+        'output_name': arg_dict['output_name'],
+        'size': os.path.getsize(outfile),
+        'checksum': get_checksum(outfile),
+        'params': get_params(arg_dict),
+        'timestamp': time.time(),
+    }
+    line = json.dumps(record, default=str) + '\n'
+
+    # a single write of a whole line, so concurrent processes do not interleave
+    with _LOG_LOCK:
+        with open(get_log_path(arg_dict), 'a') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def load_log(path):
+    """Returns the latest record of each output in a completion log.
+
+    Lines that are incomplete, e.g. after a crash, are ignored.
+
+    Args:
+        path (str): The path of the completion log.
+
+    Returns:
+        dict: The records keyed by output name.
+    """
+    records = {}
+    if not os.path.isfile(path):
+        return records
+
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                records[record['output_name']] = record
+            except (ValueError, KeyError, TypeError):
+                continue
+    return records
+
+
+def is_complete(arg_dict, record):
+    """Returns True if the output of a job matches its completion record.
+
+    Args:
+        arg_dict (dict): Command line args for a single input image.
+        record (dict): The completion record of the output, or ``None``.
+
+    Returns:
+        bool: Whether the output exists, was written with the same
+            arguments, and is not truncated or corrupt.
+    """
+    outfile = dca.app_runners.get_output_path(arg_dict)
+    if record is None or not os.path.isfile(outfile):
+        return False
+
+    # compare the params as they are stored in the log
+    params = json.loads(json.dumps(get_params(arg_dict), default=str))
+    if record.get('params') != params:
+        return False
+
+    if os.path.getsize(outfile) != record.get('size'):
+        return False
+
+    return get_checksum(outfile) == record.get('checksum')
+
+
+def get_remaining_jobs(jobs):
+    """Returns the jobs whose outputs are not verified as complete.
+
+    Args:
+        jobs (list): Command line args for each input image.
+
+    Returns:
+        list: The jobs that still need to run.
+    """
+    logs = {}
+    remaining = []
+    for job in jobs:
+        path = get_log_path(job)
+        if path not in logs:
+            logs[path] = load_log(path)
+
+        if is_complete(job, logs[path].get(job['output_name'])):
+            logger.debug('Skipping completed output %s.',
+                         dca.app_runners.get_output_path(job))
+        else:
+            remaining.append(job)
+
+    logger.info('Resuming with %s of %s jobs remaining.',
+                len(remaining), len(jobs))
+    return remaining
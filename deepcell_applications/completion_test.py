@@ -0,0 +1,127 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.completion"""
+
+import json
+import os
+
+import numpy as np
+import tifffile
+
+import deepcell_applications as dca
+
+
+def _make_jobs(temp_dir, n):
+    jobs = []
+    for i in range(n):
+        output_name = 'fov{}_mask.tif'.format(i)
+        tifffile.imwrite(os.path.join(temp_dir, output_name),
+                         np.full((10, 10), i, dtype='uint8'))
+        jobs.append({
+            'app': 'mesmer',
+            'nuclear_path': 'fov{}.tif'.format(i),
+            'nuclear_channel': [0],
+            'output_directory': temp_dir,
+            'output_name': output_name,
+            'compartment': 'whole-cell',
+            'batch_size': 4,
+            'pipeline_depth': 2,
+        })
+    return jobs
+
+
+def test_get_params():
+    params = dca.completion.get_params({
+        'app': 'mesmer', 'compartment': 'nuclear', 'image_mpp': 0.5,
+        'nuclear_path': 'fov.tif', 'nuclear_channel': [0], 'backend': 'tflite',
+        'batch_size': 4, 'log_level': 'INFO', 'output_directory': '/tmp'})
+    assert params == {
+        'app': 'mesmer', 'backend': 'tflite', 'compartment': 'nuclear',
+        'image_mpp': 0.5, 'nuclear_channel': [0], 'nuclear_path': 'fov.tif'}
+
+    # arguments added for running jobs do not change the output
+    runtime = {'stack_chunk': 8, 'dry_run': True, 'load_processes': 2,
+               'warmup': True, 'model_directory': '/models', 'offline': True,
+               'check_accuracy': True, 'check_samples': 2, 'new_option': 1}
+    assert dca.completion.get_params(dict(params, **runtime)) == params
+
+
+def test_record_job(tmpdir):
+    temp_dir = str(tmpdir)
+    jobs = _make_jobs(temp_dir, 3)
+    for job in jobs:
+        dca.completion.record_job(job)
+
+    log_path = dca.completion.get_log_path(jobs[0])
+    assert log_path == os.path.join(temp_dir, dca.completion.COMPLETION_LOG)
+
+    # a line left incomplete by a crash is ignored
+    with open(log_path, 'a') as f:
+        f.write('{"output_name": "fov3_ma')
+
+    records = dca.completion.load_log(log_path)
+    assert sorted(records) == [job['output_name'] for job in jobs]
+    for job in jobs:
+        record = records[job['output_name']]
+        outfile = dca.app_runners.get_output_path(job)
+        assert record['size'] == os.path.getsize(outfile)
+        assert record['checksum'] == dca.completion.get_checksum(outfile)
+        assert dca.completion.is_complete(job, record)
+
+    assert dca.completion.load_log(os.path.join(temp_dir, 'missing.jsonl')) == {}
+
+
+def test_get_remaining_jobs(tmpdir):
+    temp_dir = str(tmpdir)
+    jobs = _make_jobs(temp_dir, 5)
+    for job in jobs[:4]:
+        dca.completion.record_job(job)
+
+    # only the job without a record is remaining
+    assert dca.completion.get_remaining_jobs(jobs) == jobs[4:]
+
+    # options that do not change the output are ignored
+    jobs[0]['batch_size'] = 8
+    jobs[0]['pipeline_depth'] = 0
+    jobs[0]['stack_chunk'] = 8
+    jobs[0]['load_processes'] = 2
+    assert dca.completion.get_remaining_jobs(jobs) == jobs[4:]
+
+    # changed arguments, truncated, corrupt and missing outputs are remaining
+    jobs[0]['compartment'] = 'nuclear'
+    with open(dca.app_runners.get_output_path(jobs[1]), 'r+b') as f:
+        f.truncate(100)
+    with open(dca.app_runners.get_output_path(jobs[2]), 'r+b') as f:
+        f.seek(-1, os.SEEK_END)
+        f.write(b'\xff')
+    os.remove(dca.app_runners.get_output_path(jobs[3]))
+    assert dca.completion.get_remaining_jobs(jobs) == jobs
+
+    # the latest record of an output is used
+    dca.completion.record_job(jobs[0])
+    assert dca.completion.get_remaining_jobs(jobs) == jobs[1:]
+    with open(dca.completion.get_log_path(jobs[0])) as f:
+        assert len([json.loads(line) for line in f]) == 5
@@ -25,54 +25,716 @@
 # ==============================================================================
 """Functions for reading and writing files."""
 
+import contextlib
+import logging
+import os
+
 import numpy as np
+import tifffile
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_image(path):
+    """Load an image file with ``deepcell.utils.io_utils.get_image``.
+
+    ``deepcell`` imports TensorFlow, so it is only imported when needed.
+    """
+    from deepcell.utils.io_utils import get_image as _get_image
+    return _get_image(path)
+
+
+def get_pil_shape(path):
+    """Returns the shape of an image file from its header, read with PIL.
+
+    Args:
+        path (str): Filepath to the image file.
+
+    Returns:
+        tuple: The ``(height, width)`` of a single-band image, or
+            ``(height, width, bands)``, or ``None`` if PIL is not installed
+            or the image has several frames.
+    """
+    try:
+        from PIL import Image
+    except ImportError:  # PIL is installed with deepcell, which can decode it
+        return None
+
+    try:
+        with Image.open(path) as img:
+            if getattr(img, 'n_frames', 1) > 1:
+                return None
+            width, height = img.size
+            bands = len(img.getbands())
+    except (IOError, OSError, ValueError):
+        return None
+
+    return (height, width) if bands == 1 else (height, width, bands)
+
+
+def import_zarr():
+    """Returns the ``zarr`` module, or ``None`` if it is not installed."""
+    try:
+        import zarr
+    except ImportError:  # zarr is optional, used to read compressed TIFF windows
+        return None
+    return zarr
+
+
+def get_channel_axis(shape):
+    """Returns the channel axis of an image with the given shape.
+
+    The channel axis is assumed to be the smallest dimension.
+
+    Args:
+        shape (tuple): The shape of the image.
+
+    Returns:
+        int: The index of the channel axis.
+    """
+    shape = tuple(shape)
+    return shape.index(min(shape))
+
+
+def get_tiff_channel_axis(axes, shape):
+    """Returns the channel axis of a TIFF series from its metadata.
+
+    If the axes metadata has no channel (``C``) or sample (``S``) axis,
+    the channel axis is assumed to be the smallest dimension.
+
+    Args:
+        axes (str): The axes of the TIFF series, e.g. ``"CYX"``.
+        shape (tuple): The shape of the TIFF series.
+
+    Returns:
+        int: The index of the channel axis.
+    """
+    for a in 'CS':
+        if a in axes:
+            return axes.index(a)
+    return get_channel_axis(shape)
+
+
+def check_channels(channel, size):
+    """Raise a ValueError if any channel is out of range of the channel axis."""
+    if max(channel) >= size:
+        raise ValueError('Channel {} was passed but channel axis is '
+                         'only size {}'.format(max(channel), size))
+
+
+def get_image_channel_axis(img, stack=False):
+    """Returns the channel axis of an opened image.
+
+    Images with an ``axes`` attribute, like ``ZarrImage``, use their axes
+    metadata. Otherwise the channel axis is assumed to be the smallest
+    dimension.
+
+    Args:
+        img (array-like): The opened image.
+        stack (bool): Whether the first axis of the image is a frame axis.
+            If so, the channel axis of a single frame is returned.
+
+    Returns:
+        int: The index of the channel axis.
+    """
+    shape, axes = tuple(img.shape), getattr(img, 'axes', None)
+    if stack:
+        shape, axes = shape[1:], axes[1:] if axes else axes
+    if axes:
+        return get_tiff_channel_axis(axes, shape)
+    return get_channel_axis(shape)
+
+
+def is_zarr(path):
+    """Returns True if the path is a local Zarr store."""
+    path = str(path).rstrip(os.sep)
+    if not os.path.isdir(path):
+        return False
+    if path.lower().endswith('.zarr'):
+        return True
+    return any(os.path.exists(os.path.join(path, f))
+               for f in ('.zarray', '.zgroup', 'zarr.json'))
+
+
+class ZarrImage(object):
+    """A lazily read image in a Zarr array.
+
+    Only the channel (``C``) and spatial (``Y``, ``X``) axes are kept.
+    Any other axis, such as time or z, must have size 1 and is dropped,
+    unless it is one of ``frame_axes``: then it is kept as the first axis,
+    so the image can be read as a stack of frames.
+    No pixel data are read until the image is indexed, and indexing only
+    reads the chunks that are needed.
+
+    Args:
+        array (zarr.Array): The Zarr array of the image.
+        axes (str): The axes of the array, e.g. ``"TCZYX"``.
+            If not given, all axes are kept.
+        frame_axes (str): The axes that may be kept as the frame axis,
+            e.g. ``"TZ"``. At most one of them may have a size above 1.
+    """
+
+    def __init__(self, array, axes=None, frame_axes=''):
+        self.array = array
+        self.dtype = array.dtype
+
+        # the frame axis is the frame axis with more than one frame, if any
+        frames = [i for i, size in enumerate(array.shape)
+                  if axes and axes[i] in frame_axes]
+        if len([i for i in frames if array.shape[i] > 1]) > 1:
+            raise ValueError('Only one of the {} axes may have more than one '
+                             'frame, but the image has axes {} and shape '
+                             '{}'.format(frame_axes, axes, array.shape))
+        frame = max(frames, key=lambda i: array.shape[i]) if frames else None
+
+        index, order = [], []
+        for i, size in enumerate(array.shape):
+            name = axes[i] if axes else None
+            if name is None or name in 'CYX':
+                index.append(slice(None))
+                order.append(i)
+            elif i == frame:
+                index.append(slice(None))
+            elif size == 1:
+                index.append(0)
+            else:
+                raise ValueError('Only images with C, Y and X axes are '
+                                 'supported, but axis {} has size {}. Use '
+                                 '--stack to read the frames of T or Z '
+                                 'axes.'.format(name, size))
+
+        if frame is not None:
+            order.insert(0, frame)
+
+        self._index = index
+        # the axes of the array in the order they are returned
+        self._order = order
+        self.shape = tuple(array.shape[i] for i in order)
+        self.ndim = len(order)
+        self.axes = ''.join(axes[i] for i in order) if axes else None
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key,)
+        index = list(self._index)
+        for axis, k in zip(self._order, key):
+            index[axis] = k
+        data = self.array[tuple(index)]
+
+        # the returned axes are in the order of the array
+        kept = [a for a in self._order
+                if not isinstance(index[a], (int, np.integer))]
+        if kept != sorted(kept):
+            data = np.transpose(data, [sorted(kept).index(a) for a in kept])
+        return data
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[()], dtype=dtype)
+
+
+def open_zarr(path, level=0, stack=False):
+    """Open an image in a local Zarr store without reading any pixel data.
+
+    The store may be a single array or an OME-Zarr multiscale image,
+    in which case the axes are read from the metadata.
+
+    Args:
+        path (str): Path to the Zarr store.
+        level (int): The resolution level of an OME-Zarr image,
+            where 0 is the full resolution.
+        stack (bool): Whether to keep the time or z axis of an OME-Zarr
+            image as the first axis, so it is read as a stack of frames.
+
+    Returns:
+        ZarrImage: The lazily read image.
+
+    Raises:
+        ImportError: If zarr is not installed.
+        ValueError: If the store is not an image or the level does not exist.
+    """
+    zarr = import_zarr()
+    if zarr is None:
+        raise ImportError('zarr must be installed to read {}'.format(path))
+
+    node = zarr.open(path, mode='r')
+    if hasattr(node, 'shape'):  # a single array
+        if level:
+            raise ValueError('Resolution level {} was passed but {} is not '
+                             'a multiscale image.'.format(level, path))
+        return ZarrImage(node)
+
+    attrs = dict(node.attrs)
+    attrs = attrs.get('ome', attrs)  # OME-Zarr 0.5 nests its metadata
+    try:
+        multiscales = attrs['multiscales'][0]
+    except (KeyError, IndexError):
+        raise ValueError('{} is not an OME-Zarr multiscale image.'.format(path))
+
+    datasets = multiscales['datasets']
+    if level >= len(datasets):
+        raise ValueError('Resolution level {} was passed but {} only has {} '
+                         'levels.'.format(level, path, len(datasets)))
+
+    axes = None
+    if multiscales.get('axes'):
+        names = [a['name'] if isinstance(a, dict) else a
+                 for a in multiscales['axes']]
+        axes = ''.join({'c': 'C', 'y': 'Y', 'x': 'X', 't': 'T', 'z': 'Z'}.get(
+            str(n).lower(), 'Q') for n in names)
+
+    return ZarrImage(node[datasets[level]['path']], axes=axes,
+                     frame_axes='TZ' if stack else '')
+
+
+def is_tiff(path):
+    """Returns True if the path is an existing TIFF file."""
+    return str(path).lower().endswith(('.tif', '.tiff')) and os.path.isfile(path)
+
+
+def _channel_slice(axis, c):
+    # index a single channel on the given axis as a view
+    return (slice(None),) * axis + (c,)
+
+
+def iter_channels(img, channel, ndim=3):
+    """Yields each of the given channels of an image as a 2D plane.
+
+    Args:
+        img (array-like): The image data, e.g. a numpy array or ``ZarrImage``.
+        channel (list): The channels to select.
+        ndim (int): The rank of an image with a channel axis.
+
+    Yields:
+        tuple: The index and data of each selected channel. If the image has
+            no channel axis, the whole image is yielded once with index
+            ``None``.
+    """
+    if img.ndim != ndim:
+        yield None, np.asarray(img)
+        return
+
+    # file includes channels, find the channel axis
+    # assuming the channels axis is the smallest dimension
+    # unless the image has axes metadata
+    axis = get_image_channel_axis(img)
+    check_channels(channel, img.shape[axis])
+    for c in channel:
+        yield c, img[_channel_slice(axis, c)]
+
+
+def iter_tiff_channels(path, channel, ndim=3, maxworkers=None):
+    """Yields each of the given channels of a TIFF file as a 2D plane.
+
+    Uncompressed, contiguous files are memory-mapped and only the
+    selected channels are read. If each channel is stored as its own page,
+    only the selected pages are decoded. Otherwise the whole image is
+    decoded, using multiple threads for compressed or tiled files.
+
+    Args:
+        path (str): Filepath to the TIFF file to load.
+        channel (list): The channels to read.
+        ndim (int): The rank of an image with a channel axis.
+        maxworkers (int): Maximum number of threads used to decode
+            tiles, strips or pages. Defaults to half of the CPU cores.
+
+    Yields:
+        tuple: The index and data of each selected channel. If the image has
+            no channel axis, the whole image is yielded once with index
+            ``None``.
+    """
+    with tifffile.TiffFile(path) as tif:
+        series = tif.series[0]
+        shape = tuple(series.shape)
+
+        if len(shape) != ndim:
+            # no channel axis (or an invalid rank), read the whole image
+            yield None, series.asarray(maxworkers=maxworkers)
+            return
+
+        axis = get_tiff_channel_axis(series.axes, shape)
+        check_channels(channel, shape[axis])
+
+        if series.dataoffset is not None:
+            # contiguous and uncompressed, read from a memory-map
+            img = tifffile.memmap(path, mode='r')
+            for c in channel:
+                yield c, img[_channel_slice(axis, c)]
+
+        elif axis == 0 and len(series.pages) == shape[0]:
+            # each channel is a page, only decode the selected pages
+            for c in channel:
+                yield c, tif.asarray(key=c, series=0, maxworkers=maxworkers)
+
+        else:
+            img = series.asarray(maxworkers=maxworkers)
+            for c in channel:
+                yield c, img[_channel_slice(axis, c)]
+
+
+def get_image_header(path, level=0, stack=False):
+    """Returns the shape, axes and dtype of an image without reading pixels.
+
+    Only TIFF files and Zarr stores can be read this way.
+
+    Args:
+        path (str): Filepath to the image file.
+        level (int): The resolution level of an OME-Zarr image.
+        stack (bool): Whether the image is read as a stack of frames.
+
+    Returns:
+        dict: The ``shape``, ``axes`` (or ``None`` if unknown) and ``dtype``
+            of the image, or ``None`` if the file is not a TIFF or Zarr store.
+    """
+    if is_zarr(path):
+        img = open_zarr(path, level=level, stack=stack)
+        return {'shape': tuple(img.shape), 'axes': img.axes,
+                'dtype': np.dtype(img.dtype)}
+
+    if is_tiff(path):
+        with tifffile.TiffFile(path) as tif:
+            series = tif.series[0]
+            return {'shape': tuple(series.shape), 'axes': series.axes,
+                    'dtype': np.dtype(series.dtype)}
+
+    return None
 
-from deepcell.utils.io_utils import get_image
 
+def get_image_shape(path, ndim=3, level=0):
+    """Returns the ``(height, width)`` of an image file.
 
-def load_image(path, channel=0, ndim=3):
+    Only the header of TIFF files, Zarr stores and images PIL can open is
+    read. Other files are loaded.
+
+    Args:
+        path (str): Filepath to the image file.
+        ndim (int): The rank of an image with a channel axis.
+        level (int): The resolution level of an OME-Zarr image.
+
+    Returns:
+        tuple: The spatial shape of the image.
+    """
+    if not path:
+        raise IOError('Invalid path: %s' % path)
+
+    if is_zarr(path):
+        img = open_zarr(path, level=level)
+        shape = list(img.shape)
+        if len(shape) == ndim:
+            del shape[get_image_channel_axis(img)]
+
+    elif is_tiff(path):
+        with tifffile.TiffFile(path) as tif:
+            series = tif.series[0]
+            shape = list(series.shape)
+            if len(shape) == ndim:
+                del shape[get_tiff_channel_axis(series.axes, shape)]
+    else:
+        header_shape = get_pil_shape(path)
+        if header_shape is not None:
+            # PIL images have at most one spatial plane and a last band axis
+            return header_shape[:2]
+
+        shape = list(get_image(path).shape)
+        if len(shape) == ndim:
+            del shape[get_channel_axis(shape)]
+
+    return tuple(shape)
+
+
+def load_image(path, channel=0, ndim=3, maxworkers=None, out=None,
+               dtype='float32', level=0):
     """Load an image file as a single-channel numpy array.
 
+    The selected channels are summed one at a time into a single buffer,
+    and only the selected channels of TIFF files and Zarr stores are read.
+
     Args:
         path (str): Filepath to the image file to load.
         channel (list): Loads the given channel if available.
             If channel is list of length > 1, each channel
             will be summed.
         ndim (int): The expected rank of the returned tensor.
+        maxworkers (int): Maximum number of threads used to decode
+            compressed or tiled TIFF files.
+        out (numpy.array): Optional ``(height, width, 1)`` array to sum
+            the channels into, e.g. a view of a larger input buffer.
+        dtype (str): The dtype of the returned array if ``out`` is not given.
+        level (int): The resolution level of an OME-Zarr image.
 
     Returns:
         numpy.array: The image channel loaded as an array.
     """
+    return load_channel_groups(path, [channel], ndim=ndim, maxworkers=maxworkers,
+                               outs=[out], dtype=dtype, level=level)[0]
+
+
+def load_channel_groups(path, channels, ndim=3, maxworkers=None, outs=None,
+                        dtype='float32', level=0):
+    """Load several groups of channels of one image file in a single pass.
+
+    Each selected channel is read once, even if it is in several groups,
+    and is summed into the output of every group that includes it.
+
+    Args:
+        path (str): Filepath to the image file to load.
+        channels (list): The channel, or list of channels, of each group.
+        ndim (int): The expected rank of the returned tensors.
+        maxworkers (int): Maximum number of threads used to decode
+            compressed or tiled TIFF files.
+        outs (list): Optional ``(height, width, 1)`` array of each group
+            to sum its channels into.
+        dtype (str): The dtype of the returned arrays without ``outs``.
+        level (int): The resolution level of an OME-Zarr image.
+
+    Returns:
+        list: The summed channels of each group.
+    """
     if not path:
         raise IOError('Invalid path: %s' % path)
 
-    img = get_image(path)
+    groups = [c if isinstance(c, (list, tuple)) else [c] for c in channels]
+    outs = list(outs) if outs is not None else [None] * len(groups)
+
+    # read every channel once, in the order they are first selected
+    channel = []
+    for group in groups:
+        channel.extend(c for c in group if c not in channel)
+
+    if is_zarr(path):
+        planes = iter_channels(open_zarr(path, level=level), channel, ndim=ndim)
+    elif is_tiff(path):
+        planes = iter_tiff_channels(path, channel, ndim=ndim,
+                                    maxworkers=maxworkers)
+    else:
+        planes = iter_channels(get_image(path), channel, ndim=ndim)
+
+    for c, plane in planes:
+        # the (proper) channel axis is expanded
+        if not plane.ndim + 1 == ndim:
+            raise ValueError('Expected image with ndim = {} but found ndim={} '
+                             'and shape={}'.format(
+                                 ndim, plane.ndim + 1, plane.shape + (1,)))
+
+        for i, group in enumerate(groups):
+            # an image without a channel axis is loaded once for each group
+            for _ in range(1 if c is None else group.count(c)):
+                if outs[i] is None:
+                    outs[i] = np.zeros(plane.shape + (1,), dtype=dtype)
+
+                elif outs[i].shape[:-1] != plane.shape:
+                    raise ValueError('Image {} has shape {} but expected '
+                                     'shape {}'.format(
+                                         path, plane.shape, outs[i].shape[:-1]))
+
+                # sum on the channel axis without a 64-bit intermediate
+                np.add(outs[i][..., 0], plane, out=outs[i][..., 0],
+                       casting='unsafe')
+
+    return outs
+
+
+def open_image(path, level=0, stack=False):
+    """Open an image file without reading all of the pixel data into memory.
+
+    Zarr stores are read lazily. Uncompressed TIFF files are memory-mapped.
+    Other TIFF files are read lazily through ``zarr`` if it is installed.
+    Any other file is loaded into memory.
+
+    Args:
+        path (str): Filepath to the image file to open.
+        level (int): The resolution level of an OME-Zarr image.
+        stack (bool): Whether to keep the time or z axis of an OME-Zarr
+            image as the first axis, so it is read as a stack of frames.
+
+    Returns:
+        array-like: A sliceable array of the image data.
+    """
+    if not path:
+        raise IOError('Invalid path: %s' % path)
+
+    if is_zarr(path):
+        return open_zarr(path, level=level, stack=stack)
+
+    if is_tiff(path):
+        try:
+            return tifffile.memmap(path, mode='r')
+        except ValueError:  # image data are not memory-mappable
+            zarr = import_zarr()
+            if zarr is not None:
+                return zarr.open(tifffile.imread(path, aszarr=True), mode='r')
+
+        logger.warning('%s can not be read lazily without zarr installed '
+                       'and will be loaded into memory.', path)
+        return tifffile.imread(path)
 
+    logger.warning('%s can not be read lazily and will be loaded into '
+                   'memory.', path)
+    return get_image(path)
+
+
+def read_window(img, channel=0, rows=slice(None), cols=slice(None), ndim=3,
+                out=None, frame=None):
+    """Read a 2D window of an opened image as a single-channel float32 array.
+
+    Args:
+        img (array-like): An image opened with ``open_image``.
+        channel (list): Loads the given channel if available.
+            If channel is list of length > 1, each channel
+            will be summed.
+        rows (slice): The rows of the window to read.
+        cols (slice): The columns of the window to read.
+        ndim (int): The expected rank of the returned tensor.
+        out (numpy.array): Optional ``(rows, cols, 1)`` array to sum
+            the channels into.
+        frame (int): The frame to read from a stack opened with
+            ``stack=True``. The frame, channel and window are read with a
+            single index, so only the chunks of the selected channels are
+            read from a Zarr stack.
+
+    Returns:
+        numpy.array: The window of the image channel(s) with shape
+            ``(rows, cols, 1)``.
+    """
     channel = channel if isinstance(channel, (list, tuple)) else [channel]
 
-    # getting a little tricky, which axis is channel axis?
-    if img.ndim == ndim:
-        # file includes channels, find the channel axis
-        # assuming the channels axis is the smallest dimension
-        axis = img.shape.index(min(img.shape))
-        if max(channel) >= img.shape[axis]:
-            raise ValueError('Channel {} was passed but channel axis is '
-                             'only size {}'.format(
-                                 max(channel), img.shape[axis]))
-
-        # slice out only the required channel
-        slc = [slice(None)] * len(img.shape)
-        # use integer to select only the relevant channels
-        slc[axis] = channel
-        img = img[tuple(slc)]
-        # sum on the channel axis
-        img = img.sum(axis=axis)
-
-    # expand the (proper) channel axis
-    img = np.expand_dims(img, axis=-1)
-
-    if not img.ndim == ndim:
-        raise ValueError('Expected image with ndim = {} but found ndim={} '
-                         'and shape={}'.format(ndim, img.ndim, img.shape))
+    index = () if frame is None else (frame,)
+    shape = img.shape[len(index):]
+
+    if len(shape) == ndim:
+        axis = get_image_channel_axis(img, stack=frame is not None)
+        check_channels(channel, shape[axis])
+        slices = []
+        for c in channel:
+            slc = [rows, cols]
+            slc.insert(axis, c)
+            slices.append(index + tuple(slc))
+
+    elif len(shape) == ndim - 1:
+        slices = [index + (rows, cols)]
+
+    else:
+        raise ValueError('Expected image with ndim = {} or {} but found '
+                         'ndim={} and shape={}'.format(
+                             ndim - 1, ndim, len(shape), shape))
+
+    for slc in slices:
+        plane = np.asarray(img[slc])
+        if out is None:
+            out = np.zeros(plane.shape + (1,), dtype='float32')
+        np.add(out[..., 0], plane, out=out[..., 0], casting='unsafe')
+
+    return out
+
+
+def downcast_labels(img):
+    """Returns the image as the smallest unsigned integer dtype that fits it.
+
+    Only non-negative integer images are cast, as label images usually
+    fit in far fewer than the 64 bits returned by the applications.
+
+    Args:
+        img (numpy.array): The image to cast.
+
+    Returns:
+        numpy.array: The image as ``uint8``, ``uint16`` or ``uint32`` if
+            all of its values fit, otherwise the image is returned unchanged.
+    """
+    if not np.issubdtype(img.dtype, np.integer) or img.size == 0:
+        return img
+
+    if img.min() < 0:
+        return img
 
+    max_value = img.max()
+    for dtype in ('uint8', 'uint16', 'uint32'):
+        if max_value <= np.iinfo(dtype).max:
+            if np.dtype(dtype).itemsize < img.dtype.itemsize:
+                return img.astype(dtype)
+            break
     return img
+
+
+def get_save_kwargs(kwargs):
+    """Returns the ``tifffile.imwrite`` options from the parsed arguments.
+
+    Args:
+        kwargs (dict): Parsed command-line arguments.
+
+    Returns:
+        dict: The keyword arguments for ``tifffile.imwrite``.
+    """
+    compression = kwargs.get('compression')
+    tile = kwargs.get('output_tile')
+
+    if tile and tile % 16:
+        raise ValueError('Output tile size must be a multiple of 16, '
+                         'got {}'.format(tile))
+
+    return {
+        'compression': None if compression in (None, 'none') else compression,
+        'tile': (tile, tile) if tile else None,
+        'bigtiff': kwargs.get('bigtiff') or None,
+    }
+
+
+@contextlib.contextmanager
+def atomic_write(path):
+    """Context manager yielding a temporary path that replaces ``path`` on exit.
+
+    The file is written next to ``path`` and renamed once it is complete,
+    so a crash never leaves a partial file at ``path``.
+
+    Args:
+        path (str): The final path of the file.
+
+    Yields:
+        str: The temporary path to write the file to.
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, '.{}.{}.tmp'.format(name, os.getpid()))
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_image(path, img, channels=None, compression=None, tile=None,
+               bigtiff=None, downcast=True):
+    """Save an output image as a TIFF file.
+
+    Multiple channels are stored as samples of each pixel, and any other
+    axes before the spatial axes, e.g. frames, as pages.
+    The file is written to a temporary path and renamed once it is complete.
+
+    Args:
+        path (str): Filepath to save the image to.
+        img (numpy.array): The image to save.
+        channels (int): The number of channels of the last axis of ``img``.
+            A single channel may have no axis, e.g. after squeezing.
+            Defaults to the last axis of a ``(batch, height, width,
+            channels)`` image, or a single channel otherwise.
+        compression (str): The codec used to compress the image,
+            e.g. ``"zlib"``, ``"zstd"`` or ``"lzw"``.
+        tile (tuple): Optional ``(height, width)`` of the TIFF tiles.
+            The last two axes of ``img`` (ignoring a channel axis of size 1)
+            must be the spatial axes.
+        bigtiff (bool): Whether to write a BigTIFF file. By default, BigTIFF
+            is used only if the image is larger than 4 GB.
+        downcast (bool): Whether to save integer labels as the smallest
+            unsigned integer dtype that fits them.
+    """
+    if downcast:
+        img = downcast_labels(img)
+
+    if channels is None:
+        channels = img.shape[-1] if img.ndim == 4 else 1
+
+    # store multiple channels as samples of each pixel, not as pages
+    planarconfig = 'contig' if channels > 1 else None
+
+    with atomic_write(path) as tmp_path:
+        tifffile.imwrite(tmp_path, img, compression=compression, tile=tile,
+                         bigtiff=bigtiff, photometric='minisblack',
+                         planarconfig=planarconfig)
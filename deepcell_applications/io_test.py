@@ -25,7 +25,10 @@
 # ==============================================================================
 """Tests for deepcell_applications.io"""
 
+import os
+
 import numpy as np
+import tifffile
 
 import pytest
 
@@ -48,13 +51,14 @@ def test_load_image(mocker):
     for c in range(channels):
         img = dca.io.load_image(path, channel=c, ndim=source.ndim)
         assert img.shape == (32, 32, 1)
-        np.testing.assert_array_equal(img, source[..., c:c + 1])
+        assert img.dtype == np.float32
+        np.testing.assert_array_equal(img, source[..., c:c + 1].astype('float32'))
 
     # multiple channels can be selected using a list
     channels = list(range(channels))
     img = dca.io.load_image(path, channel=channels, ndim=source.ndim)
     assert img.shape == (32, 32, 1)
-    np.testing.assert_array_equal(img[..., 0], source.sum(axis=-1))
+    np.testing.assert_allclose(img[..., 0], source.sum(axis=-1), rtol=1e-6)
 
     # test 3D image has correct image loaded (channels first)
     channels = 3
@@ -63,14 +67,27 @@ def test_load_image(mocker):
     for c in range(channels):
         img = dca.io.load_image(path, channel=c, ndim=source.ndim)
         assert img.shape == (32, 32, 1)
-        expected = np.expand_dims(source[c], axis=-1)
+        expected = np.expand_dims(source[c], axis=-1).astype('float32')
         np.testing.assert_array_equal(img, expected)
 
     # multiple channels can be selected using a list
     channels = list(range(channels))
     img = dca.io.load_image(path, channel=channels, ndim=source.ndim)
     assert img.shape == (32, 32, 1)
-    np.testing.assert_array_equal(img[..., 0], source.sum(axis=0))
+    np.testing.assert_allclose(img[..., 0], source.sum(axis=0), rtol=1e-6)
+
+    # channels are summed into a provided buffer without 64-bit intermediates
+    source = np.random.randint(0, 2 ** 16, size=(32, 32, 3)).astype('uint16')
+    mocker.patch('deepcell_applications.io.get_image', lambda x: source)
+    buffer = np.zeros((1, 32, 32, 2), dtype='float32')
+    img = dca.io.load_image(path, channel=[0, 2], out=buffer[0, ..., 1:2])
+    assert np.shares_memory(img, buffer)
+    np.testing.assert_array_equal(buffer[0, ..., 1], source[..., [0, 2]].sum(axis=-1))
+    np.testing.assert_array_equal(buffer[0, ..., 0], 0)
+
+    # the buffer must match the image shape
+    with pytest.raises(ValueError):
+        dca.io.load_image(path, channel=0, out=np.zeros((16, 32, 1)))
 
     # test too large of an image fails
     with pytest.raises(ValueError):
@@ -89,3 +106,349 @@ def test_load_image(mocker):
     for bad_value in bad_values:
         with pytest.raises(IOError):
             dca.io.load_image(bad_value)
+
+
+def test_open_image_read_window(tmpdir):
+    temp_dir = str(tmpdir)
+    source = np.random.randint(0, 100, size=(3, 40, 30)).astype('uint16')
+
+    # uncompressed TIFFs are memory-mapped
+    path = os.path.join(temp_dir, 'img.tif')
+    tifffile.imwrite(path, source)
+    img = dca.io.open_image(path)
+    assert isinstance(img, np.memmap)
+
+    rows, cols = slice(5, 25), slice(10, 30)
+    window = dca.io.read_window(img, channel=[0, 2], rows=rows, cols=cols)
+    assert window.shape == (20, 20, 1)
+    assert window.dtype == np.float32
+    expected = source[0, rows, cols].astype('float32') + source[2, rows, cols]
+    np.testing.assert_array_equal(window[..., 0], expected)
+
+    # 2D images have no channel axis
+    window = dca.io.read_window(source[1], channel=0, rows=rows, cols=cols)
+    np.testing.assert_array_equal(window[..., 0], source[1, rows, cols])
+
+    # test channels out of range throws error
+    with pytest.raises(ValueError):
+        dca.io.read_window(img, channel=3)
+
+    # test too large of an image fails
+    with pytest.raises(ValueError):
+        dca.io.read_window(np.zeros((2, 3, 40, 30)), channel=0)
+
+    # Test invalid (falsey) values raise IOError
+    for bad_value in [None, '', False]:
+        with pytest.raises(IOError):
+            dca.io.open_image(bad_value)
+
+
+def test_load_image_tiff(tmpdir, mocker):
+    temp_dir = str(tmpdir)
+    source = np.random.randint(0, 100, size=(5, 40, 30)).astype('uint16')
+    channels = [1, 3]
+    expected = source[channels].sum(axis=0)
+
+    # TIFF files are not read with get_image
+    get_image = mocker.patch('deepcell_applications.io.get_image')
+
+    files = {
+        'contiguous.tif': (source, {}),
+        'pages.tif': (source, {'compression': 'zlib'}),
+        'ome.ome.tif': (source, {'metadata': {'axes': 'CYX'}}),
+        'tiled.tif': (np.moveaxis(source, 0, -1),
+                      {'tile': (16, 16), 'compression': 'zlib'}),
+    }
+    for name, (data, kwargs) in files.items():
+        path = os.path.join(temp_dir, name)
+        tifffile.imwrite(path, data, photometric='minisblack', **kwargs)
+        img = dca.io.load_image(path, channel=channels, ndim=3)
+        assert img.shape == (40, 30, 1)
+        np.testing.assert_array_equal(img[..., 0], expected)
+
+        with pytest.raises(ValueError):
+            dca.io.load_image(path, channel=[0, 5], ndim=3)
+
+    # only the selected pages are decoded
+    spy = mocker.spy(tifffile.TiffFile, 'asarray')
+    img = dca.io.load_image(os.path.join(temp_dir, 'pages.tif'),
+                            channel=channels, maxworkers=2)
+    np.testing.assert_array_equal(img[..., 0], expected)
+    assert [c[1]['key'] for c in spy.call_args_list] == channels
+    assert all(c[1]['maxworkers'] == 2 for c in spy.call_args_list)
+
+    # the shape is read from the header
+    for name in files:
+        shape = dca.io.get_image_shape(os.path.join(temp_dir, name))
+        assert shape == (40, 30)
+
+    # other images are not decoded to read their shape
+    Image = pytest.importorskip('PIL.Image')
+    get_image = mocker.patch('deepcell_applications.io.get_image')
+    for mode, bands in (('L', 1), ('RGB', 3)):
+        path = os.path.join(temp_dir, '{}.png'.format(mode))
+        Image.new(mode, (30, 40)).save(path)
+        expected_shape = (40, 30) if bands == 1 else (40, 30, bands)
+        assert dca.io.get_pil_shape(path) == expected_shape
+        assert dca.io.get_image_shape(path) == (40, 30)
+    get_image.assert_not_called()
+
+    # 2D images are expanded
+    path = os.path.join(temp_dir, '2d.tif')
+    tifffile.imwrite(path, source[0])
+    img = dca.io.load_image(path, channel=0, ndim=3)
+    np.testing.assert_array_equal(img[..., 0], source[0])
+
+    # test too large of an image fails
+    path = os.path.join(temp_dir, '4d.tif')
+    tifffile.imwrite(path, np.zeros((2, 3, 40, 30), dtype='uint16'))
+    with pytest.raises(ValueError):
+        dca.io.load_image(path, channel=0, ndim=3)
+
+    assert not get_image.called
+
+
+def test_load_channel_groups(tmpdir, mocker):
+    temp_dir = str(tmpdir)
+    source = np.random.randint(0, 100, size=(5, 40, 30)).astype('uint16')
+    path = os.path.join(temp_dir, 'pages.tif')
+    tifffile.imwrite(path, source, photometric='minisblack', compression='zlib')
+
+    # each channel is decoded once, even if it is in several groups
+    spy = mocker.spy(tifffile.TiffFile, 'asarray')
+    outs = dca.io.load_channel_groups(path, [[0, 2], 2, [3, 0]], ndim=3)
+    assert sorted(c[1]['key'] for c in spy.call_args_list) == [0, 2, 3]
+    assert len(outs) == 3
+    for out, channels in zip(outs, [[0, 2], [2], [3, 0]]):
+        assert out.shape == (40, 30, 1)
+        np.testing.assert_array_equal(out[..., 0], source[channels].sum(axis=0))
+
+    # a channel repeated within a group is summed each time
+    outs = dca.io.load_channel_groups(path, [[1, 1]], ndim=3)
+    np.testing.assert_array_equal(outs[0][..., 0], 2 * source[1])
+
+    # the groups are summed into the given outputs
+    img = np.zeros((40, 30, 2), dtype='float32')
+    dca.io.load_channel_groups(path, [4, 1], outs=[img[..., 0:1], img[..., 1:2]])
+    np.testing.assert_array_equal(img, np.stack([source[4], source[1]], axis=-1))
+
+    # an image without a channel axis is read once for every group
+    path = os.path.join(temp_dir, '2d.tif')
+    tifffile.imwrite(path, source[0])
+    outs = dca.io.load_channel_groups(path, [0, 0], ndim=3)
+    for out in outs:
+        np.testing.assert_array_equal(out[..., 0], source[0])
+
+    with pytest.raises(ValueError):
+        dca.io.load_channel_groups(path, [0], outs=[np.zeros((8, 8, 1))])
+
+    with pytest.raises(IOError):
+        dca.io.load_channel_groups(None, [0])
+
+
+def test_downcast_labels():
+    cases = [
+        (np.array([0, 1, 255], dtype='int64'), np.uint8),
+        (np.array([0, 256], dtype='int64'), np.uint16),
+        (np.array([0, 2 ** 16], dtype='int64'), np.uint32),
+        (np.array([0, 2 ** 16], dtype='int32'), np.int32),
+        (np.array([0, 2 ** 32], dtype='int64'), np.int64),
+        # negative values and floats are not labels
+        (np.array([-1, 1], dtype='int64'), np.int64),
+        (np.array([0.5, 1], dtype='float32'), np.float32),
+        # never upcast
+        (np.array([0, 1], dtype='uint8'), np.uint8),
+        (np.array([0, 1], dtype='int8'), np.int8),
+        (np.zeros((0,), dtype='int64'), np.int64),
+    ]
+    for img, dtype in cases:
+        out = dca.io.downcast_labels(img)
+        assert out.dtype == dtype
+        np.testing.assert_array_equal(out, img)
+
+
+def test_save_image(tmpdir):
+    temp_dir = str(tmpdir)
+    img = np.random.randint(0, 1000, size=(1, 64, 48, 1)).astype('int64')
+
+    kwargs = dca.io.get_save_kwargs({'compression': 'none'})
+    assert kwargs == {'compression': None, 'tile': None, 'bigtiff': None}
+
+    with pytest.raises(ValueError):
+        dca.io.get_save_kwargs({'output_tile': 20})
+
+    options = [
+        {'compression': 'zlib'},
+        {'compression': 'zstd', 'output_tile': 16},
+        {'compression': 'lzw', 'bigtiff': True},
+        {},
+    ]
+    for i, option in enumerate(options):
+        path = os.path.join(temp_dir, 'out{}.tif'.format(i))
+        dca.io.save_image(path, img, **dca.io.get_save_kwargs(option))
+        saved = tifffile.imread(path)
+        assert saved.dtype == np.uint16
+        np.testing.assert_array_equal(saved, img)
+
+        with tifffile.TiffFile(path) as tif:
+            assert tif.is_bigtiff == bool(option.get('bigtiff'))
+            assert tif.pages[0].is_tiled == bool(option.get('output_tile'))
+
+    # labels are saved as is without downcasting
+    path = os.path.join(temp_dir, 'int64.tif')
+    dca.io.save_image(path, img, downcast=False)
+    assert tifffile.imread(path).dtype == np.int64
+
+    # multiple channels are saved as samples, not pages
+    path = os.path.join(temp_dir, 'both.tif')
+    img = np.random.randint(0, 1000, size=(1, 64, 48, 2))
+    dca.io.save_image(path, img, tile=(16, 16))
+    np.testing.assert_array_equal(tifffile.imread(path), img)
+    with tifffile.TiffFile(path) as tif:
+        assert len(tif.pages) == 1
+
+    path = os.path.join(temp_dir, 'squeezed.tif')
+    dca.io.save_image(path, img[0], channels=2)
+    np.testing.assert_array_equal(tifffile.imread(path), img[0])
+    with tifffile.TiffFile(path) as tif:
+        assert len(tif.pages) == 1
+
+    # frames of a single channel are saved as pages, not samples
+    path = os.path.join(temp_dir, 'frames.tif')
+    img = np.random.randint(0, 1000, size=(3, 64, 64))
+    dca.io.save_image(path, img, channels=1)
+    np.testing.assert_array_equal(tifffile.imread(path), img)
+    with tifffile.TiffFile(path) as tif:
+        assert len(tif.pages) == 3
+        assert tif.pages[0].shape == (64, 64)
+
+
+def test_get_image_header(tmpdir):
+    temp_dir = str(tmpdir)
+    path = os.path.join(temp_dir, 'img.tif')
+    tifffile.imwrite(path, np.zeros((2, 30, 20), dtype='uint16'),
+                     metadata={'axes': 'CYX'})
+    header = dca.io.get_image_header(path)
+    assert header == {'shape': (2, 30, 20), 'axes': 'CYX',
+                      'dtype': np.dtype('uint16')}
+
+    assert dca.io.get_image_header(os.path.join(temp_dir, 'img.png')) is None
+
+
+def test_atomic_write(tmpdir):
+    temp_dir = str(tmpdir)
+    path = os.path.join(temp_dir, 'out.tif')
+
+    with dca.io.atomic_write(path) as tmp_path:
+        assert tmp_path != path
+        with open(tmp_path, 'w') as f:
+            f.write('complete')
+        assert not os.path.exists(path)
+    with open(path) as f:
+        assert f.read() == 'complete'
+
+    # a failed write leaves the previous file and no temporary file
+    with pytest.raises(RuntimeError):
+        with dca.io.atomic_write(path) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                f.write('partial')
+            raise RuntimeError('crashed')
+    with open(path) as f:
+        assert f.read() == 'complete'
+    assert os.listdir(temp_dir) == ['out.tif']
+
+
+def test_load_image_zarr(tmpdir):
+    zarr = pytest.importorskip('zarr')
+    temp_dir = str(tmpdir)
+    source = np.random.randint(0, 100, size=(1, 3, 1, 40, 30)).astype('uint16')
+
+    # an OME-Zarr image with 2 resolution levels
+    path = os.path.join(temp_dir, 'img.ome.zarr')
+    group = zarr.open_group(path, mode='w')
+    for level, data in enumerate([source, source[..., ::2, ::2]]):
+        array = zarr.open_array(os.path.join(path, str(level)), mode='w',
+                                shape=data.shape, chunks=(1, 1, 1, 16, 16),
+                                dtype=data.dtype)
+        array[:] = data
+    group.attrs['multiscales'] = [{
+        'axes': [{'name': n} for n in 'tczyx'],
+        'datasets': [{'path': '0'}, {'path': '1'}],
+    }]
+
+    assert dca.io.is_zarr(path)
+    assert not dca.io.is_zarr(temp_dir)
+
+    img = dca.io.open_image(path)
+    assert isinstance(img, dca.io.ZarrImage)
+    assert img.shape == (3, 40, 30)
+    assert img.axes == 'CYX'
+    np.testing.assert_array_equal(img[1, 5:10], source[0, 1, 0, 5:10])
+    np.testing.assert_array_equal(np.asarray(img), source[0, :, 0])
+
+    assert dca.io.get_image_shape(path) == (40, 30)
+    assert dca.io.get_image_shape(path, level=1) == (20, 15)
+
+    img = dca.io.load_image(path, channel=[0, 2])
+    assert img.shape == (40, 30, 1)
+    np.testing.assert_array_equal(img[..., 0], source[0, [0, 2], 0].sum(axis=0))
+
+    img = dca.io.load_image(path, channel=1, level=1)
+    np.testing.assert_array_equal(img[..., 0], source[0, 1, 0, ::2, ::2])
+
+    window = dca.io.read_window(dca.io.open_image(path), channel=[1],
+                                rows=slice(0, 8), cols=slice(4, 12))
+    np.testing.assert_array_equal(window[..., 0], source[0, 1, 0, :8, 4:12])
+
+    with pytest.raises(ValueError):
+        dca.io.load_image(path, channel=3)
+
+    with pytest.raises(ValueError):
+        dca.io.open_image(path, level=2)
+
+    # a plain Zarr array uses the smallest axis as channels
+    path = os.path.join(temp_dir, 'array.zarr')
+    array = zarr.open_array(path, mode='w', shape=(40, 30, 2), dtype='uint16')
+    array[:] = source[0, :2, 0].transpose(1, 2, 0)
+    img = dca.io.load_image(path, channel=1)
+    np.testing.assert_array_equal(img[..., 0], source[0, 1, 0])
+
+    with pytest.raises(ValueError):
+        dca.io.open_image(path, level=1)
+
+    # other axes must be a single plane
+    with pytest.raises(ValueError):
+        dca.io.ZarrImage(np.zeros((2, 3, 40, 30)), axes='ZCYX')
+
+    # or a frame axis, which is moved first
+    source = np.random.randint(0, 100, size=(3, 1, 4, 40, 30))
+    img = dca.io.ZarrImage(source, axes='CTZYX', frame_axes='TZ')
+    assert img.shape == (4, 3, 40, 30)
+    assert img.axes == 'ZCYX'
+    np.testing.assert_array_equal(img[2], source[:, 0, 2])
+    np.testing.assert_array_equal(np.asarray(img),
+                                  source[:, 0].transpose(1, 0, 2, 3))
+
+    # a window of a frame only reads the selected channels
+    class RecordingArray(object):
+        def __init__(self, array):
+            self.array = array
+            self.shape = array.shape
+            self.dtype = array.dtype
+            self.keys = []
+
+        def __getitem__(self, key):
+            self.keys.append(key)
+            return self.array[key]
+
+    array = RecordingArray(source)
+    img = dca.io.ZarrImage(array, axes='CTZYX', frame_axes='TZ')
+    rows, cols = slice(5, 25), slice(10, 30)
+    window = dca.io.read_window(img, channel=[2], rows=rows, cols=cols, frame=3)
+    np.testing.assert_array_equal(window[..., 0], source[2, 0, 3, rows, cols])
+    assert array.keys == [(2, 0, 3, rows, cols)]
+
+    # with at most one frame axis of more than one frame
+    with pytest.raises(ValueError):
+        dca.io.ZarrImage(np.zeros((2, 3, 4, 40, 30)), axes='TCZYX',
+                         frame_axes='TZ')
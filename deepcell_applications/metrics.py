@@ -0,0 +1,345 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Timing and resource metrics for each stage of a job"""
+
+import collections
+import contextlib
+import itertools
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import timeit
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+_EMIT_LOCK = threading.Lock()
+
+
+def get_peak_rss():
+    """Returns the peak resident set size of this process in bytes.
+
+    Returns:
+        int: The peak RSS in bytes, or ``None`` if it is not available.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return int(peak) if sys.platform == 'darwin' else int(peak) * 1024
+
+
+def get_current_rss():
+    """Returns the current resident set size of this process in bytes.
+
+    Returns:
+        int: The current RSS in bytes, or ``None`` if it is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    # /proc is only available on Linux
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+
+def read_rss_high_water_mark():
+    """Returns the peak RSS of this process since it was last reset.
+
+    Returns:
+        int: The ``VmHWM`` of this process in bytes, or ``None`` if it is not
+        available.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def reset_rss_high_water_mark():
+    """Reset the peak RSS of this process to its current RSS (Linux only).
+
+    Returns:
+        bool: Whether the peak RSS was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+class PeakRssMonitor(object):
+    """Tracks the peak RSS of the process during intervals that may overlap.
+
+    On Linux, the high-water mark of the process is reset at the start of
+    each interval and read at the end of it. As the high-water mark is
+    shared by the whole process, it is read before every reset and added to
+    the peaks of the intervals that are still running, so nested stages,
+    and stages of other threads, do not hide each other's peaks.
+
+    Where the high-water mark cannot be reset, the RSS is sampled by a
+    background thread every ``interval`` seconds while an interval runs.
+
+    Args:
+        interval (float): The seconds between samples of the RSS.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._peaks = {}
+        self._tokens = itertools.count()
+        self._resettable = None
+        self._sampler = None
+
+    def _read(self):
+        if self._resettable:
+            return read_rss_high_water_mark()
+        return get_current_rss()
+
+    def _observe(self):
+        rss = self._read()
+        if rss is None:
+            return
+        for token, peak in self._peaks.items():
+            if peak is None or rss > peak:
+                self._peaks[token] = rss
+
+    def _sample(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._peaks:
+                    self._sampler = None
+                    return
+                self._observe()
+
+    def start(self):
+        """Start an interval.
+
+        Returns:
+            int: The token to pass to ``stop``.
+        """
+        with self._lock:
+            if self._resettable is None:
+                self._resettable = (read_rss_high_water_mark() is not None and
+                                    reset_rss_high_water_mark())
+
+            # keep the peaks of the running intervals before resetting
+            self._observe()
+            if self._resettable:
+                reset_rss_high_water_mark()
+
+            token = next(self._tokens)
+            self._peaks[token] = None
+            self._observe()
+
+            if not self._resettable and self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample,
+                                                 daemon=True)
+                self._sampler.start()
+            return token
+
+    def stop(self, token):
+        """End an interval.
+
+        Args:
+            token (int): The token returned by ``start``.
+
+        Returns:
+            int: The peak RSS during the interval in bytes,
+            or ``None`` if it is not available.
+        """
+        with self._lock:
+            self._observe()
+            return self._peaks.pop(token)
+
+
+PEAK_RSS = PeakRssMonitor()
+
+
+class JobMetrics(object):
+    """Records the time and memory used by each stage of a single job.
+
+    Stages are timed with a high-resolution clock, and the peak resident set
+    size of the process during each stage is recorded. A stage that is run
+    more than once, e.g. once per tile, accumulates its time and number of
+    calls, and keeps the highest peak.
+
+    Args:
+        arg_dict (dict): Command line args for a single input image.
+    """
+
+    def __init__(self, arg_dict):
+        self.app = arg_dict.get('app')
+        self.inputs = {k: v for k, v in arg_dict.items()
+                       if k.endswith('_path') and v}
+        self.output = os.path.join(arg_dict.get('output_directory', ''),
+                                   arg_dict.get('output_name', ''))
+        self.stages = collections.OrderedDict()
+        self.input_megapixels = None
+        self.output_bytes = None
+        self.cache = None
+        self.timestamp = time.time()
+        self._start = timeit.default_timer()
+
+    @contextlib.contextmanager
+    def stage(self, name, exclude_nested=False):
+        """Context manager timing a stage of the job.
+
+        Args:
+            name (str): The name of the stage.
+            exclude_nested (bool): Whether to leave out the time of the
+                stages run inside this one, e.g. when the tiles of an output
+                are predicted while it is written.
+        """
+        token = PEAK_RSS.start()
+        before = self.get_stage_seconds()
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            seconds = timeit.default_timer() - start
+            if exclude_nested:
+                seconds -= self.get_stage_seconds() - before
+            self.add(name, seconds, peak_rss=PEAK_RSS.stop(token))
+
+    def add(self, name, seconds, peak_rss=None):
+        """Add the time and memory spent in a stage of the job.
+
+        Args:
+            name (str): The name of the stage.
+            seconds (float): The time spent in the stage.
+            peak_rss (int): The peak RSS during the stage in bytes,
+                or ``None`` if it is not known.
+        """
+        stage = self.stages.setdefault(name, {'seconds': 0., 'calls': 0,
+                                              'peak_rss_bytes': None})
+        stage['seconds'] += seconds
+        stage['calls'] += 1
+        if peak_rss is not None and (stage['peak_rss_bytes'] is None or
+                                     peak_rss > stage['peak_rss_bytes']):
+            stage['peak_rss_bytes'] = peak_rss
+
+    def get_peak_rss(self):
+        """Returns the highest peak RSS of all stages so far, or ``None``."""
+        peaks = [stage['peak_rss_bytes'] for stage in self.stages.values()
+                 if stage['peak_rss_bytes'] is not None]
+        return max(peaks) if peaks else None
+
+    def get_stage_seconds(self):
+        """Returns the total time spent in all stages so far."""
+        return sum(stage['seconds'] for stage in self.stages.values())
+
+    def set_input_shape(self, shape):
+        """Record the size of the input from its ``(batch, ..., channels)`` shape."""
+        pixels = 1
+        for dim in shape[:-1]:
+            pixels *= int(dim)
+        self.input_megapixels = pixels / 1e6
+
+    def set_output_file(self, path):
+        """Record the size of the written output file."""
+        self.output_bytes = os.path.getsize(path)
+
+    def to_dict(self):
+        """Returns the metrics as a JSON serializable dictionary."""
+        seconds = timeit.default_timer() - self._start
+        per_megapixel = None
+        if self.input_megapixels:
+            per_megapixel = seconds / self.input_megapixels
+
+        return {
+            'app': self.app,
+            'inputs': self.inputs,
+            'output': self.output,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'timestamp': self.timestamp,
+            'seconds': seconds,
+            'input_megapixels': self.input_megapixels,
+            'seconds_per_megapixel': per_megapixel,
+            'output_bytes': self.output_bytes,
+            'cache': self.cache,
+            'peak_rss_bytes': self.get_peak_rss(),
+            'process_peak_rss_bytes': get_peak_rss(),
+            'stages': self.stages,
+        }
+
+    def emit(self, path):
+        """Append the metrics to a JSON lines file.
+
+        Args:
+            path (str): The file to append a JSON record to,
+                or ``-`` to write to stdout.
+        """
+        record = json.dumps(self.to_dict()) + '\n'
+        with _EMIT_LOCK:
+            if path == '-':
+                sys.stdout.write(record)
+                sys.stdout.flush()
+            else:
+                with open(path, 'a') as f:
+                    f.write(record)
+
+
+def stage(metrics, name, exclude_nested=False):
+    """Returns a context manager timing ``name`` if ``metrics`` is given.
+
+    Args:
+        metrics (JobMetrics): The metrics of the job, or ``None``.
+        name (str): The name of the stage.
+        exclude_nested (bool): Whether to leave out the time of the stages
+            run inside this one.
+
+    Returns:
+        contextlib.AbstractContextManager: The stage timer.
+    """
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.stage(name, exclude_nested=exclude_nested)
@@ -0,0 +1,144 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.metrics"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+import pytest
+
+import deepcell_applications as dca
+
+
+def test_get_peak_rss():
+    peak = dca.metrics.get_peak_rss()
+    assert peak is None or peak > 0
+
+
+def test_get_current_rss():
+    rss = dca.metrics.get_current_rss()
+    assert rss is None or rss > 0
+
+
+@pytest.mark.parametrize('resettable', [True, False])
+def test_peak_rss_monitor(mocker, resettable):
+    if dca.metrics.get_current_rss() is None:
+        pytest.skip('The RSS is not available on this platform.')
+    if resettable and not dca.metrics.reset_rss_high_water_mark():
+        pytest.skip('The peak RSS cannot be reset on this platform.')
+    if not resettable:
+        # sample the RSS in a background thread instead
+        mocker.patch('deepcell_applications.metrics.reset_rss_high_water_mark',
+                     return_value=False)
+
+    size = 64 * 2 ** 20
+    monitor = dca.metrics.PeakRssMonitor(interval=0.001)
+
+    # memory that is allocated and freed inside an interval is included
+    outer = monitor.start()
+    before = dca.metrics.get_current_rss()
+    inner = monitor.start()
+    temp = np.ones(size, dtype='uint8')
+    time.sleep(0.05)
+    del temp
+    inner_peak = monitor.stop(inner)
+    assert dca.metrics.get_current_rss() < before + size / 2
+    assert inner_peak >= before + size * 0.9
+
+    # resetting the peak for a nested interval does not hide it from others
+    assert monitor.stop(outer) >= inner_peak
+
+    # later intervals do not include earlier peaks
+    token = monitor.start()
+    assert monitor.stop(token) < before + size / 2
+
+
+def test_job_metrics(tmpdir, capsys, mocker):
+    temp_dir = str(tmpdir)
+    arg_dict = {
+        'app': 'mesmer',
+        'nuclear_path': 'nuclear.tif',
+        'membrane_path': None,
+        'output_directory': temp_dir,
+        'output_name': 'mask.tif',
+    }
+    metrics = dca.metrics.JobMetrics(arg_dict)
+
+    # the highest peak RSS of all calls of a stage is kept
+    peaks = iter([150, 100])
+    mocker.patch.object(dca.metrics.PEAK_RSS, 'stop',
+                        side_effect=lambda token: next(peaks))
+    for _ in range(2):
+        with metrics.stage('load'):
+            time.sleep(0.001)
+    mocker.patch.object(dca.metrics.PEAK_RSS, 'stop', return_value=None)
+    with dca.metrics.stage(metrics, 'predict'):
+        pass
+
+    # nested stages are left out of the time of a stage
+    with dca.metrics.stage(metrics, 'write', exclude_nested=True):
+        with dca.metrics.stage(metrics, 'stitch'):
+            time.sleep(0.01)
+    metrics.set_input_shape((1, 1000, 2000, 2))
+
+    outfile = os.path.join(temp_dir, 'mask.tif')
+    with open(outfile, 'wb') as f:
+        f.write(b'0' * 100)
+    metrics.set_output_file(outfile)
+
+    record = metrics.to_dict()
+    assert record['inputs'] == {'nuclear_path': 'nuclear.tif'}
+    assert record['output'] == outfile
+    assert record['input_megapixels'] == 2
+    assert record['output_bytes'] == 100
+    assert record['seconds_per_megapixel'] == record['seconds'] / 2
+    assert list(record['stages']) == ['load', 'predict', 'stitch', 'write']
+    assert record['stages']['load']['calls'] == 2
+    assert record['stages']['load']['seconds'] >= 0.002
+    assert record['stages']['load']['peak_rss_bytes'] == 150
+    assert record['stages']['predict']['peak_rss_bytes'] is None
+    assert record['stages']['write']['seconds'] < 0.01
+    assert record['peak_rss_bytes'] == 150
+    assert metrics.get_stage_seconds() <= record['seconds']
+
+    # records are appended as JSON lines
+    metrics_file = os.path.join(temp_dir, 'metrics.jsonl')
+    metrics.emit(metrics_file)
+    metrics.emit(metrics_file)
+    with open(metrics_file) as f:
+        lines = f.readlines()
+    assert len(lines) == 2
+    assert json.loads(lines[0])['output_bytes'] == 100
+
+    metrics.emit('-')
+    assert json.loads(capsys.readouterr().out)['output'] == outfile
+
+    # no metrics are recorded without a JobMetrics
+    with dca.metrics.stage(None, 'load'):
+        pass
@@ -0,0 +1,318 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Functions for caching the models of applications for offline loading"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import deepcell_applications as dca
+
+
+logger = logging.getLogger(__name__)
+
+
+MANIFEST = 'manifest.json'
+DEFAULT_MODEL_DIRECTORY = os.path.join(
+    os.path.expanduser('~'), '.deepcell', 'models')
+
+
+def get_model_directory(directory=None):
+    """Returns the model cache directory.
+
+    Args:
+        directory (str): The directory, defaults to ``DEEPCELL_MODEL_DIR``
+            or ``~/.deepcell/models``.
+
+    Returns:
+        str: The model cache directory.
+    """
+    return directory or os.environ.get('DEEPCELL_MODEL_DIR') or \
+        DEFAULT_MODEL_DIRECTORY
+
+
+def is_offline(offline=None):
+    """Returns whether models must be loaded without any network access.
+
+    Args:
+        offline (bool): Whether to load offline, defaults to
+            ``DEEPCELL_OFFLINE``.
+
+    Returns:
+        bool: True if models must be loaded from the model cache.
+    """
+    if offline is not None:
+        return bool(offline)
+    return os.environ.get('DEEPCELL_OFFLINE', '').lower() in ('1', 'true', 'yes')
+
+
+def get_deepcell_version():
+    """Returns the installed ``deepcell`` version, or ``None`` if not known."""
+    try:
+        import deepcell  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return getattr(deepcell, '__version__', None)
+
+
+def get_model_path(app_class, directory=None):
+    """Returns the path of the cached model of an application class.
+
+    The path includes the installed ``deepcell`` version, so a model cached
+    by another version is not used after an upgrade.
+    """
+    name = app_class.__name__
+    version = get_deepcell_version()
+    if version:
+        name = '{}-{}'.format(name, version)
+    return os.path.join(get_model_directory(directory), name)
+
+
+def get_file_checksum(path, chunk_size=2 ** 20):
+    """Returns the sha256 hex digest of a file."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_checksums(path):
+    """Returns the sha256 of each file of a saved model, and of all of them.
+
+    Args:
+        path (str): The directory of the saved model.
+
+    Returns:
+        tuple: The ``(files, sha256)`` of the model, where ``files`` maps
+            the relative path of each file to its sha256.
+    """
+    files = {}
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for name in sorted(names):
+            filepath = os.path.join(root, name)
+            relpath = os.path.relpath(filepath, path).replace(os.sep, '/')
+            if relpath != MANIFEST:
+                files[relpath] = get_file_checksum(filepath)
+
+    h = hashlib.sha256()
+    for relpath in sorted(files):
+        h.update('{}:{}\n'.format(relpath, files[relpath]).encode('utf-8'))
+    return files, h.hexdigest()
+
+
+def load_manifest(path):
+    """Returns the manifest of a cached model, or None if there is none."""
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def is_cached(path):
+    """Returns whether a model was cached in path by this ``deepcell`` version.
+
+    Args:
+        path (str): The directory of the cached model.
+
+    Returns:
+        bool: True if the model has a manifest of the installed version.
+    """
+    manifest = load_manifest(path)
+    if manifest is None:
+        return False
+
+    version = get_deepcell_version()
+    if manifest.get('deepcell_version') != version:
+        logger.warning('The model in %s was cached by deepcell %s, but %s is '
+                       'installed. It is not used.', path,
+                       manifest.get('deepcell_version'), version)
+        return False
+    return True
+
+
+def verify_model(path, sha256=None):
+    """Check that the files of a cached model match its manifest.
+
+    Args:
+        path (str): The directory of the cached model.
+        sha256 (str): Optional expected checksum of the whole model,
+            e.g. the one logged when it was prefetched.
+
+    Returns:
+        str: The sha256 of the model.
+
+    Raises:
+        IOError: If the model or its manifest does not exist, or the model
+            was cached by another ``deepcell`` version.
+        ValueError: If any file is missing, changed or unexpected.
+    """
+    if not is_cached(path):
+        raise IOError('No cached model found in {} for deepcell {}. Run '
+                      '`python run_app.py prefetch` to cache it.'.format(
+                          path, get_deepcell_version()))
+    manifest = load_manifest(path)
+
+    files, digest = get_checksums(path)
+    changed = sorted(set(files) ^ set(manifest['files']) | {
+        f for f in files if manifest['files'].get(f) not in (None, files[f])})
+    if changed:
+        raise ValueError('The cached model in {} is corrupt. Files that do '
+                         'not match its manifest: {}'.format(path, changed))
+
+    if sha256 and digest != sha256:
+        raise ValueError('The cached model in {} has checksum {} but {} was '
+                         'expected.'.format(path, digest, sha256))
+    return digest
+
+
+def get_pinned_checksum(name):
+    """Returns the ``model_sha256`` of an application in its settings."""
+    return dca.settings.VALID_APPLICATIONS[str(name).lower()].get('model_sha256')
+
+
+def save_model(model, path, sha256=None):
+    """Save a Keras model with a manifest of its checksums.
+
+    The manifest also records the installed ``deepcell`` version, so the
+    model is not loaded by another version.
+
+    The model is written to a temporary directory next to ``path`` and
+    moved into place once its manifest is written, so an interrupted save
+    never leaves a partial model behind.
+
+    Args:
+        model (tf.keras.Model): The model to save.
+        path (str): The directory of the cached model.
+        sha256 (str): Optional expected checksum of the saved model.
+            A model with another checksum is not saved.
+
+    Returns:
+        str: The sha256 of the saved model.
+
+    Raises:
+        ValueError: If the checksum is not ``sha256``.
+    """
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+
+    try:
+        model.save(tmp_path, include_optimizer=False)
+        files, digest = get_checksums(tmp_path)
+        if sha256 and digest != sha256:
+            raise ValueError('The model saved to {} has checksum {}, '
+                             'expected {}.'.format(path, digest, sha256))
+        with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+            json.dump({'files': files, 'sha256': digest,
+                       'deepcell_version': get_deepcell_version()}, f, indent=1)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+
+    return digest
+
+
+def prefetch_model(name, directory=None, overwrite=False):
+    """Download the model of an application into the model cache.
+
+    The application is built once, which downloads its weights if needed,
+    and its model is saved to the model cache. If the application pins a
+    ``model_sha256``, a model with another checksum is not cached, so a
+    wrong model fails when it is prefetched rather than when it is loaded.
+
+    Args:
+        name (str): The name of the application.
+        directory (str): The model cache directory.
+        overwrite (bool): Whether to replace a valid cached model.
+
+    Returns:
+        str: The path of the cached model.
+
+    Raises:
+        ValueError: If the model does not match the pinned checksum.
+    """
+    app_class = dca.utils.get_app_class(name)
+    path = get_model_path(app_class, directory)
+    sha256 = get_pinned_checksum(name)
+
+    if not overwrite and is_cached(path):
+        try:
+            digest = verify_model(path, sha256=sha256)
+            logger.info('%s is already cached in %s (sha256 %s).',
+                        name, path, digest)
+            return path
+        except ValueError as err:
+            logger.warning('Replacing the cached model: %s', err)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    digest = save_model(app_class().model, path, sha256=sha256)
+    logger.info('Cached the %s model in %s (sha256 %s).', name, path, digest)
+    return path
+
+
+def load_app(app_class, directory=None, offline=None, sha256=None, **kwargs):
+    """Instantiate an application, loading its model from the model cache.
+
+    If the model is cached, it is verified and loaded from its local path,
+    and passed to the application, so no weights are downloaded. Otherwise
+    the application loads its model itself, unless ``offline`` is set.
+
+    Args:
+        app_class (class): The ``deepcell.applications.Application`` class.
+        directory (str): The model cache directory.
+        offline (bool): Whether to fail instead of downloading a model that
+            is not cached. Defaults to ``DEEPCELL_OFFLINE``.
+        sha256 (str): Optional expected checksum of the cached model.
+        kwargs (dict): Keyword arguments used for application instantiation.
+
+    Returns:
+        deepcell.applications.Application: The instantiated application.
+
+    Raises:
+        IOError: If ``offline`` is set and the model is not cached.
+        ValueError: If the cached model does not match its checksums.
+    """
+    path = get_model_path(app_class, directory)
+
+    if 'model' not in kwargs and (
+            is_offline(offline) or is_cached(path)):
+        verify_model(path, sha256=sha256)
+
+        import tensorflow as tf  # pylint: disable=import-outside-toplevel
+
+        kwargs['model'] = tf.keras.models.load_model(path, compile=False)
+        logger.debug('Loaded the %s model from %s.', app_class.__name__, path)
+
+    return app_class(**kwargs)
@@ -0,0 +1,199 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.models"""
+
+import os
+import sys
+
+import pytest
+
+import deepcell_applications as dca
+
+
+class DummyModel(object):
+
+    def save(self, path, include_optimizer=True):
+        os.makedirs(os.path.join(path, 'variables'))
+        with open(os.path.join(path, 'saved_model.pb'), 'wb') as f:
+            f.write(b'graph')
+        with open(os.path.join(path, 'variables', 'variables.data'), 'wb') as f:
+            f.write(b'weights')
+
+
+class DummyApplication(object):
+
+    instances = 0
+
+    def __init__(self, model=None):
+        DummyApplication.instances += 1
+        self.model = DummyModel() if model is None else model
+        self.loaded = model is not None
+
+
+MOCKED_APPLICATIONS = {
+    'dummy': {
+        'class': DummyApplication,
+        'predict_options': [],
+    }
+}
+
+
+def test_get_model_directory(monkeypatch):
+    monkeypatch.delenv('DEEPCELL_MODEL_DIR', raising=False)
+    assert dca.models.get_model_directory() == dca.models.DEFAULT_MODEL_DIRECTORY
+    monkeypatch.setenv('DEEPCELL_MODEL_DIR', '/env')
+    assert dca.models.get_model_directory() == '/env'
+    assert dca.models.get_model_directory('/models') == '/models'
+
+    monkeypatch.delenv('DEEPCELL_OFFLINE', raising=False)
+    assert not dca.models.is_offline()
+    monkeypatch.setenv('DEEPCELL_OFFLINE', '1')
+    assert dca.models.is_offline()
+    assert not dca.models.is_offline(False)
+
+
+def test_save_model(tmpdir):
+    path = os.path.join(str(tmpdir), 'Dummy')
+    digest = dca.models.save_model(DummyModel(), path)
+
+    manifest = dca.models.load_manifest(path)
+    assert manifest['sha256'] == digest
+    assert sorted(manifest['files']) == ['saved_model.pb', 'variables/variables.data']
+    assert not [f for f in os.listdir(str(tmpdir)) if '.tmp' in f]
+
+    assert dca.models.verify_model(path) == digest
+    assert dca.models.verify_model(path, sha256=digest) == digest
+    with pytest.raises(ValueError, match='checksum'):
+        dca.models.verify_model(path, sha256='0' * 64)
+
+    # changed, missing and unexpected files are detected
+    with open(os.path.join(path, 'variables', 'variables.data'), 'ab') as f:
+        f.write(b'!')
+    with pytest.raises(ValueError, match='variables.data'):
+        dca.models.verify_model(path)
+
+    dca.models.save_model(DummyModel(), path)
+    os.remove(os.path.join(path, 'saved_model.pb'))
+    with pytest.raises(ValueError, match='saved_model.pb'):
+        dca.models.verify_model(path)
+
+    dca.models.save_model(DummyModel(), path)
+    open(os.path.join(path, 'extra'), 'w').close()
+    with pytest.raises(ValueError, match='extra'):
+        dca.models.verify_model(path)
+
+    with pytest.raises(IOError):
+        dca.models.verify_model(os.path.join(str(tmpdir), 'missing'))
+
+
+def test_prefetch_model(tmpdir, mocker):
+    mocker.patch('deepcell_applications.settings.VALID_APPLICATIONS',
+                 MOCKED_APPLICATIONS)
+    mocker.patch('deepcell_applications.models.get_deepcell_version',
+                 return_value='0.12.5')
+    directory = str(tmpdir)
+    DummyApplication.instances = 0
+
+    # the cache path and manifest include the deepcell version
+    path = dca.models.prefetch_model('dummy', directory=directory)
+    assert path == os.path.join(directory, 'DummyApplication-0.12.5')
+    assert dca.models.load_manifest(path)['deepcell_version'] == '0.12.5'
+    dca.models.verify_model(path)
+    assert DummyApplication.instances == 1
+
+    # a valid cached model is kept
+    dca.models.prefetch_model('dummy', directory=directory)
+    assert DummyApplication.instances == 1
+
+    dca.models.prefetch_model('dummy', directory=directory, overwrite=True)
+    assert DummyApplication.instances == 2
+
+    # a corrupt cached model is replaced
+    os.remove(os.path.join(path, 'saved_model.pb'))
+    dca.models.prefetch_model('dummy', directory=directory)
+    assert DummyApplication.instances == 3
+    dca.models.verify_model(path)
+
+
+def test_prefetch_model_pinned(tmpdir, mocker):
+    applications = {'dummy': dict(MOCKED_APPLICATIONS['dummy'])}
+    mocker.patch('deepcell_applications.settings.VALID_APPLICATIONS',
+                 applications)
+    directory = str(tmpdir)
+    path = dca.models.get_model_path(DummyApplication, directory)
+    digest = dca.models.save_model(DummyModel(), os.path.join(directory, 'ref'))
+
+    # a model with another checksum is not cached
+    applications['dummy']['model_sha256'] = '0' * 64
+    with pytest.raises(ValueError, match='checksum'):
+        dca.models.prefetch_model('dummy', directory=directory)
+    assert not os.path.exists(path)
+
+    applications['dummy']['model_sha256'] = digest
+    assert dca.models.prefetch_model('dummy', directory=directory) == path
+    assert dca.models.verify_model(path) == digest
+
+
+def test_load_app(tmpdir, mocker, monkeypatch):
+    monkeypatch.delenv('DEEPCELL_OFFLINE', raising=False)
+    directory = str(tmpdir)
+    tf = mocker.MagicMock()
+    mocker.patch.dict(sys.modules, {'tensorflow': tf})
+
+    # models that are not cached are loaded by the application
+    app = dca.models.load_app(DummyApplication, directory=directory)
+    assert not app.loaded
+    assert not tf.keras.models.load_model.called
+
+    # unless models must be loaded offline
+    with pytest.raises(IOError, match='prefetch'):
+        dca.models.load_app(DummyApplication, directory=directory, offline=True)
+
+    # cached models are verified and passed to the application
+    path = dca.models.get_model_path(DummyApplication, directory)
+    digest = dca.models.save_model(DummyModel(), path)
+    app = dca.models.load_app(DummyApplication, directory=directory,
+                              offline=True, sha256=digest)
+    assert app.loaded
+    assert app.model is tf.keras.models.load_model.return_value
+    assert tf.keras.models.load_model.call_args[0][0] == path
+
+    with pytest.raises(ValueError):
+        dca.models.load_app(DummyApplication, directory=directory,
+                            sha256='0' * 64)
+
+    # a model cached by another deepcell version is a cache miss
+    tf.keras.models.load_model.reset_mock()
+    mocker.patch('deepcell_applications.models.get_deepcell_version',
+                 return_value='99.0')
+    mocker.patch('deepcell_applications.models.get_model_path',
+                 return_value=path)
+    assert not dca.models.is_cached(path)
+    app = dca.models.load_app(DummyApplication, directory=directory)
+    assert not app.loaded
+    assert not tf.keras.models.load_model.called
+    with pytest.raises(IOError, match='prefetch'):
+        dca.models.load_app(DummyApplication, directory=directory, offline=True)
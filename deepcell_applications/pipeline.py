@@ -0,0 +1,90 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Functions for overlapping the load, predict and write stages of many inputs"""
+
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+def run_pipeline(items, load, predict, write, depth=2,
+                 load_workers=1, write_workers=1):
+    """Run ``load``, ``predict`` and ``write`` on each item in a pipeline.
+
+    Inputs are loaded by background threads while the current input is
+    predicted on the calling thread, and outputs are written by background
+    threads. At most ``depth`` inputs are loaded ahead of the model and
+    at most ``depth`` outputs are waiting to be written, so memory use is
+    bounded no matter how many items there are.
+
+    Args:
+        items (iterable): The items to process.
+        load (function): Called as ``load(item)`` to load an input.
+        predict (function): Called as ``predict(item, data)`` with the loaded
+            input to return an output.
+        write (function): Called as ``write(item, output)`` to save an output.
+        depth (int): Maximum number of inputs loaded ahead, and outputs
+            waiting to be written.
+        load_workers (int): Number of threads loading inputs.
+        write_workers (int): Number of threads writing outputs.
+
+    Raises:
+        Exception: The first error raised by any of the stages.
+    """
+    depth = max(1, int(depth))
+    items = iter(items)
+    loading = collections.deque()
+    writing = collections.deque()
+
+    with ThreadPoolExecutor(load_workers) as loaders, \
+            ThreadPoolExecutor(write_workers) as writers:
+
+        def fill():
+            while len(loading) < depth:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                loading.append((item, loaders.submit(load, item)))
+
+        fill()
+        while loading:
+            item, future = loading.popleft()
+            data = future.result()
+            fill()
+
+            output = predict(item, data)
+            del data  # release the input before waiting on the writers
+
+            writing.append(writers.submit(write, item, output))
+            del output
+
+            # wait for the oldest outputs to keep the queue bounded
+            while len(writing) > depth:
+                writing.popleft().result()
+
+        while writing:
+            writing.popleft().result()
@@ -0,0 +1,93 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.pipeline"""
+
+import threading
+import time
+
+import pytest
+
+import deepcell_applications as dca
+
+
+def test_run_pipeline():
+    items = list(range(20))
+    lock = threading.Lock()
+    state = {'in_flight': 0, 'max_in_flight': 0}
+    written = []
+
+    def load(item):
+        with lock:
+            state['in_flight'] += 1
+            state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+        time.sleep(0.001)
+        return item * 2
+
+    def predict(item, data):
+        assert data == item * 2
+        return data + 1
+
+    def write(item, output):
+        time.sleep(0.002)
+        assert output == item * 2 + 1
+        with lock:
+            written.append(item)
+            state['in_flight'] -= 1
+
+    for depth in (1, 2, 4):
+        written.clear()
+        state['max_in_flight'] = 0
+        dca.pipeline.run_pipeline(items, load, predict, write, depth=depth)
+        assert sorted(written) == items
+        # loaded ahead + predicting + waiting to be written
+        assert state['max_in_flight'] <= 2 * depth + 1
+
+    # generators are consumed lazily
+    dca.pipeline.run_pipeline(iter(items), load, predict, write)
+
+    # nothing to do
+    dca.pipeline.run_pipeline([], load, predict, write)
+
+
+def test_run_pipeline_errors():
+    def fail_on(n):
+        def f(item, *_):
+            if item == n:
+                raise ValueError('failed on {}'.format(item))
+            return item
+        return f
+
+    passthrough = fail_on(None)
+
+    # errors in any stage are raised in the calling thread
+    with pytest.raises(ValueError):
+        dca.pipeline.run_pipeline(range(10), fail_on(3), passthrough, passthrough)
+
+    with pytest.raises(ValueError):
+        dca.pipeline.run_pipeline(range(10), passthrough, fail_on(3), passthrough)
+
+    with pytest.raises(ValueError):
+        dca.pipeline.run_pipeline(range(10), passthrough, passthrough, fail_on(3))
@@ -0,0 +1,403 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Functions for checking jobs and estimating their resources before reading pixels"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+import deepcell_applications as dca
+
+
+logger = logging.getLogger(__name__)
+
+# Ratio of the runtime of a job to the time the model takes to predict its
+# pixels at the calibrated throughput. The tiles overlap and the labels are
+# post-processed, which calibration does not measure.
+CALIBRATED_OVERHEAD = 3
+
+
+def get_app_spec(name, app=None):
+    """Returns the inputs and model shape of an application.
+
+    Args:
+        name (str): The name of the application.
+        app (deepcell.applications.Application): An instantiated application
+            to use instead of the settings.
+
+    Returns:
+        dict: The ``inputs``, ``model_image_shape``, ``required_channels``,
+            ``class_name`` and default ``seconds_per_megapixel``.
+    """
+    app_class = dca.utils.get_app_class(name, load=False)  # raises for invalid names
+    app_settings = dca.settings.VALID_APPLICATIONS[str(name).lower()]
+    spec = {
+        'inputs': app_settings.get('inputs', []),
+        'model_image_shape': app_settings.get('model_image_shape'),
+        'required_channels': app_settings.get('required_channels'),
+        'class_name': getattr(app_class, '__name__',
+                              str(app_class).rsplit('.', 1)[-1]),
+        'seconds_per_megapixel': app_settings.get('seconds_per_megapixel'),
+    }
+    if app is not None:
+        spec['model_image_shape'] = tuple(app.model_image_shape)
+        spec['required_channels'] = app.required_channels
+        spec['class_name'] = app.__class__.__name__
+    return spec
+
+
+def check_input(path, channel=0, ndim=3, level=0, stack=False):
+    """Check the rank and channels of an input image from its header.
+
+    Args:
+        path (str): Filepath to the image file.
+        channel (list): The channels that will be read.
+        ndim (int): The rank of an image with a channel axis.
+        level (int): The resolution level of an OME-Zarr image.
+        stack (bool): Whether the first axis of the image is the frame axis.
+
+    Returns:
+        dict: The number of ``frames`` and the spatial ``shape`` of the
+            image, or ``None`` if the header can not be read without
+            decoding the image.
+
+    Raises:
+        ValueError: If the rank or channels of the image are invalid.
+    """
+    header = dca.io.get_image_header(path, level=level, stack=stack)
+    if header is None:
+        return None
+
+    shape = header['shape']
+    axes = header['axes']
+    frames = 1
+    if stack:
+        if len(shape) not in (ndim, ndim + 1):
+            raise ValueError('Expected a stack with ndim = {} or {} but found '
+                             'ndim={} and shape={}'.format(
+                                 ndim, ndim + 1, len(shape), shape))
+        # the channels of each frame are found from their shape
+        frames, shape, axes = shape[0], shape[1:], None
+
+    channel = channel if isinstance(channel, (list, tuple)) else [channel]
+    if len(shape) == ndim:
+        if axes:
+            axis = dca.io.get_tiff_channel_axis(axes, shape)
+        else:
+            axis = dca.io.get_channel_axis(shape)
+        dca.io.check_channels(channel, shape[axis])
+        shape = shape[:axis] + shape[axis + 1:]
+
+    elif len(shape) != ndim - 1:
+        raise ValueError('Expected image with ndim = {} or {} but found '
+                         'ndim={} and shape={}'.format(
+                             ndim - 1, ndim, len(shape), shape))
+
+    return {'frames': frames, 'shape': tuple(shape)}
+
+
+def load_history(metrics_file, name):
+    """Returns the median seconds per megapixel of previous jobs.
+
+    Args:
+        metrics_file (str): A JSON lines file written with ``--metrics-file``.
+        name (str): The name of the application.
+
+    Returns:
+        float: The median seconds per megapixel, or ``None`` if there are
+            no previous jobs of the application.
+    """
+    if not metrics_file or not os.path.isfile(metrics_file):
+        return None
+
+    costs = []
+    with open(metrics_file) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('app') == name and record.get('seconds_per_megapixel'):
+                costs.append(record['seconds_per_megapixel'])
+
+    return float(np.median(costs)) if costs else None
+
+
+def get_seconds_per_megapixel(job, spec, cache_path=None):
+    """Returns the estimated seconds per megapixel of a job and its source.
+
+    The cost of previous jobs in the ``metrics_file`` of the job is used if
+    there is one. Otherwise, the cost is estimated from the throughput
+    calibrated by an automatic batch size on this host, or from the
+    ``seconds_per_megapixel`` of the application settings.
+
+    Args:
+        job (dict): Command line args for a single input image.
+        spec (dict): The application spec from ``get_app_spec``.
+        cache_path (str): JSON file the batch size is cached in.
+            Defaults to ``dca.autotune.DEFAULT_CACHE_PATH``.
+
+    Returns:
+        tuple: The seconds per megapixel, or ``None`` if it is not known,
+            and its source: ``history``, ``calibrated`` or ``default``.
+    """
+    cost = load_history(job.get('metrics_file'), job['app'])
+    if cost:
+        return cost, 'history'
+
+    shape = spec['model_image_shape']
+    if shape:
+        key = dca.autotune.format_cache_key(
+            spec['class_name'], shape,
+            backend=job.get('backend'), precision=job.get('precision'))
+        tiles_per_second = dca.autotune.get_cached_throughput(
+            key, cache_path=cache_path or dca.autotune.DEFAULT_CACHE_PATH)
+        if tiles_per_second:
+            megapixels_per_second = tiles_per_second * shape[0] * shape[1] / 1e6
+            return CALIBRATED_OVERHEAD / megapixels_per_second, 'calibrated'
+
+    return spec.get('seconds_per_megapixel'), 'default'
+
+
+def estimate_memory(job, frames, shape, spec):
+    """Estimates the peak memory of a job in bytes.
+
+    The estimate includes the float32 input batch, the int64 labels, and
+    the memory used by the model to predict a batch of tiles.
+
+    Args:
+        job (dict): Command line args for a single input image.
+        frames (int): The number of frames of the input.
+        shape (tuple): The ``(height, width)`` of the input.
+        spec (dict): The application spec from ``get_app_spec``.
+
+    Returns:
+        int: The estimated peak memory.
+    """
+    height, width = shape
+    if job.get('tile_size'):
+        window = job['tile_size'] + 2 * job.get('tile_overlap', 0)
+        # a window is predicted while strips of the previous rows are kept
+        pixels = min(height, window) * min(width, window) + width * window
+    elif job.get('stack'):
+        pixels = min(frames, job.get('stack_chunk') or 16) * height * width
+    else:
+        pixels = height * width
+
+    channels = len(spec['inputs']) or 1
+    output_channels = 2 if job.get('compartment') == 'both' else 1
+    data_bytes = pixels * (channels * 4 + output_channels * 8)
+
+    model_bytes = 0
+    if spec['model_image_shape']:
+        batch_size = job.get('batch_size')
+        if not isinstance(batch_size, int):  # an automatic batch size
+            batch_size = dca.autotune.get_max_batch_size(spec['model_image_shape'])
+        model_bytes = batch_size * dca.autotune.estimate_tile_bytes(
+            spec['model_image_shape'])
+
+    return int(data_bytes + model_bytes)
+
+
+def check_job(job, spec, seconds_per_megapixel=None, estimate='history'):
+    """Check the inputs of a job and estimate its resources from headers.
+
+    Args:
+        job (dict): Command line args for a single input image.
+        spec (dict): The application spec from ``get_app_spec``.
+        seconds_per_megapixel (float): The estimated cost of the job,
+            used to estimate the runtime.
+        estimate (str): The source of ``seconds_per_megapixel``, from
+            ``get_seconds_per_megapixel``.
+
+    Returns:
+        dict: The plan of the job, with any ``errors`` found.
+    """
+    plan = {
+        'output': dca.app_runners.get_output_path(job),
+        'inputs': {},
+        'frames': None,
+        'shape': None,
+        'megapixels': None,
+        'memory_bytes': None,
+        'seconds': None,
+        'estimate': None,
+        'checked': True,
+        'errors': [],
+    }
+
+    # the prepared input has a channel for each input of the application
+    if spec['required_channels'] and len(spec['inputs']) != spec['required_channels']:
+        plan['errors'].append('{} inputs are prepared but the application '
+                              'requires {} channels.'.format(
+                                  len(spec['inputs']), spec['required_channels']))
+    if spec['model_image_shape'] and len(spec['model_image_shape']) != 3:
+        plan['errors'].append('Inputs are prepared with ndim = 3 but the '
+                              'application expects {}.'.format(
+                                  spec['model_image_shape']))
+
+    found = {}
+    for name in spec['inputs']:
+        path = job.get('{}_path'.format(name))
+        if not path:
+            continue
+        plan['inputs'][name] = path
+        try:
+            info = check_input(path,
+                               channel=job.get('{}_channel'.format(name), 0),
+                               level=job.get('resolution_level', 0),
+                               stack=bool(job.get('stack')))
+        except (ValueError, IOError, OSError) as err:
+            plan['errors'].append('{}: {}'.format(path, err))
+            continue
+
+        if info is None:
+            plan['checked'] = False
+        else:
+            found[name] = info
+
+    if len({(i['frames'], i['shape']) for i in found.values()}) > 1:
+        plan['errors'].append('Input shapes do not match: {}'.format(
+            ', '.join('{} {}'.format(name, (i['frames'],) + i['shape'])
+                      for name, i in found.items())))
+
+    elif found:
+        info = next(iter(found.values()))
+        frames, shape = info['frames'], info['shape']
+        plan['frames'] = frames
+        plan['shape'] = shape
+        plan['megapixels'] = frames * shape[0] * shape[1] / 1e6
+        plan['memory_bytes'] = estimate_memory(job, frames, shape, spec)
+        if seconds_per_megapixel:
+            plan['seconds'] = plan['megapixels'] * seconds_per_megapixel
+            plan['estimate'] = estimate
+
+    return plan
+
+
+def check_jobs(jobs, app=None):
+    """Check the inputs of every job and estimate their resources.
+
+    Only the headers of TIFF files and Zarr stores are read. The inputs of
+    other files can not be checked without decoding them, and are checked
+    when they are loaded instead. The runtime of each job is estimated from
+    ``get_seconds_per_megapixel``.
+
+    Args:
+        jobs (list): Command line args for each input image.
+        app (deepcell.applications.Application): An instantiated application,
+            if one is already built.
+
+    Returns:
+        list: The plan of each job.
+    """
+    if not jobs:
+        return []
+
+    name = jobs[0]['app']
+    spec = get_app_spec(name, app=app)
+    cost, estimate = get_seconds_per_megapixel(jobs[0], spec)
+
+    plans = [check_job(job, spec, seconds_per_megapixel=cost, estimate=estimate)
+             for job in jobs]
+
+    unchecked = sum(not p['checked'] for p in plans)
+    if unchecked:
+        logger.warning('%s of %s jobs have inputs that can only be checked '
+                       'once they are loaded.', unchecked, len(plans))
+    return plans
+
+
+def raise_errors(plans):
+    """Raise a ValueError listing the errors of all jobs, if there are any."""
+    errors = ['{}: {}'.format(p['output'], e) for p in plans for e in p['errors']]
+    if errors:
+        raise ValueError('Invalid inputs for {} of {} jobs:\n{}'.format(
+            sum(bool(p['errors']) for p in plans), len(plans), '\n'.join(errors)))
+
+
+def _format_megabytes(nbytes):
+    return '?' if nbytes is None else '{:.1f}'.format(nbytes / 2 ** 20)
+
+
+def _format_seconds(seconds, estimate):
+    if seconds is None:
+        return '?'
+    return '{:.1f} ({})'.format(seconds, estimate)
+
+
+def format_plan(plans):
+    """Returns a table of the plan of each job and the totals.
+
+    The estimated runtime of each job is labeled with its source, e.g.
+    ``12.0 (default)``.
+
+    Args:
+        plans (list): The plan of each job from ``check_jobs``.
+
+    Returns:
+        str: The formatted plan.
+    """
+    rows = [('output', 'shape', 'megapixels', 'memory_mb', 'seconds', 'status')]
+    for p in plans:
+        # the shape is a list in plans returned by a server as JSON
+        shape = p['shape'] and 'x'.join(
+            str(d) for d in (p['frames'],) + tuple(p['shape']))
+        status = 'ok' if p['checked'] else 'unchecked'
+        if p['errors']:
+            status = 'error: ' + '; '.join(p['errors'])
+        rows.append((
+            p['output'],
+            shape or '?',
+            '?' if p['megapixels'] is None else '{:.2f}'.format(p['megapixels']),
+            _format_megabytes(p['memory_bytes']),
+            _format_seconds(p['seconds'], p['estimate']),
+            status,
+        ))
+
+    megapixels = sum(p['megapixels'] or 0 for p in plans)
+    seconds = [p['seconds'] for p in plans]
+    estimates = {p['estimate'] for p in plans if p['estimate']}
+    memory = [p['memory_bytes'] for p in plans if p['memory_bytes']]
+    rows.append((
+        'total: {} jobs, {} with errors'.format(
+            len(plans), sum(bool(p['errors']) for p in plans)),
+        '',
+        '{:.2f}'.format(megapixels),
+        _format_megabytes(max(memory) if memory else None),
+        '?' if None in seconds else _format_seconds(
+            sum(seconds), estimates.pop() if len(estimates) == 1 else 'mixed'),
+        '',
+    ))
+
+    widths = [max(len(str(r[i])) for r in rows[:-1]) for i in range(len(rows[0]) - 1)]
+    lines = []
+    for row in rows:
+        cells = [str(c).ljust(w) for c, w in zip(row[:-1], widths)] + [str(row[-1])]
+        lines.append('  '.join(cells).rstrip())
+    return '\n'.join(lines)
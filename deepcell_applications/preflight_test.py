@@ -0,0 +1,165 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.preflight"""
+
+import json
+import os
+
+import numpy as np
+import tifffile
+
+import pytest
+
+import deepcell_applications as dca
+
+
+class DummyApplication(object):
+
+    def __init__(self, *args, **kwargs):
+        self.model_image_shape = (32, 32, 2)
+        self.required_channels = 2
+
+
+def _job(temp_dir, **kwargs):
+    job = {
+        'app': 'mesmer',
+        'output_directory': temp_dir,
+        'output_name': 'mask.tif',
+        'nuclear_channel': [0],
+        'membrane_channel': [0],
+        'batch_size': 4,
+        'compartment': 'whole-cell',
+    }
+    job.update(kwargs)
+    return job
+
+
+def test_get_app_spec():
+    spec = dca.preflight.get_app_spec('Mesmer')
+    assert spec['inputs'] == ['nuclear', 'membrane']
+    assert spec['required_channels'] == 2
+
+    spec = dca.preflight.get_app_spec('mesmer', app=DummyApplication())
+    assert spec['model_image_shape'] == (32, 32, 2)
+
+    with pytest.raises(ValueError):
+        dca.preflight.get_app_spec('bad_app_name')
+
+
+def test_check_input(tmpdir):
+    temp_dir = str(tmpdir)
+    path = os.path.join(temp_dir, 'img.tif')
+
+    tifffile.imwrite(path, np.zeros((3, 40, 30), dtype='uint8'))
+    assert dca.preflight.check_input(path, [0, 2]) == {
+        'frames': 1, 'shape': (40, 30)}
+    with pytest.raises(ValueError):
+        dca.preflight.check_input(path, [3])
+
+    # the channel axis is read from the metadata
+    tifffile.imwrite(path, np.zeros((8, 40, 5), dtype='uint8'),
+                     metadata={'axes': 'CYX'})
+    assert dca.preflight.check_input(path, [7])['shape'] == (40, 5)
+
+    # single channel images and stacks
+    tifffile.imwrite(path, np.zeros((40, 30), dtype='uint8'))
+    assert dca.preflight.check_input(path)['shape'] == (40, 30)
+    tifffile.imwrite(path, np.zeros((6, 2, 40, 30), dtype='uint8'))
+    assert dca.preflight.check_input(path, [1], stack=True) == {
+        'frames': 6, 'shape': (40, 30)}
+    with pytest.raises(ValueError):
+        dca.preflight.check_input(path)
+
+    # other files can not be checked from their header
+    other_path = os.path.join(temp_dir, 'img.png')
+    with open(other_path, 'wb') as f:
+        f.write(b'not read')
+    assert dca.preflight.check_input(other_path) is None
+
+
+def test_check_jobs(tmpdir, mocker):
+    temp_dir = str(tmpdir)
+    nuclear_path = os.path.join(temp_dir, 'nuclear.tif')
+    membrane_path = os.path.join(temp_dir, 'membrane.tif')
+    tifffile.imwrite(nuclear_path, np.zeros((2, 100, 200), dtype='uint8'))
+    tifffile.imwrite(membrane_path, np.zeros((100, 200), dtype='uint8'))
+    small_path = os.path.join(temp_dir, 'small.tif')
+    tifffile.imwrite(small_path, np.zeros((50, 200), dtype='uint8'))
+
+    jobs = [
+        _job(temp_dir, nuclear_path=nuclear_path, membrane_path=membrane_path),
+        # bad channel
+        _job(temp_dir, nuclear_path=nuclear_path, nuclear_channel=[2]),
+        # mismatched shapes
+        _job(temp_dir, nuclear_path=nuclear_path, membrane_path=small_path),
+    ]
+    # without previous jobs or a calibration, the default cost is used
+    cache_path = os.path.join(temp_dir, 'batch_size.json')
+    mocker.patch('deepcell_applications.autotune.DEFAULT_CACHE_PATH', cache_path)
+    plans = dca.preflight.check_jobs(jobs, app=DummyApplication())
+    assert [bool(p['errors']) for p in plans] == [False, True, True]
+    assert plans[0]['shape'] == (100, 200)
+    assert plans[0]['megapixels'] == 0.02
+    assert plans[0]['memory_bytes'] > 100 * 200 * 2 * 4
+    default = dca.settings.VALID_APPLICATIONS['mesmer']['seconds_per_megapixel']
+    assert plans[0]['seconds'] == pytest.approx(0.02 * default)
+    assert plans[0]['estimate'] == 'default'
+
+    # or the throughput calibrated by an automatic batch size
+    app = DummyApplication()
+    key = dca.autotune.get_cache_key(app)
+    dca.autotune.save_cache(cache_path, key, 4, tiles_per_second=1e6 / 32 / 32)
+    plan = dca.preflight.check_jobs(jobs[:1], app=app)[0]
+    assert plan['estimate'] == 'calibrated'
+    assert plan['seconds'] == pytest.approx(
+        0.02 * dca.preflight.CALIBRATED_OVERHEAD)
+
+    with pytest.raises(ValueError, match='2 of 3 jobs'):
+        dca.preflight.raise_errors(plans)
+    dca.preflight.raise_errors(plans[:1])
+
+    # tiles use less memory than the whole image
+    tiled = _job(temp_dir, nuclear_path=nuclear_path, tile_size=32, tile_overlap=0)
+    tiled_plan = dca.preflight.check_jobs([tiled], app=DummyApplication())[0]
+    assert tiled_plan['memory_bytes'] < plans[0]['memory_bytes']
+
+    # the runtime is estimated from previous jobs
+    metrics_file = os.path.join(temp_dir, 'metrics.jsonl')
+    with open(metrics_file, 'w') as f:
+        for cost in (1, 2, 30):
+            f.write(json.dumps({'app': 'mesmer', 'seconds_per_megapixel': cost}) + '\n')
+    jobs[0]['metrics_file'] = metrics_file
+    assert dca.preflight.load_history(metrics_file, 'mesmer') == 2
+    plan = dca.preflight.check_jobs(jobs[:1])[0]
+    assert plan['seconds'] == pytest.approx(0.04)
+    assert plan['estimate'] == 'history'
+
+    table = dca.preflight.format_plan(plans)
+    lines = table.splitlines()
+    assert len(lines) == len(plans) + 2
+    assert 'error' in lines[2]
+    assert '(default)' in lines[1]
+    assert lines[-1].startswith('total: 3 jobs, 2 with errors')
@@ -25,6 +25,10 @@
 # ==============================================================================
 """Functions for preparing input data for the applications"""
 
+import collections
+
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
 import deepcell_applications as dca
@@ -38,10 +42,42 @@ def prepare_input(name, **kwargs):
         raise ValueError('Invalid application name: {}'.format(name))
 
 
+def get_input_shape(name, **kwargs):
+    """Returns the shape of the prepared input, reading only file headers.
+
+    Args:
+        name (str): The name of the application.
+        kwargs (dict): The same arguments as ``prepare_input``.
+
+    Returns:
+        tuple: The shape of the batch returned by ``prepare_input``.
+    """
+    name = str(name).lower()
+    if name == 'mesmer':
+        return get_mesmer_input_shape(**kwargs)
+    else:
+        raise ValueError('Invalid application name: {}'.format(name))
+
+
+def get_mesmer_input_shape(nuclear_path, ndim=3, resolution_level=0, **kwargs):
+    """Returns the ``(1, height, width, 2)`` shape of a Mesmer input."""
+    shape = dca.io.get_image_shape(nuclear_path, ndim=ndim,
+                                   level=resolution_level)
+    return (1,) + tuple(shape) + (2,)
+
+
 def prepare_mesmer_input(nuclear_path, membrane_path=None, ndim=3,
-                         nuclear_channel=0, membrane_channel=0, **kwargs):
+                         nuclear_channel=0, membrane_channel=0,
+                         resolution_level=0, out=None, **kwargs):
     """Load and reshape image input files for the Mesmer application
 
+    The inputs are summed directly into a single preallocated float32 batch
+    of shape ``(1, height, width, 2)``. The nuclear and membrane images are
+    loaded concurrently, or in a single pass if they are the same file.
+    A missing membrane image is left as the zeros of the batch, so it does
+    not need another array. The batch may be given as ``out``, e.g. a
+    reused shared memory buffer.
+
     Args:
         nuclear_path (str): The path to the nuclear image file
         membrane_path (str): The path to the membrane image file
@@ -52,26 +88,73 @@ def prepare_mesmer_input(nuclear_path, membrane_path=None, ndim=3,
         membrane_channel (int): Integer or list of integers for the relevant
             nuclear channels of the membrane image data.
             All channels will be summed into a single tensor.
+        resolution_level (int): The resolution level of OME-Zarr inputs.
+        out (numpy.array): Optional float32 batch to load the inputs into.
+            It is cleared before the inputs are loaded.
 
     Returns:
-        numpy.array: Single array of input images concatenated on channels.
+        numpy.array: Batch of input images with nuclear and membrane channels.
+
+    Raises:
+        ValueError: If ``out`` does not have the shape of the input.
     """
-    # load the input files into numpy arrays
-    nuclear_img = dca.io.load_image(
-        nuclear_path,
-        channel=nuclear_channel,
-        ndim=ndim)
+    shape = get_mesmer_input_shape(nuclear_path, ndim=ndim,
+                                   resolution_level=resolution_level)
 
-    # membrane image is optional
-    if membrane_path:
-        membrane_img = dca.io.load_image(
-            membrane_path,
-            channel=membrane_channel,
-            ndim=ndim)
+    if out is None:
+        img = np.zeros(shape, dtype='float32')
+    elif out.shape != shape:
+        raise ValueError('Expected an output of shape {} but found shape '
+                         '{}'.format(shape, out.shape))
     else:
-        membrane_img = np.zeros(nuclear_img.shape, dtype=nuclear_img.dtype)
+        img = out
+        img[...] = 0
 
-    # join the inputs in the correct order
-    img = np.concatenate([nuclear_img, membrane_img], axis=-1)
+    # membrane image is optional
+    load_channels(img[0], [(nuclear_path, nuclear_channel),
+                           (membrane_path, membrane_channel)],
+                  ndim=ndim, level=resolution_level)
 
     return img
+
+
+def load_channels(img, inputs, ndim=3, level=0):
+    """Load each input file directly into its channel of an image.
+
+    Inputs from the same file are read together, so each file is decoded
+    once. Different files are independent, so they are read and decoded
+    concurrently in a small thread pool. Reading, decompression and summing
+    release the GIL, so the total time is close to that of the slowest file.
+
+    Args:
+        img (numpy.array): The ``(height, width, channels)`` image to load
+            the inputs into. Channels without an input are left unchanged.
+        inputs (list): The ``(path, channel)`` of the input of each channel.
+            Inputs without a path are skipped.
+        ndim (int): Rank of the expected image size
+        level (int): The resolution level of OME-Zarr inputs.
+
+    Raises:
+        Exception: The first error raised while loading any input.
+    """
+    # the channels of the image that are loaded from each file
+    files = collections.OrderedDict()
+    for i, (path, _) in enumerate(inputs):
+        if path:
+            files.setdefault(path, []).append(i)
+
+    def load(path):
+        indices = files[path]
+        dca.io.load_channel_groups(
+            path, [inputs[i][1] for i in indices], ndim=ndim,
+            outs=[img[..., i:i + 1] for i in indices], level=level)
+
+    if len(files) < 2:
+        for path in files:
+            load(path)
+        return
+
+    with ThreadPoolExecutor(len(files)) as executor:
+        # each input is loaded into its own channel, so they do not overlap
+        for future in [executor.submit(load, path) for path in files]:
+            future.result()
@@ -25,7 +25,12 @@
 # ==============================================================================
 """Tests for deepcell_applications.prepare"""
 
+import os
+import threading
+import time
+
 import numpy as np
+import tifffile
 
 import pytest
 
@@ -40,16 +45,19 @@ def test_prepare_input():
 
 def test_prepare_mesmer_input(mocker):
     # mock the application config in imported settings
-    nuclear = np.random.random((32, 32, 1))
-    membrane = np.random.random((32, 32, 1))
+    nuclear = np.random.random((32, 32, 1)).astype('float32')
+    membrane = np.random.random((32, 32, 1)).astype('float32')
 
-    def mocked_load_image(path, *_, **__):
-        if 'membrane' in str(path):
-            return membrane
-        return nuclear
+    def mocked_load_channel_groups(path, channels, outs=None, **_):
+        img = membrane if 'membrane' in str(path) else nuclear
+        for out in outs:
+            out[:] += img
+        return outs
 
-    mocker.patch('deepcell_applications.io.load_image',
-                 mocked_load_image)
+    mocker.patch('deepcell_applications.io.load_channel_groups',
+                 mocked_load_channel_groups)
+    mocker.patch('deepcell_applications.io.get_image_shape',
+                 lambda *_, **__: nuclear.shape[:-1])
 
     # test that nuclear image first, then membrane
     img = dca.prepare.prepare_mesmer_input(
@@ -57,16 +65,19 @@ def test_prepare_mesmer_input(mocker):
         membrane_path='membrane',
     )
 
-    np.testing.assert_equal(img[..., 0:1], nuclear)
-    np.testing.assert_equal(img[..., 1:2], membrane)
+    # inputs are a float32 batch
+    assert img.shape == (1, 32, 32, 2)
+    assert img.dtype == np.float32
+    np.testing.assert_equal(img[0, ..., 0:1], nuclear)
+    np.testing.assert_equal(img[0, ..., 1:2], membrane)
 
     # no membrane passed should be all zeros
     img = dca.prepare.prepare_mesmer_input(
         nuclear_path='nuclear',
     )
 
-    np.testing.assert_equal(img[..., 0:1], nuclear)
-    np.testing.assert_equal(img[..., 1:2], np.zeros_like(nuclear))
+    np.testing.assert_equal(img[0, ..., 0:1], nuclear)
+    np.testing.assert_equal(img[0, ..., 1:2], np.zeros_like(nuclear))
 
     # test that `prepare_input` works
     img = dca.prepare.prepare_input(
@@ -76,5 +87,101 @@ def test_prepare_mesmer_input(mocker):
         unknown_kwarg='test',  # this shouldn't throw error
     )
 
-    np.testing.assert_equal(img[..., 0:1], nuclear)
-    np.testing.assert_equal(img[..., 1:2], membrane)
+    np.testing.assert_equal(img[0, ..., 0:1], nuclear)
+    np.testing.assert_equal(img[0, ..., 1:2], membrane)
+
+
+def test_prepare_mesmer_input_out(tmpdir):
+    temp_dir = str(tmpdir)
+    nuclear = np.random.randint(0, 100, size=(32, 32)).astype('uint16')
+    nuclear_path = os.path.join(temp_dir, 'nuclear.tif')
+    tifffile.imwrite(nuclear_path, nuclear)
+
+    # the shape is read from the headers
+    shape = dca.prepare.get_input_shape('mesmer', nuclear_path=nuclear_path)
+    assert shape == (1, 32, 32, 2)
+    with pytest.raises(ValueError):
+        dca.prepare.get_input_shape('unknown app')
+
+    # the input is loaded into a given batch, which is cleared first
+    out = np.ones(shape, dtype='float32')
+    img = dca.prepare.prepare_input('mesmer', nuclear_path=nuclear_path, out=out)
+    assert img is out
+    np.testing.assert_array_equal(out[0, ..., 0], nuclear)
+    np.testing.assert_array_equal(out[0, ..., 1], 0)
+
+    with pytest.raises(ValueError):
+        dca.prepare.prepare_mesmer_input(nuclear_path, out=np.zeros((1, 8, 8, 2)))
+
+
+def test_load_channels(mocker):
+    lock = threading.Lock()
+    state = {'loading': 0, 'max_loading': 0}
+
+    def mocked_load_channel_groups(path, channels, outs=None, **_):
+        with lock:
+            state['loading'] += 1
+            state['max_loading'] = max(state['max_loading'], state['loading'])
+        time.sleep(0.05)
+        for channel, out in zip(channels, outs):
+            out[:] += np.sum(channel)
+        with lock:
+            state['loading'] -= 1
+        return outs
+
+    load = mocker.patch('deepcell_applications.io.load_channel_groups',
+                        side_effect=mocked_load_channel_groups)
+
+    # the inputs are loaded at the same time
+    img = np.zeros((8, 8, 3), dtype='float32')
+    dca.prepare.load_channels(img, [('a', 1), (None, 5), ('c', 3)])
+    assert state['max_loading'] == 2
+    np.testing.assert_array_equal(img[0, 0], [1, 0, 3])
+
+    # inputs from the same file are loaded together
+    load.reset_mock()
+    img = np.zeros((8, 8, 2), dtype='float32')
+    dca.prepare.load_channels(img, [('a', 1), ('a', [2, 4])])
+    assert load.call_count == 1
+    assert load.call_args[0] == ('a', [1, [2, 4]])
+    np.testing.assert_array_equal(img[0, 0], [1, 6])
+
+    # errors from any input are raised
+    def failing_load_channel_groups(path, *_, **__):
+        raise ValueError(path)
+
+    mocker.patch('deepcell_applications.io.load_channel_groups',
+                 failing_load_channel_groups)
+    with pytest.raises(ValueError):
+        dca.prepare.load_channels(img, [('a', 0), ('b', 0)])
+
+
+def test_prepare_mesmer_input_files(tmpdir):
+    temp_dir = str(tmpdir)
+    nuclear = np.random.randint(0, 2 ** 16, size=(3, 32, 32)).astype('uint16')
+    membrane = np.random.randint(0, 2 ** 16, size=(32, 32, 2)).astype('uint16')
+    nuclear_path = os.path.join(temp_dir, 'nuclear.tif')
+    membrane_path = os.path.join(temp_dir, 'membrane.tif')
+    tifffile.imwrite(nuclear_path, nuclear)
+    tifffile.imwrite(membrane_path, membrane, photometric='minisblack')
+
+    img = dca.prepare.prepare_mesmer_input(
+        nuclear_path=nuclear_path,
+        nuclear_channel=[0, 2],
+        membrane_path=membrane_path,
+        membrane_channel=[0, 1],
+    )
+    assert img.shape == (1, 32, 32, 2)
+    assert img.dtype == np.float32
+    np.testing.assert_array_equal(
+        img[0, ..., 0], nuclear[[0, 2]].sum(axis=0).astype('float32'))
+    np.testing.assert_array_equal(
+        img[0, ..., 1], membrane.sum(axis=-1).astype('float32'))
+
+    # nuclear and membrane shapes must match
+    tifffile.imwrite(membrane_path, membrane[:16])
+    with pytest.raises(ValueError):
+        dca.prepare.prepare_mesmer_input(
+            nuclear_path=nuclear_path,
+            membrane_path=membrane_path,
+        )
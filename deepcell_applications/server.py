@@ -0,0 +1,477 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Functions for serving warm applications from a long-running process"""
+
+import glob
+import json
+import logging
+import os
+import queue
+import signal
+import threading
+import timeit
+import urllib.error
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+import deepcell_applications as dca
+
+
+logger = logging.getLogger(__name__)
+
+# Paths of a job, in addition to the ``<input>_path`` of each input.
+# Paths are opened by the server, so they must be absolute.
+PATH_ARGS = ('manifest', 'output_directory', 'metrics_file', 'cache_directory')
+
+# Expected types of the other arguments of a job
+INT_ARGS = ('resolution_level', 'stack_chunk', 'tile_size', 'tile_overlap',
+            'output_tile', 'pipeline_depth', 'load_processes', 'workers',
+            'check_samples')
+FLOAT_ARGS = ('image_mpp', 'cache_size')
+FLAG_ARGS = ('squeeze', 'bigtiff', 'downcast', 'stack', 'overwrite', 'resume',
+             'dry_run', 'check_accuracy', 'warmup', 'offline')
+STR_ARGS = ('app', 'output_name', 'compartment', 'compression', 'backend',
+            'precision')
+
+
+def get_input_names(arg_dict):
+    """Returns the names of the inputs of the application of a job."""
+    settings = dca.settings.VALID_APPLICATIONS.get(str(arg_dict.get('app')), {})
+    return settings.get('inputs', [])
+
+
+def get_path_args(arg_dict):
+    """Returns the names of the path arguments of a job."""
+    inputs = ['{}_path'.format(name) for name in get_input_names(arg_dict)]
+    return inputs + list(PATH_ARGS)
+
+
+def make_paths_absolute(arg_dict):
+    """Returns a copy of the arguments of a job with absolute paths.
+
+    Relative paths are resolved against the current directory, so the
+    server does not resolve them against its own.
+    """
+    arg_dict = dict(arg_dict)
+    for name in get_path_args(arg_dict):
+        path = arg_dict.get(name)
+        if path and path != '-':
+            arg_dict[name] = os.path.abspath(path)
+    return arg_dict
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _to_json(value):
+    """Convert the numpy values in a plan or report for ``json.dumps``."""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError('{} is not JSON serializable'.format(type(value).__name__))
+
+
+def validate_job(arg_dict):
+    """Check the paths and types of the arguments of a job sent to a server.
+
+    The arguments of a job are sent as JSON, so they are checked here
+    instead of by the argument parser.
+
+    Args:
+        arg_dict (dict): The parsed command line arguments of the job.
+
+    Raises:
+        ValueError: If an argument has the wrong type or a path is relative.
+        IOError: If an input does not exist or the output directory is not
+            a writable directory.
+    """
+    if not isinstance(arg_dict, dict):
+        raise ValueError('Expected a JSON object of arguments, got {}'.format(
+            type(arg_dict).__name__))
+
+    def check(names, is_valid, expected):
+        for name in names:
+            value = arg_dict.get(name)
+            if value is not None and not is_valid(value):
+                raise ValueError('Expected {} to be {}, got {!r}'.format(
+                    name, expected, value))
+
+    check(INT_ARGS, _is_int, 'an integer')
+    check(FLOAT_ARGS, lambda x: _is_int(x) or isinstance(x, float), 'a number')
+    check(FLAG_ARGS, lambda x: isinstance(x, bool), 'a boolean')
+    check(STR_ARGS, lambda x: isinstance(x, str), 'a string')
+    check(['batch_size'], lambda x: x == 'auto' or _is_int(x) and x > 0,
+          'a positive integer or auto')
+
+    paths = get_path_args(arg_dict)
+    check(paths, lambda x: isinstance(x, str), 'a string')
+    channels = ['{}_channel'.format(name) for name in get_input_names(arg_dict)]
+    check(channels, lambda x: all(_is_int(c) and c >= 0 for c in
+                                  (x if isinstance(x, list) else [x])),
+          'a non-negative integer or a list of them')
+
+    for name in paths:
+        path = arg_dict.get(name)
+        if not path or path == '-':
+            continue
+        if not os.path.isabs(path):
+            raise ValueError('Expected {} to be an absolute path, got {}'.format(
+                name, path))
+        if name.endswith('_path') and not (os.path.exists(path) or glob.glob(path)):
+            raise IOError('{} does not exist.'.format(path))
+
+    manifest = arg_dict.get('manifest')
+    if manifest and not os.path.isfile(manifest):
+        raise IOError('{} does not exist.'.format(manifest))
+
+    output_directory = arg_dict.get('output_directory')
+    if output_directory is not None and not (
+            os.path.isdir(output_directory) and
+            os.access(output_directory, os.W_OK | os.X_OK)):
+        raise IOError('{} is not a writable directory'.format(output_directory))
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Handles health checks and prediction jobs for an ApplicationServer.
+
+    ``GET /healthz`` responds while the server is running,
+    ``GET /readyz`` responds once the applications are loaded and the server
+    is not draining, and ``POST /predict`` runs a JSON object of the same
+    arguments as ``run_app.py`` with ``run_application``. The plan of a
+    ``dry_run`` job, or the report of a ``check_accuracy`` job, is sent back
+    as the ``result`` of the response.
+    """
+
+    def _send(self, code, body):
+        data = json.dumps(body, default=_to_json).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/healthz':
+            self._send(200, {'status': 'ok'})
+        elif self.path == '/readyz':
+            if self.server.is_ready():
+                self._send(200, {'status': 'ready'})
+            else:
+                self._send(503, {'status': 'draining' if self.server.draining
+                                 else 'loading'})
+        else:
+            self._send(404, {'error': 'Unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+
+        if not self.server.admit():
+            self._send(503, {'error': 'Server is not ready, busy or draining.'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            arg_dict = json.loads(self.rfile.read(length).decode('utf-8'))
+            start = timeit.default_timer()
+            result = self.server.run(arg_dict)
+            self._send(200, {'status': 'ok',
+                             'seconds': timeit.default_timer() - start,
+                             'result': result})
+        except (ValueError, KeyError, IOError) as err:
+            self._send(400, {'error': '{}: {}'.format(type(err).__name__, err)})
+        except Exception as err:  # pylint: disable=broad-except
+            logger.exception('Failed to run job.')
+            self._send(500, {'error': '{}: {}'.format(type(err).__name__, err)})
+        finally:
+            self.server.release()
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+
+class ApplicationServer(ThreadingHTTPServer):
+    """An HTTP server that keeps warm applications in memory.
+
+    Each application in ``apps`` is instantiated ``max_concurrency`` times
+    and the instances are shared through a pool, so at most
+    ``max_concurrency`` jobs run at once per application. At most
+    ``max_queue`` more jobs wait for an instance, others are rejected.
+
+    Instances run on the default backend and precision of their
+    application, and jobs that ask for another backend are rejected.
+    The paths and types of each job are checked before it is run.
+
+    Jobs with ``check_accuracy`` compare a pooled instance with a single
+    reference Keras instance of its application, which is built by the
+    first of these jobs and kept for later ones. The checks of an
+    application run one at a time, so they never build more models.
+
+    Args:
+        address (tuple): The ``(host, port)`` to listen on.
+        apps (list): The names of the applications to serve.
+        max_concurrency (int): Number of instances of each application.
+        max_queue (int): Number of jobs that may wait for an instance.
+        warmup_batch_size (int): If set, each instance is compiled for this
+            batch size when it is loaded.
+        model_directory (str): The model cache directory.
+        offline (bool): Whether to fail instead of downloading a model that
+            is not cached.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, apps, max_concurrency=1, max_queue=16,
+                 warmup_batch_size=0, model_directory=None, offline=None):
+        super(ApplicationServer, self).__init__(address, RequestHandler)
+        self.apps = [str(a).lower() for a in apps]
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_pending = self.max_concurrency + max(0, max_queue)
+        self.pools = {name: queue.Queue() for name in self.apps}
+        self.references = {}
+        self._references_lock = threading.Lock()
+        self.backends = {name: dca.backends.get_backend_options(name)
+                         for name in self.apps}
+        self.warmup_batch_size = warmup_batch_size
+        self.model_directory = model_directory
+        self.offline = offline
+        self.pending = 0
+        self.ready = False
+        self.draining = False
+        self._condition = threading.Condition()
+
+    def load_apps(self):
+        """Instantiate each application and mark the server as ready."""
+        for name in self.apps:
+            for _ in range(self.max_concurrency):
+                app = dca.utils.get_app(name,
+                                        model_directory=self.model_directory,
+                                        offline=self.offline)
+                app = dca.backends.set_backend(app, *self.backends[name])
+                if self.warmup_batch_size:
+                    dca.utils.warmup_app(app, batch_size=self.warmup_batch_size)
+                self.pools[name].put(app)
+            logger.info('Loaded %s instance(s) of %s.', self.max_concurrency, name)
+        self.ready = True
+
+    def get_reference_pool(self, name):
+        """Returns the pool of the reference Keras instance of an application.
+
+        The instance is built the first time it is needed.
+
+        Args:
+            name (str): The name of the application.
+
+        Returns:
+            queue.Queue: A pool with a single reference instance.
+        """
+        with self._references_lock:
+            if name not in self.references:
+                reference = dca.utils.get_app(name,
+                                              model_directory=self.model_directory,
+                                              offline=self.offline)
+                pool = queue.Queue()
+                pool.put(dca.backends.set_backend(reference))
+                self.references[name] = pool
+                logger.info('Loaded the reference instance of %s.', name)
+            return self.references[name]
+
+    def is_ready(self):
+        return self.ready and not self.draining
+
+    def admit(self):
+        """Returns True if a new job may be started."""
+        with self._condition:
+            if not self.is_ready() or self.pending >= self.max_pending:
+                return False
+            self.pending += 1
+            return True
+
+    def release(self):
+        """Mark an admitted job as finished."""
+        with self._condition:
+            self.pending -= 1
+            self._condition.notify_all()
+
+    def run(self, arg_dict):
+        """Run a job with a warm instance of its application.
+
+        Args:
+            arg_dict (dict): The parsed command line arguments of the job.
+
+        Returns:
+            list: The plan of each job if ``dry_run`` is set, or the report
+                of each sample if ``check_accuracy`` is set.
+
+        Raises:
+            ValueError: If the application is not served on the backend of
+                the job, or an argument is invalid.
+            IOError: If an input or the output directory is invalid.
+        """
+        validate_job(arg_dict)
+
+        name = str(arg_dict.get('app')).lower()
+        try:
+            pool = self.pools[name]
+        except KeyError:
+            raise ValueError('{} is not served. Served applications: {}'.format(
+                name, self.apps))
+
+        backend = dca.backends.get_backend_options(
+            name, arg_dict.get('backend'), arg_dict.get('precision'))
+        if backend != self.backends[name]:
+            raise ValueError('{} is served on {}, not {}.'.format(
+                name, '/'.join(self.backends[name]), '/'.join(backend)))
+
+        references = None
+        if arg_dict.get('check_accuracy') and not arg_dict.get('dry_run'):
+            references = self.get_reference_pool(name)
+
+        app = pool.get()
+        reference = references.get() if references is not None else None
+        try:
+            return dca.app_runners.run_application(arg_dict, app=app,
+                                                   reference=reference)
+        finally:
+            if reference is not None:
+                references.put(reference)
+            pool.put(app)
+
+    def drain(self, timeout=None):
+        """Stop accepting jobs, wait for running jobs, and shut down.
+
+        Args:
+            timeout (float): Maximum seconds to wait for running jobs.
+        """
+        with self._condition:
+            self.draining = True
+            logger.info('Draining %s job(s).', self.pending)
+            self._condition.wait_for(lambda: self.pending == 0, timeout=timeout)
+        self.shutdown()
+
+
+def serve(host='127.0.0.1', port=8765, apps=None, max_concurrency=1,
+          max_queue=16, drain_timeout=None, warmup_batch_size=0,
+          model_directory=None, offline=None):
+    """Serve applications until SIGTERM or SIGINT, then drain gracefully.
+
+    Args:
+        host (str): The host to listen on.
+        port (int): The port to listen on.
+        apps (list): The names of the applications to serve.
+            Defaults to all valid applications.
+        max_concurrency (int): Number of instances of each application.
+        max_queue (int): Number of jobs that may wait for an instance.
+        drain_timeout (float): Maximum seconds to wait for running jobs
+            when shutting down.
+        warmup_batch_size (int): If set, each instance is compiled for this
+            batch size before the server is ready.
+        model_directory (str): The model cache directory.
+        offline (bool): Whether to fail instead of downloading a model that
+            is not cached.
+    """
+    apps = apps or list(dca.settings.VALID_APPLICATIONS)
+    server = ApplicationServer((host, port), apps,
+                               max_concurrency=max_concurrency,
+                               max_queue=max_queue,
+                               warmup_batch_size=warmup_batch_size,
+                               model_directory=model_directory,
+                               offline=offline)
+
+    def handle_signal(signum, _):
+        logger.info('Received signal %s, shutting down.', signum)
+        threading.Thread(target=server.drain, args=(drain_timeout,)).start()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+
+    def load_apps():
+        try:
+            server.load_apps()
+        except Exception:  # pylint: disable=broad-except
+            logger.exception('Failed to load applications.')
+            server.drain()
+
+    # health checks are answered while the applications load
+    threading.Thread(target=load_apps, daemon=True).start()
+
+    logger.info('Serving %s on http://%s:%s', apps, *server.server_address[:2])
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def submit(url, arg_dict, timeout=None):
+    """Submit a job to a running ApplicationServer and wait for it.
+
+    Relative paths in ``arg_dict`` are made absolute before the job is sent.
+    The paths must be readable and writable by the server. The plan of a
+    ``dry_run`` job, or the report of a ``check_accuracy`` job, is logged
+    as if the job was run locally.
+
+    Args:
+        url (str): The URL of the server, e.g. ``http://127.0.0.1:8765``.
+        arg_dict (dict): The parsed command line arguments of the job.
+        timeout (float): Seconds to wait for the job to finish.
+
+    Returns:
+        dict: The response of the server.
+
+    Raises:
+        RuntimeError: If the server could not run the job.
+    """
+    arg_dict = {k: v for k, v in make_paths_absolute(arg_dict).items()
+                if k != 'server'}
+    request = urllib.request.Request(
+        url.rstrip('/') + '/predict',
+        data=json.dumps(arg_dict).encode('utf-8'),
+        headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response = json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as err:
+        try:
+            error = json.loads(err.read().decode('utf-8')).get('error')
+        except ValueError:
+            error = err.reason
+        raise RuntimeError('{} could not run the job: {}'.format(url, error))
+
+    result = response.get('result')
+    if result and arg_dict.get('dry_run'):
+        logger.info('Plan of %s job(s):\n%s', len(result),
+                    dca.preflight.format_plan(result))
+    elif result and arg_dict.get('check_accuracy'):
+        backend, precision = dca.backends.get_backend_options(
+            arg_dict['app'], arg_dict.get('backend'), arg_dict.get('precision'))
+        logger.info('Accuracy of %s (%s) on %s sample(s):\n%s',
+                    backend, precision, len(result),
+                    dca.backends.format_report(result, backend, precision))
+    return response
@@ -0,0 +1,246 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.server"""
+
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+import tifffile
+
+import pytest
+
+import deepcell_applications as dca
+
+
+class DummyApplication(object):
+
+    def __init__(self, *args, **kwargs):
+        self.model_image_shape = (32, 32, 2)
+        self.required_channels = 2
+        self.logger = logging.getLogger('DummyApplication')
+
+    def predict(self, image, **kwargs):
+        return np.ones(image.shape[:-1] + (1,), dtype='int32')
+
+
+def _get(url):
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as err:
+        return err.code, json.loads(err.read())
+
+
+def _wait_for_release(server):
+    # each job is released just after its response is sent
+    for _ in range(100):
+        if server.pending == 0:
+            break
+        time.sleep(0.01)
+    assert server.pending == 0
+
+
+@pytest.fixture
+def server(mocker):
+    mocker.patch('deepcell_applications.utils.get_app',
+                 lambda *_, **__: DummyApplication())
+    server = dca.server.ApplicationServer(('127.0.0.1', 0), ['mesmer'],
+                                          max_concurrency=2, max_queue=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_application_server(tmpdir, caplog, server):
+    temp_dir = str(tmpdir)
+    url = 'http://{}:{}'.format(*server.server_address[:2])
+
+    # healthy but not ready until the applications are loaded
+    assert _get(url + '/healthz')[0] == 200
+    assert _get(url + '/readyz')[0] == 503
+    assert _get(url + '/unknown')[0] == 404
+
+    server.load_apps()
+    assert server.pools['mesmer'].qsize() == 2
+    assert _get(url + '/readyz')[0] == 200
+
+    img_path = os.path.join(temp_dir, 'img.tif')
+    tifffile.imwrite(img_path, np.zeros((10, 10)))
+    args = dca.argparse.get_arg_parser().parse_args([
+        'mesmer',
+        '--output-directory', temp_dir,
+        '--nuclear-image', img_path,
+        '--server', url,
+        '--squeeze'])
+
+    response = dca.server.submit(url, dict(args._get_kwargs()))
+    assert response['status'] == 'ok'
+    output = tifffile.imread(os.path.join(temp_dir, 'mask.tif'))
+    np.testing.assert_array_equal(output, np.ones((10, 10)))
+
+    # instances are returned to the pool
+    assert server.pools['mesmer'].qsize() == 2
+    _wait_for_release(server)
+
+    # the plan of a dry run is sent back and logged by the client
+    with caplog.at_level(logging.INFO, logger='deepcell_applications.server'):
+        response = dca.server.submit(url, dict(args._get_kwargs(), dry_run=True))
+    assert response['result'][0]['output'] == os.path.join(temp_dir, 'mask.tif')
+    assert response['result'][0]['shape'] == [10, 10]
+    assert 'Plan of 1 job(s)' in caplog.text
+    _wait_for_release(server)
+
+    # errors in the job are sent back to the client
+    with pytest.raises(RuntimeError, match='already exists'):
+        dca.server.submit(url, dict(args._get_kwargs()))
+
+    bad_args = dict(args._get_kwargs())
+    bad_args['app'] = 'unknown'
+    with pytest.raises(RuntimeError, match='not served'):
+        dca.server.submit(url, bad_args)
+
+    # invalid paths and types are rejected before the job is run
+    for key, value, match in [
+            ('nuclear_path', os.path.join(temp_dir, 'missing.tif'), 'does not exist'),
+            ('output_directory', img_path, 'not a writable directory'),
+            ('nuclear_channel', ['0'], 'nuclear_channel'),
+            ('image_mpp', '0.5', 'image_mpp'),
+            ('batch_size', 0, 'batch_size'),
+            ('squeeze', 1, 'squeeze'),
+            ('backend', 'onnx', 'served on keras/float32')]:
+        bad_args = dict(args._get_kwargs(), overwrite=True)
+        bad_args[key] = value
+        with pytest.raises(RuntimeError, match=match):
+            dca.server.submit(url, bad_args)
+
+    # relative paths are never resolved by the server
+    with pytest.raises(ValueError, match='absolute'):
+        dca.server.validate_job(dict(args._get_kwargs(), nuclear_path='img.tif'))
+    with pytest.raises(ValueError, match='JSON object'):
+        dca.server.validate_job(['mesmer'])
+
+    # jobs are rejected when all instances are busy and the queue is full
+    _wait_for_release(server)
+    assert server.admit() and server.admit()
+    assert not server.admit()
+    server.release()
+    server.release()
+
+
+def test_application_server_check_accuracy(tmpdir, caplog, mocker, server):
+    temp_dir = str(tmpdir)
+    url = 'http://{}:{}'.format(*server.server_address[:2])
+    server.load_apps()
+    get_app = mocker.patch('deepcell_applications.utils.get_app',
+                           side_effect=lambda *_, **__: DummyApplication())
+
+    img_path = os.path.join(temp_dir, 'img.tif')
+    tifffile.imwrite(img_path, np.zeros((10, 10)))
+    args = dca.argparse.get_arg_parser().parse_args([
+        'mesmer',
+        '--output-directory', temp_dir,
+        '--nuclear-image', img_path,
+        '--check-accuracy'])
+
+    with caplog.at_level(logging.INFO, logger='deepcell_applications.server'):
+        for _ in range(2):
+            response = dca.server.submit(url, dict(args._get_kwargs()))
+            assert response['result'][0]['f1'] == 1.0
+            _wait_for_release(server)
+    assert 'Accuracy of keras (float32) on 1 sample(s)' in caplog.text
+
+    # the reference instance is built once and kept for later checks
+    assert get_app.call_count == 1
+    assert server.references['mesmer'].qsize() == 1
+    assert server.pools['mesmer'].qsize() == 2
+
+
+def test_make_paths_absolute(tmpdir):
+    temp_dir = str(tmpdir)
+    arg_dict = {
+        'app': 'mesmer',
+        'nuclear_path': 'nuclear/*.tif',
+        'membrane_path': None,
+        'output_directory': 'output',
+        'metrics_file': '-',
+        'output_name': 'mask.tif',
+    }
+    cwd = os.getcwd()
+    try:
+        os.chdir(temp_dir)
+        absolute = dca.server.make_paths_absolute(arg_dict)
+    finally:
+        os.chdir(cwd)
+
+    assert absolute == dict(arg_dict,
+                            nuclear_path=os.path.join(temp_dir, 'nuclear/*.tif'),
+                            output_directory=os.path.join(temp_dir, 'output'))
+    assert arg_dict['output_directory'] == 'output'
+
+
+def test_application_server_drain(server):
+    url = 'http://{}:{}'.format(*server.server_address[:2])
+    server.load_apps()
+
+    # a running job delays the shutdown
+    assert server.admit()
+    drain = threading.Thread(target=server.drain)
+    drain.start()
+    drain.join(timeout=0.1)
+    assert drain.is_alive()
+
+    # no new jobs are accepted while draining
+    assert _get(url + '/readyz')[0] == 503
+    assert not server.admit()
+
+    server.release()
+    drain.join(timeout=5)
+    assert not drain.is_alive()
+
+
+def test_application_server_warmup(mocker):
+    mocker.patch('deepcell_applications.utils.get_app',
+                 lambda *_, **__: DummyApplication())
+    warmup = mocker.patch('deepcell_applications.utils.warmup_app')
+    server = dca.server.ApplicationServer(('127.0.0.1', 0), ['mesmer'],
+                                          max_concurrency=2,
+                                          warmup_batch_size=8)
+    try:
+        # each instance is compiled before the server is ready
+        server.load_apps()
+        assert warmup.call_count == 2
+        assert all(c[1]['batch_size'] == 8 for c in warmup.call_args_list)
+        assert server.is_ready()
+    finally:
+        server.server_close()
@@ -25,15 +25,31 @@
 # ==============================================================================
 """Settings and configurations for deepcell_applications"""
 
-from deepcell import applications as apps
-
-
 # TODO: Add each new application to the dictionary
+# class is the import path of the application, which is only imported
+# when the application is instantiated, as importing deepcell is slow.
 # predict_options will be the configurable options
 # for ``app.predict`` that are exposed in run_app.py
+# inputs are the prepared channels, read from the ``<input>_path`` and
+# ``<input>_channel`` arguments, and model_image_shape and required_channels
+# match the application, so inputs can be checked before it is built.
+# backend and precision are the defaults of ``--backend`` and ``--precision``.
+# model_sha256 optionally pins the checksum of the model cached by
+# ``run_app.py prefetch``, which is logged when it is cached. The checksum
+# is of the SavedModel written by the installed TensorFlow, which is not
+# stable across TensorFlow versions, so update it with the deepcell version.
+# seconds_per_megapixel is the rough runtime of a job on a CPU, used by
+# ``--dry-run`` when there are no previous metrics or calibrated throughput.
 VALID_APPLICATIONS = {
-    str(apps.Mesmer.__name__).lower(): {
-        'class': apps.Mesmer,
+    'mesmer': {
+        'class': 'deepcell.applications.Mesmer',
         'predict_options': ['batch_size', 'image_mpp', 'compartment'],
+        'inputs': ['nuclear', 'membrane'],
+        'model_image_shape': (256, 256, 2),
+        'required_channels': 2,
+        'backend': 'keras',
+        'precision': 'float32',
+        'model_sha256': None,
+        'seconds_per_megapixel': 2.0,
     },
 }
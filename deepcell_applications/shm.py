@@ -0,0 +1,258 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Functions for loading inputs in other processes into shared memory"""
+
+import logging
+import multiprocessing
+import sys
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import deepcell_applications as dca
+
+
+logger = logging.getLogger(__name__)
+
+
+def import_shared_memory():
+    """Returns the ``multiprocessing.shared_memory`` module.
+
+    Raises:
+        RuntimeError: If it is not available, before Python 3.8.
+    """
+    try:
+        from multiprocessing import shared_memory  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise RuntimeError('Loading inputs in other processes requires '
+                           'Python 3.8 or later.')
+    return shared_memory
+
+
+def free_block(block):
+    """Close and unlink a shared memory block."""
+    try:
+        block.close()
+    except BufferError:  # a view is still held, e.g. by an error
+        pass
+    block.unlink()
+
+
+class BufferPool(object):
+    """A pool of reusable shared memory blocks.
+
+    A block is reused for any input that fits in it, so a batch of similar
+    images allocates only a few blocks. At most ``max_buffers`` blocks exist
+    at once, and ``acquire`` waits for a block to be released if they are
+    all in use. If no free block is large enough, the smallest free block is
+    replaced by a larger one.
+
+    Args:
+        max_buffers (int): Maximum number of blocks.
+    """
+
+    def __init__(self, max_buffers=4):
+        self.shared_memory = import_shared_memory()
+        self.max_buffers = max(1, int(max_buffers))
+        self.free = []
+        self.used = set()
+        self.created = 0
+        self._condition = threading.Condition()
+
+    def _create(self, nbytes):
+        self.created += 1
+        return self.shared_memory.SharedMemory(create=True, size=max(1, nbytes))
+
+    def acquire(self, nbytes):
+        """Returns a shared memory block of at least ``nbytes``.
+
+        Args:
+            nbytes (int): The number of bytes needed.
+
+        Returns:
+            multiprocessing.shared_memory.SharedMemory: The acquired block.
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.free or len(self.used) < self.max_buffers)
+
+            fits = [b for b in self.free if b.size >= nbytes]
+            if fits:
+                block = min(fits, key=lambda b: b.size)
+                self.free.remove(block)
+            else:
+                if len(self.free) + len(self.used) >= self.max_buffers:
+                    # replace the smallest free block with a larger one
+                    smallest = min(self.free, key=lambda b: b.size)
+                    self.free.remove(smallest)
+                    free_block(smallest)
+                block = self._create(nbytes)
+
+            self.used.add(block)
+            return block
+
+    def release(self, block):
+        """Return a block to the pool so it can be reused."""
+        with self._condition:
+            self.used.discard(block)
+            self.free.append(block)
+            self._condition.notify()
+
+    def close(self):
+        """Free every block. Blocks still in use must not be used after."""
+        with self._condition:
+            for block in self.free + list(self.used):
+                free_block(block)
+            self.free = []
+            self.used = set()
+
+
+def attach_block(name):
+    """Attach to a shared memory block created by another process.
+
+    Attaching registers the block with the resource tracker of this process
+    before Python 3.13, which would warn about a leaked block and unlink it
+    when this process exits. The block is unregistered, so only the process
+    that created it unlinks it.
+
+    Args:
+        name (str): The name of the shared memory block.
+
+    Returns:
+        multiprocessing.shared_memory.SharedMemory: The attached block.
+    """
+    shared_memory = import_shared_memory()
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    from multiprocessing import resource_tracker  # pylint: disable=import-outside-toplevel
+    block = shared_memory.SharedMemory(name=name)
+    # pylint: disable=protected-access
+    resource_tracker.unregister(block._name, 'shared_memory')
+    return block
+
+
+def get_array(block, shape, dtype='float32'):
+    """Returns a numpy view of a shared memory block, without a copy.
+
+    The view holds the buffer of the block, so the block is not unmapped
+    while the view is alive.
+    """
+    count = int(np.prod(shape))
+    return np.frombuffer(block.buf, dtype=dtype, count=count).reshape(shape)
+
+
+def load_shared(name, shape, arg_dict):
+    """Prepare the input of a job into an existing shared memory block.
+
+    This runs in a loader process, so the input is decoded without holding
+    the GIL of the inference process and is never pickled.
+
+    Args:
+        name (str): The name of the shared memory block.
+        shape (tuple): The shape of the prepared input.
+        arg_dict (dict): Command line args for a single input image.
+    """
+    block = attach_block(name)
+    out = get_array(block, shape)
+    try:
+        dca.prepare.prepare_input(arg_dict['app'], out=out, **arg_dict)
+    finally:
+        del out
+        try:
+            block.close()
+        except BufferError:  # a view is held by the traceback of an error
+            pass
+
+
+class SharedLoader(object):
+    """Loads inputs in other processes into shared memory blocks.
+
+    The inference process reads the shape of each input from its headers,
+    acquires a block from a ``BufferPool``, and a loader process decodes
+    the input into it. The input is then a zero-copy view of the block,
+    which is recycled once ``release`` is called after the job is done.
+
+    Args:
+        processes (int): Number of loader processes.
+        max_buffers (int): Maximum number of shared memory blocks.
+    """
+
+    def __init__(self, processes=2, max_buffers=4):
+        self.pool = BufferPool(max_buffers)
+        self.executor = ProcessPoolExecutor(
+            max(1, int(processes)),
+            mp_context=multiprocessing.get_context('spawn'))
+        self.blocks = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def load(self, key, arg_dict):
+        """Load the input of a job into a shared memory block.
+
+        Args:
+            key (str): A unique key of the job, used to release its block.
+            arg_dict (dict): Command line args for a single input image.
+
+        Returns:
+            numpy.array: The prepared input, as a view of the block.
+        """
+        shape = dca.prepare.get_input_shape(arg_dict['app'], **arg_dict)
+        nbytes = int(np.prod(shape)) * np.dtype('float32').itemsize
+
+        block = self.pool.acquire(nbytes)
+        try:
+            self.executor.submit(load_shared, block.name, shape, arg_dict).result()
+        except BaseException:
+            self.pool.release(block)
+            raise
+
+        with self._lock:
+            self.blocks[key] = block
+        return get_array(block, shape)
+
+    def release(self, key):
+        """Recycle the block of a job once its input is no longer used.
+
+        The block may then be overwritten by another input, so views of it
+        must not be used after it is released.
+        """
+        with self._lock:
+            block = self.blocks.pop(key, None)
+        if block is not None:
+            self.pool.release(block)
+
+    def close(self):
+        """Stop the loader processes and free every block."""
+        self.executor.shutdown(wait=True)
+        self.pool.close()
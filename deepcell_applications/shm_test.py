@@ -0,0 +1,145 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.shm"""
+
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import tifffile
+
+import pytest
+
+import deepcell_applications as dca
+
+
+def test_buffer_pool():
+    pool = dca.shm.BufferPool(max_buffers=2)
+    try:
+        # released blocks are reused by inputs that fit
+        block = pool.acquire(1000)
+        assert block.size >= 1000
+        pool.release(block)
+        assert pool.acquire(500) is block
+        assert pool.created == 1
+
+        # a new block is created while there is room
+        other = pool.acquire(100)
+        assert other is not block
+        assert pool.created == 2
+
+        # acquire waits for a block to be released
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(pool.acquire(10)))
+        thread.start()
+        thread.join(timeout=0.1)
+        assert thread.is_alive()
+        pool.release(other)
+        thread.join(timeout=5)
+        assert acquired == [other]
+
+        # a free block that is too small is replaced by a larger one
+        pool.release(other)
+        larger = pool.acquire(10000)
+        assert larger.size >= 10000
+        assert pool.created == 3
+        assert len(pool.used) == 2
+    finally:
+        pool.close()
+
+    assert not pool.free and not pool.used
+
+
+def test_get_array():
+    pool = dca.shm.BufferPool()
+    try:
+        block = pool.acquire(4 * 32)
+        array = dca.shm.get_array(block, (4, 8))
+        array[:] = 1
+        # views share the block, without a copy
+        assert dca.shm.get_array(block, (32,)).sum() == 32
+        del array
+    finally:
+        pool.close()
+
+
+ATTACH_SCRIPT = """
+import sys
+import deepcell_applications as dca
+block = dca.shm.attach_block(sys.argv[1])
+block.buf[0] = 7
+block.close()
+"""
+
+
+def test_attach_block():
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pool = dca.shm.BufferPool()
+    try:
+        block = pool.acquire(16)
+        block.buf[0] = 0
+
+        # a process that attached to the block does not unlink it on exit
+        result = subprocess.run([sys.executable, '-c', ATTACH_SCRIPT, block.name],
+                                cwd=root_dir, capture_output=True, check=True)
+        assert b'leaked' not in result.stderr
+        assert block.buf[0] == 7
+        other = dca.shm.attach_block(block.name)
+        other.close()
+    finally:
+        pool.close()
+
+
+def test_shared_loader(tmpdir):
+    temp_dir = str(tmpdir)
+    nuclear = np.random.randint(0, 100, size=(2, 20, 30)).astype('uint16')
+    jobs = []
+    for i in range(3):
+        path = os.path.join(temp_dir, 'nuclear{}.tif'.format(i))
+        tifffile.imwrite(path, nuclear + i)
+        jobs.append({'app': 'mesmer', 'nuclear_path': path,
+                     'nuclear_channel': [0, 1]})
+
+    with dca.shm.SharedLoader(processes=2, max_buffers=2) as loader:
+        for i, job in enumerate(jobs):
+            image = loader.load(job['nuclear_path'], job)
+            assert image.shape == (1, 20, 30, 2)
+            expected = (nuclear + i).sum(axis=0)
+            np.testing.assert_array_equal(image[0, ..., 0], expected)
+            # reused blocks are cleared before they are loaded
+            np.testing.assert_array_equal(image[0, ..., 1], 0)
+            del image
+            loader.release(job['nuclear_path'])
+
+        # blocks are recycled once released
+        assert loader.pool.created == 1
+
+        # errors in the loader processes are raised and the block is returned
+        with pytest.raises(ValueError):
+            loader.load('bad', dict(jobs[0], nuclear_channel=5))
+        assert not loader.pool.used
@@ -0,0 +1,169 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Functions for running applications on each frame of a stack of images"""
+
+
+import numpy as np
+import tifffile
+
+import deepcell_applications as dca
+
+
+def get_stack_shape(img, ndim=4):
+    """Returns the number of frames and the ``(height, width)`` of a stack.
+
+    The first axis of the stack is the frame axis, e.g. time or z.
+
+    Args:
+        img (array-like): A stack opened with ``dca.io.open_image``.
+        ndim (int): The rank of a stack with a channel axis.
+
+    Returns:
+        tuple: The number of frames and the spatial shape of each frame.
+
+    Raises:
+        ValueError: If the stack does not have ``ndim`` or ``ndim - 1`` axes.
+    """
+    if img.ndim not in (ndim - 1, ndim):
+        raise ValueError('Expected a stack with ndim = {} or {} but found '
+                         'ndim={} and shape={}'.format(
+                             ndim - 1, ndim, img.ndim, img.shape))
+    # the shape of a frame is found without reading it
+    shape = list(img.shape[1:])
+    if len(shape) == ndim - 1:
+        del shape[dca.io.get_image_channel_axis(img, stack=True)]
+    return img.shape[0], tuple(shape)
+
+
+def iter_tiles(page, tile):
+    """Yields the tiles of a page in row-major order, padded to ``tile``."""
+    height, width = page.shape[:2]
+    for y in range(0, height, tile[0]):
+        for x in range(0, width, tile[1]):
+            out = np.zeros(tuple(tile) + page.shape[2:], dtype=page.dtype)
+            window = page[y:y + tile[0], x:x + tile[1]]
+            out[:window.shape[0], :window.shape[1]] = window
+            yield out
+
+
+def run_stack(app, arg_dict, metrics=None):
+    """Run the application on each frame of a stack and stream the outputs.
+
+    The leading axis of the inputs is the frame axis. Frames are read and
+    predicted ``stack_chunk`` at a time, and each output frame is written
+    as a page of a multi-page TIFF, so peak memory depends on the chunk
+    size rather than the number of frames.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        arg_dict (dict): Command line args for a single input stack.
+        metrics (dca.metrics.JobMetrics): Optional metrics of the job.
+
+    Raises:
+        ValueError: If the stack options or image shapes are invalid.
+    """
+    chunk_size = arg_dict.get('stack_chunk') or 16
+    if chunk_size < 1:
+        raise ValueError('Stack chunk must be at least 1, got {}'.format(
+            chunk_size))
+    if arg_dict.get('tile_size'):
+        raise ValueError('Stacks can not be tiled, remove --tile-size.')
+
+    ndim = 4
+    level = arg_dict.get('resolution_level', 0)
+    nuclear = dca.io.open_image(arg_dict['nuclear_path'], level=level,
+                                stack=True)
+    frames, shape = get_stack_shape(nuclear, ndim=ndim)
+
+    membrane = None
+    if arg_dict.get('membrane_path'):
+        membrane = dca.io.open_image(arg_dict['membrane_path'], level=level,
+                                     stack=True)
+        membrane_frames, membrane_shape = get_stack_shape(membrane, ndim=ndim)
+        if (membrane_frames, membrane_shape) != (frames, shape):
+            raise ValueError('Nuclear stack shape {} does not match membrane '
+                             'stack shape {}'.format(
+                                 (frames,) + shape,
+                                 (membrane_frames,) + membrane_shape))
+
+    if metrics is not None:
+        metrics.set_input_shape((frames,) + shape + (1,))
+
+    kwargs = dca.utils.get_predict_kwargs(arg_dict)
+
+    def predict(start):
+        stop = min(start + chunk_size, frames)
+        with dca.metrics.stage(metrics, 'load'):
+            image = np.zeros((stop - start,) + shape + (2,), dtype='float32')
+            for i in range(start, stop):
+                dca.io.read_window(nuclear, arg_dict.get('nuclear_channel', 0),
+                                   ndim=ndim - 1, out=image[i - start, ..., 0:1],
+                                   frame=i)
+                if membrane is not None:
+                    dca.io.read_window(membrane, arg_dict.get('membrane_channel', 0),
+                                       ndim=ndim - 1, out=image[i - start, ..., 1:2],
+                                       frame=i)
+        with dca.metrics.stage(metrics, 'validate'):
+            dca.utils.validate_input(app, image[0])
+        with dca.metrics.stage(metrics, 'predict'):
+            return app.predict(image, **kwargs)
+
+    # predict the first chunk to find the number of output channels
+    first_labels = predict(0)
+    channels = first_labels.shape[-1]
+
+    squeeze = arg_dict.get('squeeze') and channels == 1
+    page_shape = shape if squeeze else shape + (channels,)
+
+    save_kwargs = dca.io.get_save_kwargs(arg_dict)
+    tile = save_kwargs['tile']
+
+    # the largest label is not known until the end, so labels are at most uint32
+    dtype = 'uint32' if arg_dict.get('downcast', True) else first_labels.dtype
+
+    def pages():
+        labels = first_labels
+        for start in range(0, frames, chunk_size):
+            if start:
+                labels = predict(start)
+            for frame in labels:
+                page = frame.reshape(page_shape).astype(dtype, copy=False)
+                if tile:
+                    for out in iter_tiles(page, tile):
+                        yield out
+                else:
+                    yield page
+
+    outfile = dca.app_runners.get_output_path(arg_dict)
+
+    # the frames are loaded and predicted while writing
+    with dca.metrics.stage(metrics, 'write', exclude_nested=True):
+        with dca.io.atomic_write(outfile) as tmp_path:
+            tifffile.imwrite(tmp_path, pages(), shape=(frames,) + page_shape,
+                             dtype=dtype, tile=tile, photometric='minisblack',
+                             planarconfig='contig' if channels > 1 else None,
+                             compression=save_kwargs['compression'],
+                             bigtiff=save_kwargs['bigtiff'])
@@ -0,0 +1,183 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.stack"""
+
+import logging
+import os
+
+import numpy as np
+import tifffile
+
+import pytest
+
+import deepcell_applications as dca
+
+
+class DummyApplication(object):
+    """Returns the nuclear channel plus the membrane channel as labels."""
+
+    def __init__(self, *args, **kwargs):
+        self.model_image_shape = (32, 32, 2)
+        self.required_channels = 2
+        self.logger = logging.getLogger('DummyApplication')
+        self.batch_sizes = []
+
+    def predict(self, image, **kwargs):
+        self.batch_sizes.append(len(image))
+        # like Mesmer, labels are int64
+        return image.sum(axis=-1, keepdims=True).astype('int64')
+
+
+def test_get_stack_shape():
+    assert dca.stack.get_stack_shape(np.zeros((5, 40, 30))) == (5, (40, 30))
+    assert dca.stack.get_stack_shape(np.zeros((5, 3, 40, 30))) == (5, (40, 30))
+    assert dca.stack.get_stack_shape(np.zeros((5, 40, 30, 2))) == (5, (40, 30))
+    with pytest.raises(ValueError):
+        dca.stack.get_stack_shape(np.zeros((40, 30)))
+
+
+def test_iter_tiles():
+    page = np.arange(40 * 30).reshape((40, 30))
+    tiles = list(dca.stack.iter_tiles(page, (16, 16)))
+    assert len(tiles) == 3 * 2
+    assert all(t.shape == (16, 16) for t in tiles)
+    np.testing.assert_array_equal(tiles[1][:, :14], page[:16, 16:])
+    assert not tiles[-1][8:].any()
+
+
+def test_run_stack(tmpdir):
+    temp_dir = str(tmpdir)
+    app = DummyApplication()
+
+    # frames of channels first nuclear and single channel membrane stacks
+    rng = np.random.RandomState(0)
+    nuclear = rng.randint(0, 100, size=(7, 3, 40, 30)).astype('uint16')
+    membrane = rng.randint(0, 100, size=(7, 40, 30)).astype('uint16')
+    nuclear_path = os.path.join(temp_dir, 'nuclear.tif')
+    membrane_path = os.path.join(temp_dir, 'membrane.tif')
+    tifffile.imwrite(nuclear_path, nuclear)
+    tifffile.imwrite(membrane_path, membrane, compression='zlib')
+
+    arg_dict = {
+        'app': 'mesmer',
+        'output_directory': temp_dir,
+        'output_name': 'mask.tif',
+        'nuclear_path': nuclear_path,
+        'nuclear_channel': [0, 2],
+        'membrane_path': membrane_path,
+        'membrane_channel': [0],
+        'batch_size': 4,
+        'image_mpp': 0.5,
+        'compartment': 'whole-cell',
+        'squeeze': True,
+        'stack': True,
+        'stack_chunk': 3,
+    }
+    expected = nuclear[:, 0] + nuclear[:, 2] + membrane
+
+    metrics = dca.metrics.JobMetrics(arg_dict)
+    dca.stack.run_stack(app, arg_dict, metrics=metrics)
+    outfile = os.path.join(temp_dir, 'mask.tif')
+    with tifffile.TiffFile(outfile) as tif:
+        assert len(tif.pages) == 7
+        output = tif.asarray()
+    np.testing.assert_array_equal(output, expected)
+    assert output.dtype == np.uint32
+
+    # frames are predicted in chunks
+    assert app.batch_sizes == [3, 3, 1]
+    assert metrics.input_megapixels == 7 * 40 * 30 / 1e6
+    assert metrics.stages['predict']['calls'] == 3
+
+    # outputs are not squeezed by default, and may be tiled and compressed
+    arg_dict.update(squeeze=False, output_tile=16, compression='zlib')
+    dca.stack.run_stack(app, arg_dict)
+    with tifffile.TiffFile(outfile) as tif:
+        assert tif.pages[0].is_tiled
+        np.testing.assert_array_equal(tif.asarray(), expected[..., None])
+
+    # labels keep the dtype of the application without downcasting
+    arg_dict.update(downcast=False, output_name='no_downcast.tif')
+    dca.stack.run_stack(app, arg_dict)
+    output = tifffile.imread(os.path.join(temp_dir, 'no_downcast.tif'))
+    assert output.dtype == np.int64
+    np.testing.assert_array_equal(output, expected[..., None])
+
+    # stacks run through run_job
+    arg_dict['output_name'] = 'job.tif'
+    dca.app_runners.run_job(app, arg_dict)
+    assert os.path.exists(os.path.join(temp_dir, 'job.tif'))
+
+    # the frames of the inputs must match
+    tifffile.imwrite(membrane_path, membrane[:5])
+    with pytest.raises(ValueError):
+        dca.stack.run_stack(app, arg_dict)
+
+    # stacks can not be tiled
+    arg_dict.update(membrane_path=None, tile_size=32)
+    with pytest.raises(ValueError):
+        dca.stack.run_stack(app, arg_dict)
+
+
+def test_run_stack_zarr(tmpdir):
+    zarr = pytest.importorskip('zarr')
+    temp_dir = str(tmpdir)
+    app = DummyApplication()
+
+    # an OME-Zarr time-lapse, with the z axis after the channel axis
+    rng = np.random.RandomState(0)
+    source = rng.randint(0, 100, size=(5, 2, 1, 40, 30)).astype('uint16')
+    path = os.path.join(temp_dir, 'timelapse.ome.zarr')
+    group = zarr.open_group(path, mode='w')
+    array = zarr.open_array(os.path.join(path, '0'), mode='w',
+                            shape=source.shape, chunks=(1, 1, 1, 16, 16),
+                            dtype=source.dtype)
+    array[:] = source
+    group.attrs['multiscales'] = [{
+        'axes': [{'name': n} for n in 'tczyx'],
+        'datasets': [{'path': '0'}],
+    }]
+
+    arg_dict = {
+        'app': 'mesmer',
+        'output_directory': temp_dir,
+        'output_name': 'mask.tif',
+        'nuclear_path': path,
+        'nuclear_channel': [1],
+        'batch_size': 4,
+        'image_mpp': 0.5,
+        'compartment': 'whole-cell',
+        'squeeze': True,
+        'stack': True,
+        'stack_chunk': 2,
+    }
+    dca.stack.run_stack(app, arg_dict)
+    output = tifffile.imread(os.path.join(temp_dir, 'mask.tif'))
+    np.testing.assert_array_equal(output, source[:, 1, 0])
+
+    # the time axis is only read as frames in stack mode
+    with pytest.raises(ValueError, match='--stack'):
+        dca.io.open_image(path)
@@ -0,0 +1,309 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Functions for running applications on overlapping tiles of large images"""
+
+
+import numpy as np
+import tifffile
+
+import deepcell_applications as dca
+
+
+def get_image_shape(img, ndim=3):
+    """Returns the spatial ``(height, width)`` of an opened image.
+
+    Args:
+        img (array-like): An image opened with ``dca.io.open_image``.
+        ndim (int): The expected rank of a single-channel image.
+
+    Returns:
+        tuple: The height and width of the image.
+    """
+    shape = list(img.shape)
+    if len(shape) == ndim:
+        del shape[dca.io.get_image_channel_axis(img)]
+    return tuple(shape)
+
+
+def get_windows(shape, tile_size, overlap):
+    """Yields the core and window of each tile in row-major order.
+
+    The core of each tile is a ``tile_size`` square region of the image,
+    and its window extends the core by ``overlap`` pixels on each side.
+
+    Args:
+        shape (tuple): The ``(height, width)`` of the image.
+        tile_size (int): The size of the core of each tile.
+        overlap (int): The number of pixels added to each side of the core.
+
+    Yields:
+        tuple: The core and window as tuples of ``(rows, cols)`` slices.
+    """
+    height, width = shape
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            y1 = min(y0 + tile_size, height)
+            x1 = min(x0 + tile_size, width)
+            core = (slice(y0, y1), slice(x0, x1))
+            window = (slice(max(0, y0 - overlap), min(height, y1 + overlap)),
+                      slice(max(0, x0 - overlap), min(width, x1 + overlap)))
+            yield core, window
+
+
+def match_labels(new, old, threshold=0.5):
+    """Match labels in ``new`` to the labels they overlap with in ``old``.
+
+    Args:
+        new (numpy.array): Labels of the same region as ``old``.
+        old (numpy.array): Labels that have already been assigned.
+        threshold (float): The minimum fraction of a new label's area in the
+            region that must overlap an old label to be matched.
+
+    Returns:
+        dict: Mapping of each matched new label to an old label.
+    """
+    both = (new > 0) & (old > 0)
+    if not both.any():
+        return {}
+
+    pairs, counts = np.unique(np.stack([new[both], old[both]]),
+                              axis=1, return_counts=True)
+    labels, areas = np.unique(new[new > 0], return_counts=True)
+    areas = dict(zip(labels, areas))
+
+    best = {}
+    for (n, o), count in zip(pairs.T, counts):
+        if count > best.get(n, (None, 0))[1]:
+            best[n] = (o, count)
+
+    return {n: o for n, (o, count) in best.items()
+            if count >= threshold * areas[n]}
+
+
+def relabel(labels, mapping):
+    """Replace labels in place according to ``mapping``."""
+    if not mapping:
+        return labels
+    keys = np.array(sorted(mapping), dtype=labels.dtype)
+    values = np.array([mapping[k] for k in keys], dtype=labels.dtype)
+    idx = np.clip(np.searchsorted(keys, labels), 0, len(keys) - 1)
+    hits = keys[idx] == labels
+    labels[hits] = values[idx[hits]]
+    return labels
+
+
+class LabelStitcher(object):
+    """Stitch the labels of overlapping tiles into globally consistent labels.
+
+    Tiles must be stitched in the row-major order of ``get_windows``.
+    Each tile's labels are offset to be unique, then any label that overlaps
+    an already stitched label in the tile above or to the left is replaced
+    with that label. Only a strip of ``overlap`` pixels of the previous
+    tiles is kept, so memory does not grow with the size of the image.
+
+    Args:
+        width (int): The width of the whole image.
+        channels (int): The number of label channels.
+        overlap (int): The overlap between tiles.
+        threshold (float): The overlap threshold for matching labels.
+    """
+
+    def __init__(self, width, channels, overlap, threshold=0.5):
+        self.overlap = overlap
+        self.threshold = threshold
+        # the bottom rows of the previous row of tiles
+        self.above = np.zeros((overlap, width, channels), dtype='int32')
+        self._below = np.zeros_like(self.above)
+        # the right-most columns of the previous tile in this row
+        self.left = None
+        self.max_label = np.zeros(channels, dtype='int64')
+        self._row = None
+
+    def stitch(self, labels, core, window):
+        """Stitch the labels predicted for a window and return its core.
+
+        Args:
+            labels (numpy.array): The ``(height, width, channels)`` labels
+                predicted for ``window``.
+            core (tuple): The ``(rows, cols)`` slices of the tile's core.
+            window (tuple): The ``(rows, cols)`` slices of the tile's window.
+
+        Returns:
+            numpy.array: The stitched labels of the core.
+        """
+        (y0, y1), (x0, x1) = (core[0].start, core[0].stop), (core[1].start, core[1].stop)
+        (wy0, wy1), (wx0, wx1) = ((window[0].start, window[0].stop),
+                                  (window[1].start, window[1].stop))
+
+        if self._row != y0:  # a new row of tiles
+            if self._row is not None:
+                self.above, self._below = self._below, self.above
+            self._row = y0
+            self.left = None
+
+        labels = labels.astype('int32')
+        # core of the tile relative to the window
+        cy0, cy1, cx0, cx1 = y0 - wy0, y1 - wy0, x0 - wx0, x1 - wx0
+
+        for c in range(labels.shape[-1]):
+            lab = labels[..., c]
+            lab[lab > 0] += self.max_label[c]
+
+            new_regions, old_regions = [], []
+            if cy0 > 0:  # the window overlaps the row above
+                new_regions.append(lab[:cy0])
+                old_regions.append(self.above[self.overlap - cy0:, wx0:wx1, c])
+            if cx0 > 0 and self.left is not None:  # the window overlaps the left tile
+                new_regions.append(lab[cy0:cy1, :cx0])
+                old_regions.append(self.left[:, self.left.shape[1] - cx0:, c])
+
+            mapping = {}
+            if new_regions:
+                mapping = match_labels(
+                    np.concatenate([r.ravel() for r in new_regions]),
+                    np.concatenate([r.ravel() for r in old_regions]),
+                    threshold=self.threshold)
+
+            self.max_label[c] = max(self.max_label[c], lab.max())
+            relabel(lab[cy0:cy1, cx0:cx1], mapping)
+
+        out = labels[cy0:cy1, cx0:cx1]
+
+        # save the edges of the core for the following tiles
+        self.left = out[:, -self.overlap:] if self.overlap else None
+        rows = min(self.overlap, y1 - y0)
+        if rows:
+            self._below[self.overlap - rows:, x0:x1] = out[-rows:]
+
+        return out
+
+
+def run_tiled(app, arg_dict, metrics=None):
+    """Run the application on overlapping tiles and stream them to a file.
+
+    The inputs are read one window at a time, and the stitched labels are
+    written as a tiled TIFF, so peak memory depends on the tile size
+    rather than the size of the image.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        arg_dict (dict): Command line args for a single input image.
+        metrics (dca.metrics.JobMetrics): Optional metrics of the job.
+            The stages are summed over all tiles.
+
+    Raises:
+        ValueError: If the tiling options or image shapes are invalid.
+    """
+    tile_size = arg_dict['tile_size']
+    overlap = arg_dict.get('tile_overlap', 0)
+    ndim = 3
+
+    if tile_size % 16:
+        raise ValueError('Tile size must be a multiple of 16, got {}'.format(
+            tile_size))
+    if not 0 <= overlap <= tile_size:
+        raise ValueError('Tile overlap must be between 0 and the tile size, '
+                         'got {}'.format(overlap))
+
+    level = arg_dict.get('resolution_level', 0)
+    nuclear = dca.io.open_image(arg_dict['nuclear_path'], level=level)
+    shape = get_image_shape(nuclear, ndim=ndim)
+
+    membrane = None
+    if arg_dict.get('membrane_path'):
+        membrane = dca.io.open_image(arg_dict['membrane_path'], level=level)
+        if get_image_shape(membrane, ndim=ndim) != shape:
+            raise ValueError('Nuclear image shape {} does not match membrane '
+                             'image shape {}'.format(
+                                 shape, get_image_shape(membrane, ndim=ndim)))
+
+    if metrics is not None:
+        metrics.set_input_shape(shape + (1,))
+
+    kwargs = dca.utils.get_predict_kwargs(arg_dict)
+
+    def predict(window):
+        rows, cols = window
+        with dca.metrics.stage(metrics, 'load'):
+            image = np.zeros((1, rows.stop - rows.start, cols.stop - cols.start, 2),
+                             dtype='float32')
+            dca.io.read_window(nuclear, arg_dict.get('nuclear_channel', 0),
+                               rows, cols, ndim=ndim, out=image[0, ..., 0:1])
+            if membrane is not None:
+                dca.io.read_window(membrane, arg_dict.get('membrane_channel', 0),
+                                   rows, cols, ndim=ndim, out=image[0, ..., 1:2])
+        with dca.metrics.stage(metrics, 'validate'):
+            dca.utils.validate_input(app, image[0])
+        with dca.metrics.stage(metrics, 'predict'):
+            return app.predict(image, **kwargs)[0]
+
+    windows = get_windows(shape, tile_size, overlap)
+
+    # predict the first tile to find the number of output channels
+    first_core, first_window = next(windows)
+    first_labels = predict(first_window)
+    channels = first_labels.shape[-1]
+
+    stitcher = LabelStitcher(shape[1], channels, overlap)
+
+    if arg_dict.get('squeeze'):
+        out_shape = shape if channels == 1 else shape + (channels,)
+    else:
+        out_shape = (1,) + shape + (channels,)
+    tile_shape = (tile_size, tile_size)
+    if len(out_shape) > len(shape):  # output has a channel axis
+        tile_shape += (channels,)
+
+    # the largest label is not known until the end, so labels are at most uint32
+    dtype = 'uint32' if arg_dict.get('downcast', True) else first_labels.dtype
+
+    def tiles():
+        labels = first_labels
+        core, window = first_core, first_window
+        while True:
+            with dca.metrics.stage(metrics, 'stitch'):
+                out = stitcher.stitch(labels, core, window)
+            tile = np.zeros((tile_size, tile_size, channels), dtype=dtype)
+            tile[:out.shape[0], :out.shape[1]] = out
+            yield tile.reshape(tile_shape)
+            try:
+                core, window = next(windows)
+            except StopIteration:
+                return
+            labels = predict(window)
+
+    save_kwargs = dca.io.get_save_kwargs(arg_dict)
+
+    outfile = dca.app_runners.get_output_path(arg_dict)
+
+    # the tiles are loaded, predicted and stitched while writing
+    with dca.metrics.stage(metrics, 'write', exclude_nested=True):
+        with dca.io.atomic_write(outfile) as tmp_path:
+            tifffile.imwrite(tmp_path, tiles(), shape=out_shape, dtype=dtype,
+                             tile=(tile_size, tile_size), photometric='minisblack',
+                             planarconfig='contig' if channels > 1 else None,
+                             compression=save_kwargs['compression'],
+                             bigtiff=save_kwargs['bigtiff'])
@@ -0,0 +1,195 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.tiling"""
+
+import logging
+import os
+
+import numpy as np
+import tifffile
+
+from skimage.measure import label
+
+import pytest
+
+import deepcell_applications as dca
+
+
+class DummyApplication(object):
+    """Labels the connected components of the nuclear channel."""
+
+    def __init__(self, *args, **kwargs):
+        self.model_image_shape = (32, 32, 2)
+        self.required_channels = 2
+        self.logger = logging.getLogger('DummyApplication')
+
+    def predict(self, image, **kwargs):
+        labels = [label(img[..., 0] > 0) for img in image]
+        # like Mesmer, labels are int64
+        return np.expand_dims(np.stack(labels), axis=-1).astype('int64')
+
+
+def _random_blobs(shape, num_blobs=40, seed=0):
+    rng = np.random.RandomState(seed)
+    img = np.zeros(shape, dtype='uint16')
+    for _ in range(num_blobs):
+        y, x = rng.randint(0, shape[0] - 8), rng.randint(0, shape[1] - 8)
+        h, w = rng.randint(2, 8, size=2)
+        img[y:y + h, x:x + w] = 100
+    return img
+
+
+def _assert_same_partition(a, b):
+    # labels may differ, but each label in a must map to exactly one in b
+    pairs = np.unique(np.stack([a.ravel(), b.ravel()]), axis=1)
+    assert len(np.unique(pairs[0])) == pairs.shape[1]
+    assert len(np.unique(pairs[1])) == pairs.shape[1]
+
+
+def test_get_windows():
+    shape, tile_size, overlap = (50, 70), 16, 4
+    covered = np.zeros(shape, dtype='int')
+    for core, window in dca.tiling.get_windows(shape, tile_size, overlap):
+        covered[core] += 1
+        for c, w, size in zip(core, window, shape):
+            assert w.start == max(0, c.start - overlap)
+            assert w.stop == min(size, c.stop + overlap)
+    # every pixel is in exactly one core
+    np.testing.assert_array_equal(covered, 1)
+
+
+def test_match_labels():
+    old = np.array([1, 1, 1, 2, 2, 0, 0, 3])
+    new = np.array([5, 5, 6, 6, 6, 7, 7, 7])
+    mapping = dca.tiling.match_labels(new, old)
+    # 6 overlaps 2 more than 1, 7 overlaps 3 with only 1/3 of its area
+    assert mapping == {5: 1, 6: 2}
+    assert dca.tiling.match_labels(new, np.zeros_like(old)) == {}
+
+    labels = np.array([[5, 6], [7, 0]])
+    dca.tiling.relabel(labels, mapping)
+    np.testing.assert_array_equal(labels, [[1, 2], [7, 0]])
+
+
+def test_label_stitcher():
+    app = DummyApplication()
+    img = _random_blobs((100, 90))
+    expected = label(img > 0)
+
+    for tile_size, overlap in ((32, 16), (48, 8), (16, 16)):
+        shape = img.shape
+        stitched = np.zeros(shape, dtype='int32')
+        stitcher = dca.tiling.LabelStitcher(shape[1], 1, overlap)
+        for core, window in dca.tiling.get_windows(shape, tile_size, overlap):
+            window_img = np.expand_dims(img[window], axis=(0, -1))
+            labels = app.predict(window_img)[0]
+            stitched[core] = stitcher.stitch(labels, core, window)[..., 0]
+        _assert_same_partition(stitched, expected)
+
+
+def test_run_tiled(tmpdir):
+    temp_dir = str(tmpdir)
+    app = DummyApplication()
+    img = _random_blobs((100, 90))
+    expected = label(img > 0)
+
+    # channels last and channels first multi-channel inputs
+    nuclear_path = os.path.join(temp_dir, 'nuclear.tif')
+    tifffile.imwrite(nuclear_path, np.stack([np.zeros_like(img), img], axis=-1))
+    membrane_path = os.path.join(temp_dir, 'membrane.tif')
+    tifffile.imwrite(membrane_path, np.stack([img, img, img]),
+                     compression='zlib', photometric='minisblack')
+
+    arg_dict = {
+        'app': 'mesmer',
+        'output_directory': temp_dir,
+        'output_name': 'mask.tif',
+        'nuclear_path': nuclear_path,
+        'nuclear_channel': [1],
+        'membrane_path': membrane_path,
+        'membrane_channel': [0, 2],
+        'batch_size': 4,
+        'image_mpp': 0.5,
+        'compartment': 'whole-cell',
+        'squeeze': True,
+        'tile_size': 32,
+        'tile_overlap': 16,
+    }
+
+    dca.tiling.run_tiled(app, arg_dict)
+    output = tifffile.imread(os.path.join(temp_dir, 'mask.tif'))
+    assert output.shape == img.shape
+    assert output.dtype == np.uint32
+    _assert_same_partition(output, expected)
+
+    # output options are used for the tiled file
+    arg_dict['compression'] = 'zlib'
+    arg_dict['output_name'] = 'compressed.tif'
+    dca.tiling.run_tiled(app, arg_dict)
+    with tifffile.TiffFile(os.path.join(temp_dir, 'compressed.tif')) as tif:
+        assert tif.pages[0].compression == tifffile.COMPRESSION.ADOBE_DEFLATE
+        np.testing.assert_array_equal(tif.asarray(), output)
+
+    # stages are summed over all tiles
+    arg_dict['output_name'] = 'metrics.tif'
+    metrics = dca.metrics.JobMetrics(arg_dict)
+    dca.tiling.run_tiled(app, arg_dict, metrics=metrics)
+    assert metrics.input_megapixels == img.size / 1e6
+    assert set(metrics.stages) == {'load', 'validate', 'predict', 'stitch', 'write'}
+    n_tiles = len(list(dca.tiling.get_windows(img.shape, 32, 16)))
+    assert metrics.stages['predict']['calls'] == n_tiles
+    assert metrics.stages['write']['calls'] == 1
+    assert metrics.stages['write']['seconds'] >= 0
+
+    # labels keep the dtype of the application without downcasting
+    arg_dict['downcast'] = False
+    arg_dict['output_name'] = 'no_downcast.tif'
+    dca.tiling.run_tiled(app, arg_dict)
+    no_downcast = tifffile.imread(os.path.join(temp_dir, 'no_downcast.tif'))
+    assert no_downcast.dtype == np.int64
+    np.testing.assert_array_equal(no_downcast, output)
+    arg_dict['downcast'] = True
+
+    # outputs are not squeezed by default
+    arg_dict['squeeze'] = False
+    arg_dict['output_name'] = 'mask2.tif'
+    dca.tiling.run_tiled(app, arg_dict)
+    output = tifffile.imread(os.path.join(temp_dir, 'mask2.tif'))
+    assert output.shape == (1,) + img.shape + (1,)
+
+    # bad tiling parameters
+    for tile_size, overlap in ((30, 8), (32, 48), (32, -1)):
+        arg_dict['tile_size'] = tile_size
+        arg_dict['tile_overlap'] = overlap
+        with pytest.raises(ValueError):
+            dca.tiling.run_tiled(app, arg_dict)
+
+    # nuclear and membrane shapes must match
+    tifffile.imwrite(membrane_path, img[:50])
+    arg_dict['tile_size'] = 32
+    arg_dict['tile_overlap'] = 16
+    with pytest.raises(ValueError):
+        dca.tiling.run_tiled(app, arg_dict)
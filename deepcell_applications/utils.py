@@ -25,28 +25,125 @@
 # ==============================================================================
 """Functions for instantiating and running Applications"""
 
+import importlib
+import logging
+import timeit
+
+import numpy as np
+
 import deepcell_applications as dca
 
 
-def get_app(name, **kwargs):
-    """Returns an instantiated Application based on the name.
+logger = logging.getLogger(__name__)
+
+
+def get_app_class(name, load=True):
+    """Returns the Application class for the name, importing it if needed.
 
     Args:
         name (str): The name of the application
-        kwargs (dict): Keyword arguments used for application instantiation
+        load (bool): Whether to import the class. If False, the class
+            is returned as configured, which may be its import path.
 
     Returns:
-        deepcell.applications.Application: The instantiated application
+        class: The ``deepcell.applications.Application`` subclass.
     """
     name = str(name).lower()
     app_map = dca.settings.VALID_APPLICATIONS
     try:
-        return app_map[name]['class'](**kwargs)
+        app_class = app_map[name]['class']
     except KeyError:
         raise ValueError('{} is not a valid application name. '
                          'Valid applications: {}'.format(
                              name, list(app_map.keys())))
 
+    return import_app_class(app_class) if load else app_class
+
+
+def import_app_class(app_class):
+    """Returns the Application class, importing it from its path if needed.
+
+    Args:
+        app_class (str or class): The class or its ``module.Class`` path.
+
+    Returns:
+        class: The ``deepcell.applications.Application`` subclass.
+    """
+    if isinstance(app_class, str):
+        module_name, class_name = app_class.rsplit('.', 1)
+        app_class = getattr(importlib.import_module(module_name), class_name)
+
+    return app_class
+
+
+def get_app(name, model_directory=None, offline=None, **kwargs):
+    """Returns an instantiated Application based on the name.
+
+    If the model of the application was cached by ``prefetch``, it is
+    verified and loaded from the model cache instead of being downloaded.
+
+    Args:
+        name (str): The name of the application
+        model_directory (str): The model cache directory.
+        offline (bool): Whether to fail instead of downloading a model that
+            is not cached. Defaults to ``DEEPCELL_OFFLINE``.
+        kwargs (dict): Keyword arguments used for application instantiation
+
+    Returns:
+        deepcell.applications.Application: The instantiated application
+    """
+    app_class = get_app_class(name)
+    return dca.models.load_app(app_class, directory=model_directory,
+                               offline=offline,
+                               sha256=dca.models.get_pinned_checksum(name),
+                               **kwargs)
+
+
+def warmup_app(app, batch_size=1, steps=2):
+    """Compile the model for its tile shape and batch size ahead of any job.
+
+    TensorFlow traces and optimizes the prediction graph on the first call
+    with each input shape. ``app.predict`` runs the model on tiles of
+    ``app.model_image_shape``, in full batches and a final partial batch,
+    so the model is run once on each of these with zeros. The first jobs
+    then reuse the compiled graphs instead of paying for them.
+
+    Args:
+        app (deepcell.applications.Application): The instantiated application.
+        batch_size (int): The batch size that jobs will predict with.
+        steps (int): The number of batches timed after compiling.
+
+    Returns:
+        dict: The ``batch_size``, the ``compile_seconds`` of the warm-up
+            calls, and the ``steady_seconds`` of each later batch.
+    """
+    batch_size = max(1, int(batch_size))
+    tiles = np.zeros((batch_size,) + tuple(app.model_image_shape),
+                     dtype='float32')
+
+    _ = timeit.default_timer()
+    app.model.predict(tiles, batch_size=batch_size)
+    if batch_size > 1:
+        # the last tiles of an image are usually a smaller batch
+        app.model.predict(tiles[:1], batch_size=batch_size)
+    compile_seconds = timeit.default_timer() - _
+
+    _ = timeit.default_timer()
+    for _step in range(steps):
+        app.model.predict(tiles, batch_size=batch_size)
+    steady_seconds = (timeit.default_timer() - _) / max(1, steps)
+
+    logger.info('Warmed up %s for batches of %s tiles of shape %s: '
+                '%.3f s to compile, then %.3f s per batch.',
+                app.__class__.__name__, batch_size,
+                tuple(app.model_image_shape), compile_seconds, steady_seconds)
+
+    return {
+        'batch_size': batch_size,
+        'compile_seconds': compile_seconds,
+        'steady_seconds': steady_seconds,
+    }
+
 
 def validate_input(app, img):
     # validate correct shape of image
@@ -25,6 +25,7 @@
 # ==============================================================================
 """Tests for deepcell_applications.utils"""
 
+import collections
 import copy
 
 import numpy as np
@@ -73,6 +74,55 @@ def test_get_app(mocker):
         _ = dca.utils.get_app('bad_app_name')
 
 
+def test_get_app_class(mocker):
+    # classes can be configured by import path and are imported lazily
+    mocked_applications = {
+        'ordereddict': {
+            'class': 'collections.OrderedDict',
+            'predict_options': [],
+        },
+        'dummyapplication': MOCKED_APPLICATIONS['dummyapplication'],
+    }
+    mocker.patch('deepcell_applications.settings.VALID_APPLICATIONS',
+                 mocked_applications)
+
+    app_class = dca.utils.get_app_class('OrderedDict')
+    assert app_class is collections.OrderedDict
+    assert isinstance(dca.utils.get_app('ordereddict'), collections.OrderedDict)
+
+    app_class = dca.utils.get_app_class('dummyapplication')
+    assert app_class is DummyApplication
+
+    # the import path can be passed to another process before importing it
+    app_path = dca.utils.get_app_class('ordereddict', load=False)
+    assert app_path == 'collections.OrderedDict'
+    assert dca.utils.import_app_class(app_path) is collections.OrderedDict
+
+    with pytest.raises(ValueError):
+        _ = dca.utils.get_app_class('bad_app_name')
+
+
+def test_warmup_app(mocker):
+    app = DummyApplication()
+    app.model = mocker.Mock()
+
+    timings = dca.utils.warmup_app(app, batch_size=4, steps=3)
+    assert timings['batch_size'] == 4
+    assert timings['compile_seconds'] >= 0
+    assert timings['steady_seconds'] >= 0
+
+    # a full batch and a partial batch are compiled, then full batches are timed
+    calls = app.model.predict.call_args_list
+    assert [c[0][0].shape for c in calls] == [(4, 32, 32, 1), (1, 32, 32, 1)] + [
+        (4, 32, 32, 1)] * 3
+    assert all(c[1]['batch_size'] == 4 for c in calls)
+
+    # a batch of one has no partial batch
+    app.model.reset_mock()
+    dca.utils.warmup_app(app, batch_size=1, steps=1)
+    assert app.model.predict.call_count == 2
+
+
 def test_validate_input():
     app = DummyApplication()
 
@@ -0,0 +1,279 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Functions for running many jobs in parallel worker processes"""
+
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import traceback
+
+import deepcell_applications as dca
+
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '[%(asctime)s]:[%(levelname)s]:[%(name)s]: %(message)s'
+
+# Seconds to wait for the last messages of a worker that exited cleanly
+EXIT_DRAIN_TIMEOUT = 5
+
+
+def get_available_cpus():
+    """Returns the CPUs that this process may run on."""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS and Windows
+        return list(range(os.cpu_count() or 1))
+
+
+def split_cpus(cpus, workers):
+    """Split the CPUs into contiguous sets, one for each worker.
+
+    Args:
+        cpus (list): The CPUs to split.
+        workers (int): The number of workers. There are at most as many
+            workers as CPUs.
+
+    Returns:
+        list: The CPUs of each worker.
+    """
+    workers = max(1, min(int(workers), len(cpus)))
+    size, extra = divmod(len(cpus), workers)
+    cpu_sets = []
+    start = 0
+    for i in range(workers):
+        stop = start + size + (1 if i < extra else 0)
+        cpu_sets.append(list(cpus[start:stop]))
+        start = stop
+    return cpu_sets
+
+
+def configure_worker(cpus):
+    """Pin the current process to ``cpus`` and size its thread pools to match.
+
+    This must be called before TensorFlow runs any operations.
+
+    Args:
+        cpus (list): The CPUs that the process may run on.
+    """
+    intra_op_threads = len(cpus)
+    inter_op_threads = min(2, len(cpus))
+
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+
+    # thread pools of numpy and TensorFlow that read the environment
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                 'TF_NUM_INTRAOP_THREADS'):
+        os.environ[name] = str(intra_op_threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op_threads)
+
+    try:
+        import tensorflow as tf  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return
+
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+
+
+def run_worker(index, app_class, cpus, tasks, results,
+               memory=None, log_level=None, model_options=None, template=None):
+    """Build an application and run jobs from a queue until it is empty.
+
+    Each job is reported to ``results`` as a tuple of
+    ``(kind, index, output path or job count, error, peak RSS)``.
+
+    Args:
+        index (int): The index of the worker.
+        app_class (str or class): The application class or its import path.
+        cpus (list): The CPUs that the worker may run on.
+        tasks (multiprocessing.Queue): Jobs to run, followed by ``None``.
+        results (multiprocessing.Queue): Queue to report the results to.
+        memory (int): The memory available to the worker in bytes.
+        log_level (str): The level of the worker's log messages.
+        model_options (dict): Keyword arguments of ``dca.models.load_app``,
+            e.g. the model cache ``directory``.
+        template (dict): Command line args of the first job of the run.
+            The application is converted and warmed up for it when it is
+            built, before the worker takes any jobs.
+    """
+    if log_level:
+        logging.basicConfig(level=log_level, format=LOG_FORMAT,
+                            stream=sys.stdout)
+
+    count = 0
+    cache = None
+    try:
+        configure_worker(cpus)
+        app = dca.models.load_app(dca.utils.import_app_class(app_class),
+                                  **(model_options or {}))
+        if template is not None:
+            dca.app_runners.prepare_app(app, template, [dict(template)],
+                                        memory=memory)
+
+        while True:
+            job = tasks.get()
+            if job is None:
+                break
+
+            outfile = dca.app_runners.get_output_path(job)
+            error = None
+            try:
+                if cache is None:
+                    cache = dca.cache.get_cache(job)
+                dca.autotune.resolve_batch_size(app, [job], memory=memory)
+                dca.app_runners.run_job(app, job, cache=cache)
+            except Exception:  # pylint: disable=broad-except
+                error = traceback.format_exc()
+
+            count += 1
+            results.put(('job', index, outfile, error,
+                         dca.metrics.get_peak_rss()))
+
+    except Exception:  # pylint: disable=broad-except
+        results.put(('done', index, count, traceback.format_exc(),
+                     dca.metrics.get_peak_rss()))
+        return
+
+    if cache is not None:
+        logger.info('Worker %s result cache: %s hits, %s misses, %s evictions.',
+                    index, cache.hits, cache.misses, cache.evictions)
+
+    results.put(('done', index, count, None, dca.metrics.get_peak_rss()))
+
+
+def run_jobs_in_workers(name, jobs, workers, log_level=None,
+                        model_directory=None, offline=None):
+    """Run jobs in worker processes, each with its own application.
+
+    Each worker is pinned to its own set of CPUs, with thread pools sized
+    to match. The workers take the next job from a shared queue whenever
+    they are idle, so faster workers run more jobs.
+
+    Args:
+        name (str): The name of the application.
+        jobs (list): Command line args for each input image.
+        workers (int): The number of worker processes.
+        log_level (str): The level of the workers' log messages.
+        model_directory (str): The model cache directory.
+        offline (bool): Whether to fail instead of downloading a model that
+            is not cached.
+
+    Returns:
+        list: The CPUs, number of jobs and peak RSS of each worker.
+
+    Raises:
+        RuntimeError: If a job fails or a worker exits unexpectedly.
+    """
+    app_class = dca.utils.get_app_class(name, load=False)
+    model_options = {
+        'directory': model_directory,
+        'offline': offline,
+        'sha256': dca.models.get_pinned_checksum(name),
+    }
+    cpu_sets = split_cpus(get_available_cpus(), workers)
+    if len(cpu_sets) < workers:
+        logger.warning('Using %s workers, one for each available CPU.',
+                       len(cpu_sets))
+
+    # the memory available to each worker, e.g. for the automatic batch size
+    memory = dca.autotune.get_available_memory()
+    memory = memory // len(cpu_sets) if memory else None
+
+    # spawn clean processes, as TensorFlow is not safe to fork
+    context = multiprocessing.get_context('spawn')
+    tasks = context.Queue()
+    results = context.Queue()
+    for job in jobs:
+        tasks.put(job)
+    for _ in cpu_sets:
+        tasks.put(None)
+
+    processes = [
+        context.Process(target=run_worker,
+                        args=(i, app_class, cpus, tasks, results),
+                        kwargs={'memory': memory, 'log_level': log_level,
+                                'model_options': model_options,
+                                'template': jobs[0]},
+                        daemon=True)
+        for i, cpus in enumerate(cpu_sets)
+    ]
+    for process in processes:
+        process.start()
+
+    stats = [{'cpus': cpus, 'jobs': 0, 'peak_rss_bytes': None}
+             for cpus in cpu_sets]
+    finished = set()
+
+    def handle(message):
+        kind, index, value, error, peak_rss = message
+        stats[index]['peak_rss_bytes'] = peak_rss
+        if kind == 'done':
+            finished.add(index)
+            stats[index]['jobs'] = value
+            if error:
+                raise RuntimeError('Worker {} failed:\n{}'.format(index, error))
+        elif error:
+            raise RuntimeError('Failed to write {}:\n{}'.format(value, error))
+
+    try:
+        while len(finished) < len(processes):
+            try:
+                handle(results.get(timeout=1))
+                continue
+            except queue.Empty:
+                pass
+
+            for i, process in enumerate(processes):
+                if i in finished or process.exitcode is None:
+                    continue
+                if process.exitcode != 0:
+                    raise RuntimeError('Worker {} exited with code {}.'.format(
+                        i, process.exitcode))
+
+                # the worker may have exited right after its last messages
+                while i not in finished:
+                    try:
+                        handle(results.get(timeout=EXIT_DRAIN_TIMEOUT))
+                    except queue.Empty:
+                        raise RuntimeError('Worker {} exited without finishing '
+                                           'its jobs.'.format(i))
+    finally:
+        for process in processes:
+            if process.is_alive() and len(finished) < len(processes):
+                process.terminate()
+            process.join()
+
+    for i, stat in enumerate(stats):
+        peak_rss = stat['peak_rss_bytes']
+        logger.info('Worker %s on CPUs %s ran %s jobs with a peak RSS of %s MB.',
+                    i, stat['cpus'], stat['jobs'],
+                    '?' if peak_rss is None else round(peak_rss / 2 ** 20, 1))
+
+    return stats
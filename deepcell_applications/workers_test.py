@@ -0,0 +1,183 @@
+# Copyright 2016-2021 The Van Valen Lab at the California Institute of
+# Technology (Caltech), with support from the Paul Allen Family Foundation,
+# Google, & National Institutes of Health (NIH) under Grant U24CA224309-01.
+# All rights reserved.
+#
+# Licensed under a modified Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.github.com/vanvalenlab/deepcell-applications/LICENSE
+#
+# The Work provided may be used for non-commercial academic purposes only.
+# For any other use of the Work, including commercial use, please contact:
+# vanvalenlab@gmail.com
+#
+# Neither the name of Caltech nor the names of its contributors may be used
+# to endorse or promote products derived from this software without specific
+# prior written permission.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for deepcell_applications.workers"""
+
+import logging
+import os
+import queue
+
+import numpy as np
+import tifffile
+
+import pytest
+
+import deepcell_applications as dca
+
+
+class DummyApplication(object):
+
+    def __init__(self, *args, **kwargs):
+        self.model_image_shape = (32, 32, 2)
+        self.required_channels = 2
+        self.logger = logging.getLogger('DummyApplication')
+
+    def predict(self, image, **kwargs):
+        return np.zeros(image.shape[:-1] + (1,), dtype='int32')
+
+
+def test_split_cpus():
+    assert dca.workers.split_cpus([0, 1, 2, 3], 2) == [[0, 1], [2, 3]]
+    assert dca.workers.split_cpus(list(range(5)), 2) == [[0, 1, 2], [3, 4]]
+    # at most one worker per CPU
+    assert dca.workers.split_cpus([4, 5], 3) == [[4], [5]]
+    assert dca.workers.split_cpus([0, 1], 0) == [[0, 1]]
+
+
+def test_get_available_cpus():
+    cpus = dca.workers.get_available_cpus()
+    assert cpus
+    assert len(cpus) <= os.cpu_count()
+
+
+def test_run_worker_warmup(tmpdir, mocker, monkeypatch):
+    temp_dir = str(tmpdir)
+    monkeypatch.delenv('DEEPCELL_OFFLINE', raising=False)
+    mocker.patch('deepcell_applications.workers.configure_worker')
+    calls = []
+    mocker.patch('deepcell_applications.utils.warmup_app',
+                 side_effect=lambda app, batch_size: calls.append(batch_size))
+    mocker.patch('deepcell_applications.app_runners.run_job',
+                 side_effect=lambda app, job, cache: calls.append(job['output_name']))
+
+    jobs = [{'app': 'mesmer', 'output_directory': temp_dir,
+             'output_name': name, 'batch_size': 2, 'warmup': True}
+            for name in ('a.tif', 'b.tif')]
+    tasks, results = queue.Queue(), queue.Queue()
+    for job in jobs + [None]:
+        tasks.put(job)
+
+    # the application is warmed up when it is built, before any job
+    dca.workers.run_worker(0, DummyApplication, [0], tasks, results,
+                           model_options={'directory': temp_dir},
+                           template=jobs[0])
+    assert calls == [2, 'a.tif', 'b.tif']
+
+    reports = [results.get() for _ in range(3)]
+    assert [r[0] for r in reports] == ['job', 'job', 'done']
+    assert all(r[3] is None for r in reports)
+
+
+def test_run_jobs_in_workers(tmpdir, mocker):
+    temp_dir = str(tmpdir)
+    # worker processes import the application by its path
+    mocker.patch.dict(dca.settings.VALID_APPLICATIONS['mesmer'], {
+        'class': 'deepcell_applications.workers_test.DummyApplication'})
+
+    jobs = []
+    for i in range(4):
+        nuclear_path = os.path.join(temp_dir, 'fov{}.tif'.format(i))
+        tifffile.imwrite(nuclear_path, np.zeros((10, 10)))
+        jobs.append({
+            'app': 'mesmer',
+            'nuclear_path': nuclear_path,
+            'output_directory': temp_dir,
+            'output_name': 'fov{}_mask.tif'.format(i),
+            'batch_size': 4,
+            'image_mpp': 0.5,
+            'compartment': 'whole-cell',
+            'squeeze': True,
+        })
+
+    stats = dca.workers.run_jobs_in_workers('mesmer', jobs, 2)
+    assert sum(s['jobs'] for s in stats) == len(jobs)
+    for s in stats:
+        assert s['cpus']
+        assert s['peak_rss_bytes'] is None or s['peak_rss_bytes'] > 0
+    for job in jobs:
+        output = tifffile.imread(dca.app_runners.get_output_path(job))
+        assert output.shape == (10, 10)
+
+    # errors in a worker are raised
+    jobs[0]['nuclear_path'] = os.path.join(temp_dir, 'missing.tif')
+    jobs[0]['output_name'] = 'missing_mask.tif'
+    with pytest.raises(RuntimeError):
+        dca.workers.run_jobs_in_workers('mesmer', jobs[:1], 2)
+
+
+def test_run_jobs_in_workers_exit(mocker):
+    mocker.patch.dict(dca.settings.VALID_APPLICATIONS['mesmer'], {
+        'class': 'deepcell_applications.workers_test.DummyApplication'})
+    mocker.patch('deepcell_applications.workers.get_available_cpus',
+                 return_value=[0])
+    mocker.patch('deepcell_applications.workers.EXIT_DRAIN_TIMEOUT', 0.1)
+
+    class ExitedProcess(object):
+
+        def __init__(self, exitcode):
+            self.exitcode = exitcode
+
+        def start(self):
+            pass
+
+        def is_alive(self):
+            return False
+
+        def join(self):
+            pass
+
+    class DelayedQueue(queue.Queue):
+        """Raises Empty on the first timed get, as if the message was late"""
+
+        def __init__(self):
+            super(DelayedQueue, self).__init__()
+            self.late = True
+
+        def get(self, block=True, timeout=None):
+            if self.late and timeout == 1:
+                self.late = False
+                raise queue.Empty
+            return super(DelayedQueue, self).get(block=block, timeout=timeout)
+
+    def run(exitcode, messages):
+        results = DelayedQueue()
+        for message in messages:
+            results.put(message)
+        context = mocker.Mock()
+        context.Queue.side_effect = [queue.Queue(), results]
+        context.Process.return_value = ExitedProcess(exitcode)
+        mocker.patch('multiprocessing.get_context', return_value=context)
+        return dca.workers.run_jobs_in_workers('mesmer', [{}], 1)
+
+    # a worker that exited right after its last message succeeded
+    stats = run(0, [('job', 0, 'a.tif', None, 1), ('done', 0, 1, None, 1)])
+    assert stats[0]['jobs'] == 1
+
+    # a worker that exited without finishing failed
+    with pytest.raises(RuntimeError, match='without finishing'):
+        run(0, [])
+
+    with pytest.raises(RuntimeError, match='exited with code 1'):
+        run(1, [('done', 0, 1, None, 1)])
@@ -25,11 +25,13 @@
 # ==============================================================================
 """Top level script to run Applications."""
 import logging
-import os
 import sys
 
 from deepcell_applications.argparse import get_arg_parser
 from deepcell_applications.app_runners import run_application
+from deepcell_applications.models import prefetch_model
+from deepcell_applications.settings import VALID_APPLICATIONS
+from deepcell_applications.server import serve, submit
 
 
 def initialize_logger(log_level):
@@ -52,9 +54,28 @@ if __name__ == '__main__':
     # get command line args
     ARGS = get_arg_parser().parse_args()
 
-    OUTFILE = os.path.join(ARGS.output_directory, ARGS.output_name)
-
     initialize_logger(log_level=ARGS.log_level)
 
-    # run application
-    run_application(dict(ARGS._get_kwargs()))
+    if ARGS.app == 'serve':
+        # keep applications warm and run jobs sent by other processes
+        serve(host=ARGS.host, port=ARGS.port, apps=ARGS.apps,
+              max_concurrency=ARGS.max_concurrency,
+              max_queue=ARGS.max_queue,
+              drain_timeout=ARGS.drain_timeout,
+              warmup_batch_size=ARGS.warmup_batch_size,
+              model_directory=ARGS.model_directory,
+              offline=ARGS.offline or None)
+
+    elif ARGS.app == 'prefetch':
+        # cache and verify models for offline use
+        for name in ARGS.apps or VALID_APPLICATIONS:
+            prefetch_model(name, directory=ARGS.model_directory,
+                           overwrite=ARGS.overwrite)
+
+    elif ARGS.server:
+        # forward the job to a running server
+        submit(ARGS.server, dict(ARGS._get_kwargs()))
+
+    else:
+        # run application
+        run_application(dict(ARGS._get_kwargs()))